@@ -31,5 +31,10 @@ fi
 # collect static files
 python manage.py collectstatic --noinput
 
-# start django development server
+# SERVER_MODE=asgi: multi-worker ASGI server for production,
+# otherwise the django development server
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn pampApp.asgi:application -c /app/gunicorn.conf.py
+fi
+
 python manage.py runserver 0.0.0.0:8000
@@ -38,6 +38,17 @@ export const getAllPosts = (params?: any): Promise<AxiosResponse<Post[]>> =>
 
 
 
+export interface PaginatedPosts {
+  count: number;
+  next: string | null;
+  previous: string | null;
+  results: Post[];
+}
+
+// Server-side full-text search, ranked by relevance
+export const searchPosts = (q: string, params?: any): Promise<AxiosResponse<PaginatedPosts>> =>
+  api.get('/posts/search/', { params: { q, ...params } });
+
 export const createPost = (data: FormData) => api.post('/posts/', data);
 export const updatePost = (id: number, data: FormData) => api.put(`/posts/${id}/`, data);
 export const deletePost = (id: number) => api.delete(`/posts/${id}/`);
@@ -0,0 +1,20 @@
+# gunicorn.conf.py
+# gunicorn -c gunicorn.conf.py pampApp.asgi:application
+# All values come from the ASGI_* settings in pampApp/settings.py.
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pampApp.settings')
+
+from django.conf import settings  # noqa: E402
+
+bind = settings.ASGI_BIND
+workers = settings.ASGI_WORKERS
+worker_class = settings.ASGI_WORKER_CLASS
+timeout = settings.ASGI_TIMEOUT
+graceful_timeout = settings.ASGI_GRACEFUL_TIMEOUT
+keepalive = settings.ASGI_KEEPALIVE
+max_requests = settings.ASGI_MAX_REQUESTS
+max_requests_jitter = settings.ASGI_MAX_REQUESTS_JITTER
+accesslog = '-'
+errorlog = '-'
+forwarded_allow_ips = '*'
@@ -121,13 +121,15 @@ SITE_ID = 1
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # Adds the profile_id claim read by pamp_app.authentication
+    'TOKEN_OBTAIN_SERIALIZER': 'pamp_app.serializers.ProfileTokenObtainPairSerializer',
 }
 
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'dj_rest_auth.jwt_auth.JWTCookieAuthentication',
+        'pamp_app.authentication.CachedJWTAuthentication',
+        'pamp_app.authentication.CachedJWTCookieAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -236,3 +238,97 @@ USE_TZ = True
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Cache settings
+# The feed version, post view buffer and cached JWT principals must be seen
+# by every web and worker process, so anything but a single dev process
+# needs a shared backend; docker-compose points CACHE_BACKEND/CACHE_LOCATION
+# at its redis service. `manage.py check --deploy` warns about local caches.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='pamp-app'),
+    }
+}
+
+# Post view counter (see pamp_app/view_counter.py); the job workers write
+# the buffered counts every POST_VIEWS_FLUSH_INTERVAL seconds.
+POST_VIEWS_FLUSH_INTERVAL = config('POST_VIEWS_FLUSH_INTERVAL', default=30, cast=int)
+POST_VIEWS_CACHE = 'default'
+
+# Shared feed cache (see pamp_app/feed_cache.py)
+FEED_CACHE = 'default'
+FEED_CACHE_TIMEOUT = config('FEED_CACHE_TIMEOUT', default=300, cast=int)
+
+# Chunked video uploads (see pamp_app/uploads.py). Keep the temp dir on the
+# same filesystem as MEDIA_ROOT so finished files are moved, not copied.
+VIDEO_UPLOAD_TEMP_DIR = config('VIDEO_UPLOAD_TEMP_DIR', default=os.path.join(MEDIA_ROOT, 'video_uploads_tmp'))
+VIDEO_UPLOAD_MAX_SIZE = config('VIDEO_UPLOAD_MAX_SIZE', default=2 * 1024 ** 3, cast=int)
+VIDEO_UPLOAD_MAX_CHUNK = config('VIDEO_UPLOAD_MAX_CHUNK', default=16 * 1024 ** 2, cast=int)
+
+# Image derivatives (see pamp_app/images.py). Widths are in pixels;
+# IMAGE_VARIANT_WORKERS = 0 renders inline instead of in a process pool.
+IMAGE_VARIANT_FORMAT = config('IMAGE_VARIANT_FORMAT', default='WEBP')
+IMAGE_VARIANT_QUALITY = config('IMAGE_VARIANT_QUALITY', default=80, cast=int)
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', default=2, cast=int)
+POST_IMAGE_SIZES = [320, 640, 1280]
+AVATAR_SIZES = [64, 128, 256]
+
+# Background jobs (see pamp_app/jobs.py). Times are in seconds.
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_BACKOFF_BASE = config('JOB_BACKOFF_BASE', default=5, cast=int)
+JOB_BACKOFF_MAX = config('JOB_BACKOFF_MAX', default=3600, cast=int)
+JOB_TIMEOUT = config('JOB_TIMEOUT', default=600, cast=int)
+JOB_POLL_INTERVAL = config('JOB_POLL_INTERVAL', default=1.0, cast=float)
+VIDEO_UPLOAD_EXPIRY = config('VIDEO_UPLOAD_EXPIRY', default=24 * 3600, cast=int)
+JOB_RETENTION = config('JOB_RETENTION', default=24 * 3600, cast=int)
+
+# Media is stored content-addressed and deduplicated (see pamp_app/storage.py)
+STORAGES = {
+    'default': {'BACKEND': 'pamp_app.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Production ASGI server (gunicorn with uvicorn workers, see gunicorn.conf.py).
+# Used by entrypoint.sh when SERVER_MODE=asgi; runserver stays the default.
+ASGI_BIND = config('ASGI_BIND', default='0.0.0.0:8000')
+ASGI_WORKERS = config('ASGI_WORKERS', default=(os.cpu_count() or 1) * 2 + 1, cast=int)
+ASGI_WORKER_CLASS = config('ASGI_WORKER_CLASS', default='uvicorn.workers.UvicornWorker')
+ASGI_TIMEOUT = config('ASGI_TIMEOUT', default=60, cast=int)
+ASGI_GRACEFUL_TIMEOUT = config('ASGI_GRACEFUL_TIMEOUT', default=30, cast=int)
+ASGI_KEEPALIVE = config('ASGI_KEEPALIVE', default=5, cast=int)
+# Recycle workers now and then so a slow leak cannot grow forever.
+ASGI_MAX_REQUESTS = config('ASGI_MAX_REQUESTS', default=10000, cast=int)
+ASGI_MAX_REQUESTS_JITTER = config('ASGI_MAX_REQUESTS_JITTER', default=1000, cast=int)
+
+# Bulk training session lookups for the reminder bot
+BULK_SESSIONS_MAX_IDS = config('BULK_SESSIONS_MAX_IDS', default=1000, cast=int)
+
+# Training session change feed for the reminder bot (see pamp_app/session_changes.py)
+SESSION_CHANGES_PAGE_SIZE = config('SESSION_CHANGES_PAGE_SIZE', default=500, cast=int)
+SESSION_CHANGES_RETENTION = config('SESSION_CHANGES_RETENTION', default=7 * 24 * 3600, cast=int)
+
+# Outbox pushed to the reminder bot (see pamp_app/outbox.py). With
+# OUTBOX_UDS set, events go over that Unix socket and the host in
+# OUTBOX_URL is ignored. OUTBOX_TOKEN is the secret shared with the bot;
+# dispatch_outbox does not start without it.
+OUTBOX_URL = config('OUTBOX_URL', default='http://bot:8081/events')
+OUTBOX_UDS = config('OUTBOX_UDS', default='')
+OUTBOX_TOKEN = config('OUTBOX_TOKEN', default='')
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=100, cast=int)
+OUTBOX_TIMEOUT = config('OUTBOX_TIMEOUT', default=10.0, cast=float)
+OUTBOX_CLAIM_TIMEOUT = config('OUTBOX_CLAIM_TIMEOUT', default=60, cast=int)
+OUTBOX_POLL_INTERVAL = config('OUTBOX_POLL_INTERVAL', default=5.0, cast=float)
+OUTBOX_RETENTION = config('OUTBOX_RETENTION', default=7 * 24 * 3600, cast=int)
+OCCURRENCES_MAX_DAYS = config('OCCURRENCES_MAX_DAYS', default=366, cast=int)
+
+# iCalendar feeds (see pamp_app/ical.py). Session dates and times are wall
+# clock times in CALENDAR_TIMEZONE, the same zone the reminder bot uses.
+CALENDAR_TIMEZONE = config('CALENDAR_TIMEZONE', default='Europe/Lisbon')
+CALENDAR_EVENT_MINUTES = config('CALENDAR_EVENT_MINUTES', default=60, cast=int)
+
+# Cached JWT principals (see pamp_app/authentication.py). With a per-process
+# cache, deactivations and password changes only reach other workers within
+# AUTH_CACHE_TTL, so production shares it like the other caches.
+AUTH_CACHE = 'default'
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=60, cast=int)
@@ -41,6 +41,7 @@ router = DefaultRouter()
 router.register(r'profiles', views.ProfileViewSet, basename='profile')
 router.register(r'posts', views.PostViewSet,basename='posts')
 router.register(r'training-sessions', views.TrainingSessionViewSet, basename='training-session')
+router.register(r'video-uploads', views.VideoUploadViewSet, basename='video-upload')
 
 urlpatterns = [
     #admin
@@ -49,7 +50,8 @@ urlpatterns = [
     #api
     path('api/', include(router.urls)),
     path('api/user-profile/', views.user_profile, name='user-profile'),
-    path('api/user-posts/', views.user_posts, name='user-posts'),
+    path('api/user-posts/', views.UserPostsView.as_view(), name='user-posts'),
+    path('api/feed-cache/stats/', views.feed_cache_stats, name='feed-cache-stats'),
     path('api/register/', views.register, name='register'),
     path('api/login/', views.login_view, name='login'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -79,6 +81,11 @@ urlpatterns = [
     path('api/link-telegram/confirm/', LinkTelegramConfirmView.as_view(), name='link-telegram-confirm'),
     #path('api/training-sessions/', UserTrainingSessionsView.as_view(), name='training-sessions'),
     path('api/user-training-sessions/', UserTrainingSessionsView.as_view(), name='user-training-sessions'),
+    path('api/user-training-sessions/bulk/', views.BulkTrainingSessionsView.as_view(), name='user-training-sessions-bulk'),
+    path('api/user-training-sessions/changes/', views.TrainingSessionChangesView.as_view(), name='user-training-sessions-changes'),
+    path('api/user-training-sessions/occurrences/', views.TrainingSessionOccurrencesView.as_view(), name='user-training-sessions-occurrences'),
+    path('api/calendar/', views.CalendarFeedView.as_view(), name='calendar-feed'),
+    path('api/calendar/<str:token>.ics', views.CalendarFeedIcsView.as_view(), name='calendar-feed-ics'),
     #path('', views.index, name='index'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
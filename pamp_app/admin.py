@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Post
+from .models import Profile, Post, Job, MediaBlob, OutboxEvent
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
@@ -19,3 +19,28 @@ class PostAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     ordering = ['-created_at']
     show_facets = admin.ShowFacets.ALWAYS
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'priority', 'attempts', 'run_at', 'updated_at']
+    list_filter = ['status', 'task']
+    search_fields = ['task', 'last_error']
+    date_hierarchy = 'created_at'
+    ordering = ['-created_at']
+    show_facets = admin.ShowFacets.ALWAYS
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'refcount', 'created_at']
+    search_fields = ['digest', 'name']
+    ordering = ['-created_at']
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['topic', 'created_at', 'dispatched_at']
+    list_filter = ['topic']
+    date_hierarchy = 'created_at'
+    ordering = ['-id']
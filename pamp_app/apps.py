@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PampAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pamp_app'
+
+    def ready(self):
+        # Connect the feed cache invalidation, media release, session change,
+        # outbox and auth cache receivers, register the background tasks and
+        # the shared cache check.
+        from . import authentication, checks, feed_cache, outbox, session_changes, storage, tasks  # noqa: F401
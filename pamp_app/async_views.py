@@ -0,0 +1,42 @@
+# pamp_app/async_views.py
+import inspect
+
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """
+    An APIView whose handlers are coroutines. Under ASGI the request stays
+    on the event loop while its queries run, instead of holding a worker
+    thread for the whole request.
+
+    Authentication, permission and throttle checks are DRF's regular sync
+    code and run in a thread; handlers must only use the async ORM
+    (`aget`, `afirst`, `async for`, ...) or pre-fetched objects.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
@@ -1,4 +1,17 @@
+from dj_rest_auth.jwt_auth import JWTCookieAuthentication
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from pamp_app.models import Profile
 
 class EmailAuthBackend:
@@ -26,3 +39,96 @@ class EmailAuthBackend:
 def create_profile(backend, user, *args, **kwargs):
     #Create user profile for social authentication
     Profile.objects.get_or_create(user=user)
+
+
+# Cached JWT principals
+#
+# JWTAuthentication loads the User on every request, and nearly every view
+# then loads request.user.profile. The classes below cache the user with
+# its profile attached, per token subject, for AUTH_CACHE_TTL seconds, so
+# an authenticated read costs no auth queries at all. Writes always load
+# the principal fresh (and refresh the cache), so a view never saves a
+# stale profile. Saving or deleting a User or Profile drops its entry, for
+# every worker as long as AUTH_CACHE is shared (see pamp_app/checks.py).
+# Profile views still read the profile itself fresh: edits made with
+# queryset.update() (avatar variants, say) do not drop the entry.
+
+PROFILE_ID_CLAIM = 'profile_id'
+
+
+def principal_key(user_id):
+    return f'auth:principal:{user_id}'
+
+
+def add_profile_claim(token, user):
+    """Carry the user's profile id in `token`, so a cache miss can start from it."""
+    profile_id = Profile.objects.filter(user=user).values_list('id', flat=True).first()
+    if profile_id is not None:
+        token[PROFILE_ID_CLAIM] = profile_id
+    return token
+
+
+def tokens_for_user(user):
+    """A refresh token for `user` with the profile claim; its access_token has it too."""
+    return add_profile_claim(RefreshToken.for_user(user), user)
+
+
+def load_principal(user_id, profile_id=None):
+    """The user with user.profile already populated, in one query."""
+    if profile_id is not None:
+        profile = Profile.objects.select_related('user').filter(pk=profile_id, user_id=user_id).first()
+        if profile is not None:
+            return profile.user
+    return User.objects.select_related('profile').filter(pk=user_id).first()
+
+
+class CachedPrincipalMixin:
+    def authenticate(self, request):
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cache = caches[settings.AUTH_CACHE]
+        user = cache.get(principal_key(user_id)) if getattr(self, 'use_cache', True) else None
+        if user is None:
+            user = load_principal(user_id, validated_token.get(PROFILE_ID_CLAIM))
+            if user is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(principal_key(user_id), user, settings.AUTH_CACHE_TTL)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if jwt_settings.CHECK_REVOKE_TOKEN and (
+                validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+class CachedJWTAuthentication(CachedPrincipalMixin, JWTAuthentication):
+    pass
+
+
+class CachedJWTCookieAuthentication(CachedPrincipalMixin, JWTCookieAuthentication):
+    pass
+
+
+def forget_principal(user_id):
+    cache = caches[settings.AUTH_CACHE]
+    cache.delete(principal_key(user_id))
+    # A request between now and the commit may cache the old row again.
+    transaction.on_commit(lambda: cache.delete(principal_key(user_id)))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_principal(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    forget_principal(instance.user_id)
@@ -0,0 +1,30 @@
+# pamp_app/checks.py
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends whose entries live inside one process.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    The feed version, the post view buffer and cached principals are
+    invalidated or drained by other processes than the one that wrote
+    them, which only works through a cache they all share.
+    """
+    errors = []
+    for setting in ('FEED_CACHE', 'POST_VIEWS_CACHE', 'AUTH_CACHE'):
+        alias = getattr(settings, setting)
+        backend = settings.CACHES[alias]['BACKEND']
+        if backend in LOCAL_CACHE_BACKENDS:
+            errors.append(Warning(
+                f"{setting} uses the process-local cache {alias!r} ({backend}).",
+                hint="Set CACHE_BACKEND/CACHE_LOCATION to a cache shared by every web and worker "
+                     "process, e.g. django.core.cache.backends.redis.RedisCache.",
+                id='pamp_app.W001',
+            ))
+    return errors
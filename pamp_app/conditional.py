@@ -0,0 +1,42 @@
+# pamp_app/conditional.py
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Build a strong ETag from anything that identifies a representation."""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """
+    Return a 304 response if the request's If-None-Match / If-Modified-Since
+    headers match, otherwise None. Call it before serializing anything.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Representations are per user: let caches store them, but only
+    # privately and always revalidate.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization', 'Cookie'])
+    return response
+
+
+def conditional_get(request, build, etag=None, last_modified=None):
+    """Serve `build()` only when the client's cached copy is stale."""
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = build()
+    return set_validators(response, etag, last_modified)
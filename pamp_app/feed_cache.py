@@ -0,0 +1,108 @@
+# pamp_app/feed_cache.py
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Post, PostImage, PostVideo, Profile
+
+VERSION_KEY = 'feed:version'
+HITS_KEY = 'feed:hits'
+MISSES_KEY = 'feed:misses'
+MODIFIED_KEY = 'feed:modified'
+
+
+def _cache():
+    return caches[settings.FEED_CACHE]
+
+
+def _incr(key, initial=1):
+    cache = _cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key missing or evicted: start over. add() keeps concurrent
+        # initialisations from clobbering each other.
+        if not cache.add(key, initial, timeout=None):
+            return cache.incr(key)
+        return initial
+
+
+def _initial_version():
+    # Versions end up in clients' ETags, so a flushed cache must not count
+    # from 1 again and hand out numbers that already named other content.
+    return int(time.time() * 1000)
+
+
+def get_version():
+    version = _cache().get(VERSION_KEY)
+    if version is None:
+        _cache().add(VERSION_KEY, _initial_version(), timeout=None)
+        version = _cache().get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    _cache().set(MODIFIED_KEY, timezone.now(), timeout=None)
+    return _incr(VERSION_KEY, _initial_version())
+
+
+def last_modified():
+    """When the feed last changed, as far as this cache knows."""
+    modified = _cache().get(MODIFIED_KEY)
+    if modified is None:
+        _cache().add(MODIFIED_KEY, timezone.now(), timeout=None)
+        modified = _cache().get(MODIFIED_KEY)
+    return modified
+
+
+def page_key(request, version, cursor=None, page_size=None, shape=()):
+    # Media URLs are absolute, so the host is part of the key; `shape`
+    # tells sparse / compact representations apart.
+    shape = hashlib.md5(','.join(part or '' for part in shape).encode()).hexdigest()
+    return 'feed:v{}:{}:{}:{}:{}:{}'.format(
+        version, request.scheme, request.get_host(), cursor or '-', page_size or 'all', shape,
+    )
+
+
+def get_page(key):
+    page = _cache().get(key)
+    _incr(HITS_KEY if page is not None else MISSES_KEY)
+    return page
+
+
+def set_page(key, page):
+    _cache().set(key, page, timeout=settings.FEED_CACHE_TIMEOUT)
+
+
+def exclude_profile(posts, profile_id):
+    """
+    Drop one author's posts from a cached page of (profile_id, cursor, data)
+    items, leaving (cursor, data) pairs.
+    """
+    return [(cursor, data) for author_id, cursor, data in posts if author_id != profile_id]
+
+
+def stats():
+    cache = _cache()
+    return {
+        'version': get_version(),
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=PostImage)
+@receiver([post_save, post_delete], sender=PostVideo)
+@receiver(post_save, sender=Profile)
+def invalidate_feed(sender, **kwargs):
+    # Bump after commit so a concurrent reader cannot cache the old rows
+    # under the new version. Old pages are never read again once the
+    # version moves on and simply expire after FEED_CACHE_TIMEOUT.
+    transaction.on_commit(bump_version)
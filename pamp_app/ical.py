@@ -0,0 +1,185 @@
+# pamp_app/ical.py
+"""
+iCalendar (RFC 5545) rendering of a user's training sessions.
+
+Each session is one VEVENT. Weekly sessions carry an RRULE instead of
+being expanded, so a feed stays small however far calendar apps look
+ahead; their DTSTART is the first day the rule matches. Times are wall
+clock times in CALENDAR_TIMEZONE, described by a VTIMEZONE built from
+the zone's current daylight saving rules. `feed_etag()` fingerprints the feed inside Postgres (one
+aggregate row), so a client polling an unchanged calendar gets a 304
+without any session being loaded or rendered.
+"""
+import calendar
+import secrets
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import CharField, Count, Value
+from django.db.models.functions import MD5, Cast, Concat
+from django.utils import timezone as django_timezone
+
+from . import recurrence
+from .conditional import make_etag
+from .models import TrainingSession
+
+BYDAY = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+PRODID = '-//pampApp//Training sessions//RU'
+SUMMARY = 'Тренировка'
+
+
+def new_token():
+    return secrets.token_urlsafe(32)
+
+
+def user_sessions(profile):
+    return TrainingSession.objects.filter(profile=profile)
+
+
+async def feed_etag(profile):
+    fingerprint = await user_sessions(profile).aaggregate(
+        count=Count('id'),
+        digest=MD5(StringAgg(
+            Concat(Cast('id', CharField()), Value(':'), Cast('updated_at', CharField())),
+            delimiter=',',
+            ordering='id',
+        )),
+    )
+    # The token is part of the tag, so rotating it invalidates old copies.
+    return make_etag(
+        'ical', profile.calendar_token, fingerprint['count'], fingerprint['digest'],
+        settings.CALENDAR_TIMEZONE, settings.CALENDAR_EVENT_MINUTES,
+    )
+
+
+def fold(line):
+    """Split a content line into 75-octet pieces, as RFC 5545 requires."""
+    data = line.encode()
+    parts, start, limit = [], 0, 75
+    while len(data) - start > limit:
+        end = start + limit
+        # Never cut a UTF-8 sequence in half.
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode())
+        start, limit = end, 74
+    parts.append(data[start:].decode())
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def stamp(value):
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def utc_offset(delta):
+    minutes = int(delta.total_seconds()) // 60
+    sign = '-' if minutes < 0 else '+'
+    return '{}{:02d}{:02d}'.format(sign, *divmod(abs(minutes), 60))
+
+
+def nth_weekday(year, month, weekday, nth):
+    """The `nth` (-1 = last) `weekday` of a month."""
+    days = [
+        day for day in range(1, calendar.monthrange(year, month)[1] + 1)
+        if date(year, month, day).weekday() == weekday
+    ]
+    return date(year, month, days[nth - 1 if nth > 0 else nth])
+
+
+def transitions(zone, year):
+    """(UTC moment, offset before) of each offset change of `zone` in `year`."""
+    found = []
+    moment = datetime(year, 1, 1, tzinfo=timezone.utc)
+    end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    while moment < end:
+        before = moment.astimezone(zone).utcoffset()
+        if (moment + timedelta(days=1)).astimezone(zone).utcoffset() != before:
+            # Find the change to the quarter hour; some zones switch at :30.
+            change = moment
+            while change.astimezone(zone).utcoffset() == before:
+                change += timedelta(minutes=15)
+            found.append((change, before))
+        moment += timedelta(days=1)
+    return found
+
+
+@lru_cache
+def vtimezone(tzid, year):
+    """
+    VTIMEZONE lines for `tzid`, with the daylight saving rules in force in
+    `year` repeated yearly from 1970.
+    """
+    zone = ZoneInfo(tzid)
+    lines = ['BEGIN:VTIMEZONE', f'TZID:{tzid}']
+    changes = transitions(zone, year)
+    for change, before in changes:
+        local = change.astimezone(zone)
+        onset = (change + before).replace(tzinfo=None)
+        last_day = calendar.monthrange(year, onset.month)[1]
+        nth = -1 if onset.day + 7 > last_day else (onset.day - 1) // 7 + 1
+        first = nth_weekday(1970, onset.month, onset.weekday(), nth)
+        kind = 'DAYLIGHT' if local.dst() else 'STANDARD'
+        lines += [
+            f'BEGIN:{kind}',
+            f'DTSTART:{datetime.combine(first, onset.time()):%Y%m%dT%H%M%S}',
+            f'TZOFFSETFROM:{utc_offset(before)}',
+            f'TZOFFSETTO:{utc_offset(local.utcoffset())}',
+            f'TZNAME:{local.tzname()}',
+            f'RRULE:FREQ=YEARLY;BYMONTH={onset.month};BYDAY={nth}{BYDAY[onset.weekday()]}',
+            f'END:{kind}',
+        ]
+    if not changes:
+        local = datetime(year, 1, 1, tzinfo=timezone.utc).astimezone(zone)
+        lines += [
+            'BEGIN:STANDARD',
+            'DTSTART:19700101T000000',
+            f'TZOFFSETFROM:{utc_offset(local.utcoffset())}',
+            f'TZOFFSETTO:{utc_offset(local.utcoffset())}',
+            f'TZNAME:{local.tzname()}',
+            'END:STANDARD',
+        ]
+    lines.append('END:VTIMEZONE')
+    return ''.join(fold(line) for line in lines)
+
+
+def render_event(session, host):
+    tzid = settings.CALENDAR_TIMEZONE
+    rule = recurrence.rule_for(session)
+    first = session.date
+    if rule.mask:
+        # RFC 5545 counts DTSTART as an occurrence even if BYDAY skips it.
+        first = date.fromordinal(recurrence.expand(rule, first, first + timedelta(days=6))[0])
+    start = datetime.combine(first, session.time)
+    end = start + timedelta(minutes=settings.CALENDAR_EVENT_MINUTES)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:session-{session.id}@{host}',
+        f'DTSTAMP:{stamp(session.updated_at)}',
+        f'DTSTART;TZID={tzid}:{start:%Y%m%dT%H%M%S}',
+        f'DTEND;TZID={tzid}:{end:%Y%m%dT%H%M%S}',
+        f'SUMMARY:{SUMMARY}',
+    ]
+    if rule.mask:
+        days = ','.join(BYDAY[day] for day in recurrence.weekdays(rule.mask))
+        lines.append(f'RRULE:FREQ=WEEKLY;BYDAY={days}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+async def render_feed(profile, host):
+    """Yield the calendar piece by piece, reading sessions in chunks."""
+    yield ''.join(fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{SUMMARY}',
+        f'X-WR-TIMEZONE:{settings.CALENDAR_TIMEZONE}',
+    ])
+    yield vtimezone(settings.CALENDAR_TIMEZONE, django_timezone.now().year)
+    async for session in user_sessions(profile).order_by('date', 'time', 'id').aiterator(chunk_size=500):
+        yield render_event(session, host)
+    yield fold('END:VCALENDAR')
@@ -0,0 +1,87 @@
+# pamp_app/images.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def render_variants(media_root, name, sizes, fmt, quality):
+    """
+    Write width-bounded copies of MEDIA_ROOT/name next to the original and
+    return {str(width): name}. Runs in a worker process, so it only deals
+    with paths and Pillow. Widths at or above the original are skipped.
+    """
+    stem = os.path.splitext(name)[0]
+    variants = {}
+    with Image.open(os.path.join(media_root, name)) as original:
+        image = ImageOps.exif_transpose(original)
+        if fmt == 'JPEG':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+
+        for width in sorted(sizes):
+            if width >= image.width:
+                break
+            height = max(1, round(image.height * width / image.width))
+            variant_name = f'{stem}.{width}w.{EXTENSIONS[fmt]}'
+            variants[str(width)] = variant_name
+            if os.path.exists(os.path.join(media_root, variant_name)):
+                # Shared blob, already rendered for another row.
+                continue
+            image.resize((width, height), Image.LANCZOS).save(
+                os.path.join(media_root, variant_name), fmt, quality=quality)
+    return variants
+
+
+def get_pool():
+    global _pool
+    # Worker threads render concurrently; only one of them may start the pool.
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the web process has threads and open DB sockets.
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, settings.IMAGE_VARIANT_WORKERS),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _pool
+
+
+def store_variants(model, pk, variants_field, variants, **match):
+    """
+    Save rendered variants. `match` (e.g. avatar=name) skips the write if
+    the source file was replaced while it was being rendered.
+    """
+    from .feed_cache import bump_version
+
+    if model.objects.filter(pk=pk, **match).update(**{variants_field: variants}):
+        bump_version()
+
+
+def generate_variants(instances, file_field, variants_field, sizes):
+    """
+    Queue rendering of variants for `<file_field>` into `<variants_field>`
+    of every instance that has a file, with one INSERT for all of them;
+    see pamp_app.tasks.render_image_variants.
+    """
+    from .jobs import enqueue_many, make_job
+
+    jobs = [
+        make_job(
+            'pamp_app.tasks.render_image_variants',
+            instance._meta.label, instance.pk, file_field, variants_field, sizes,
+            priority=5,
+        )
+        for instance in instances
+        if getattr(instance, file_field).name
+    ]
+    if jobs:
+        enqueue_many(jobs)
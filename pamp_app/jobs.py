@@ -0,0 +1,210 @@
+# pamp_app/jobs.py
+"""
+A small job queue stored in Postgres, so slow side effects can leave the
+request thread without an external broker.
+
+    @task(priority=5)
+    def delete_files(names): ...
+
+    delete_files.enqueue(['a.jpg'])   # inserts a Job row in the current transaction
+
+`manage.py run_workers --concurrency N` runs the workers.
+"""
+import logging
+import random
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+periodic = {}
+
+
+def make_job(task_name, *args, priority=0, run_at=None, max_attempts=None, **kwargs):
+    """An unsaved Job running `task_name(*args, **kwargs)`, for enqueue_many()."""
+    return Job(
+        task=task_name,
+        args=list(args),
+        kwargs=kwargs,
+        priority=priority,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def enqueue(task_name, *args, priority=0, run_at=None, max_attempts=None, **kwargs):
+    """
+    Queue `task_name(*args, **kwargs)`. The row is inserted in the current
+    transaction, so the job only becomes visible if the caller commits.
+    """
+    job = make_job(task_name, *args, priority=priority, run_at=run_at, max_attempts=max_attempts, **kwargs)
+    job.save()
+    return job
+
+
+def enqueue_many(jobs):
+    """Queue several make_job() jobs with a single INSERT."""
+    return Job.objects.bulk_create(jobs)
+
+
+def task(name=None, priority=0, max_attempts=None, every=None):
+    """
+    Register a function as a task and give it an `enqueue` helper.
+    `every` (a timedelta) makes it periodic: workers keep one run queued.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        registry[task_name] = func
+        if every is not None:
+            periodic[task_name] = every
+
+        def enqueue_task(*args, **kwargs):
+            kwargs.setdefault('priority', priority)
+            kwargs.setdefault('max_attempts', max_attempts)
+            return enqueue(task_name, *args, **kwargs)
+
+        func.task_name = task_name
+        func.enqueue = enqueue_task
+        return func
+    return decorator
+
+
+def backoff(attempts):
+    """Exponential backoff with full jitter, capped at JOB_BACKOFF_MAX."""
+    ceiling = min(settings.JOB_BACKOFF_MAX, settings.JOB_BACKOFF_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(0, ceiling))
+
+
+def claim():
+    """Lock the next ready job, mark it running and return it (or None)."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.STATUS_QUEUED, run_at__lte=now)
+            .order_by('-priority', 'run_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.STATUS_RUNNING
+        job.attempts += 1
+        job.locked_at = now
+        job.save(update_fields=['status', 'attempts', 'locked_at', 'updated_at'])
+    return job
+
+
+def execute(job):
+    func = registry.get(job.task)
+    try:
+        if func is None:
+            raise LookupError(f'Unknown task {job.task!r}')
+        func(*job.args, **job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.STATUS_QUEUED
+            job.run_at = timezone.now() + backoff(job.attempts)
+            logger.warning("Job %s failed (attempt %d), retrying at %s", job, job.attempts, job.run_at)
+        else:
+            job.status = Job.STATUS_FAILED
+            logger.error("Job %s failed for good after %d attempts", job, job.attempts)
+    else:
+        job.status = Job.STATUS_DONE
+    job.locked_at = None
+    job.save(update_fields=['status', 'run_at', 'last_error', 'locked_at', 'updated_at'])
+
+    if job.status in (Job.STATUS_DONE, Job.STATUS_FAILED) and job.task in periodic:
+        enqueue(job.task, run_at=timezone.now() + periodic[job.task], priority=job.priority)
+
+
+@contextmanager
+def heartbeat(job, interval=None):
+    """
+    Keep refreshing `job.locked_at` while it runs, so requeue_stale() only
+    picks up jobs whose worker is gone, not ones that are merely slow.
+    """
+    interval = interval or settings.JOB_TIMEOUT / 3
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING).update(locked_at=timezone.now())
+        except Exception:
+            logger.exception("Heartbeat of job %s failed", job)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True, name=f'job-{job.pk}-heartbeat')
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def requeue_stale():
+    """
+    Give jobs back whose worker died mid-run (locked for too long). A job
+    that has used up its attempts is failed instead: it may well be what
+    killed the worker, and running it again would only do that again.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.STATUS_FAILED, locked_at=None, last_error='Timed out: the worker died or the job ran too long.',
+    )
+    if failed:
+        logger.error("Failed %d jobs that timed out on their last attempt", failed)
+    return stale.update(status=Job.STATUS_QUEUED, locked_at=None, run_at=now)
+
+
+def schedule_periodic():
+    for task_name in periodic:
+        pending = Job.objects.filter(
+            task=task_name, status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING]
+        )
+        if not pending.exists():
+            enqueue(task_name)
+
+
+def run_pending():
+    """Run ready jobs in the current thread until none are left."""
+    count = 0
+    while (job := claim()) is not None:
+        execute(job)
+        count += 1
+    return count
+
+
+class Worker(threading.Thread):
+    def __init__(self, stop_event, poll_interval, **kwargs):
+        super().__init__(daemon=True, **kwargs)
+        self.stop_event = stop_event
+        self.poll_interval = poll_interval
+
+    def run(self):
+        while not self.stop_event.is_set():
+            close_old_connections()
+            try:
+                job = claim()
+                if job is not None:
+                    with heartbeat(job):
+                        execute(job)
+                    continue
+            except Exception:
+                logger.exception("Worker %s crashed while handling a job", self.name)
+            self.stop_event.wait(self.poll_interval)
+        close_old_connections()
@@ -0,0 +1,49 @@
+import random
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pamp_app.outbox import drain, get_client, listen, wait_for_events
+
+
+class Command(BaseCommand):
+    help = 'Push outbox events to the reminder bot until SIGINT / SIGTERM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+            help='Seconds to wait for a NOTIFY before checking the outbox anyway.',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.OUTBOX_TOKEN:
+            raise CommandError('OUTBOX_TOKEN is not set; the bot refuses events without it.')
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        failures = 0
+        listening = False
+        with get_client() as client:
+            self.stdout.write(self.style.SUCCESS(f'Dispatching outbox events to {settings.OUTBOX_URL}.'))
+            while not stop.is_set():
+                try:
+                    if not listening:
+                        listen()
+                        listening = True
+                    sent = drain(client)
+                    if sent:
+                        self.stdout.write(f'Dispatched {sent} events.')
+                    failures = 0
+                    wait_for_events(options['poll_interval'])
+                except Exception as exc:
+                    # Bot down or database gone: the events stay pending.
+                    failures += 1
+                    delay = random.uniform(0, min(60, 2 ** failures))
+                    self.stderr.write(f'Outbox dispatch failed ({exc}), retrying in {delay:.1f}s')
+                    connection.close()
+                    listening = False
+                    stop.wait(delay)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from pamp_app.view_counter import post_views
+
+
+class Command(BaseCommand):
+    help = 'Write buffered post view counts to the database (run on shutdown).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--wait', type=float, default=10.0,
+            help='Seconds to wait for a concurrent flush to release the buffer.',
+        )
+
+    def handle(self, *args, **options):
+        flushed = post_views.flush(wait=options['wait'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} post views.'))
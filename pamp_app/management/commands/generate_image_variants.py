@@ -0,0 +1,39 @@
+from concurrent.futures import as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pamp_app.images import get_pool, render_variants, store_variants
+from pamp_app.models import PostImage, Profile
+
+
+class Command(BaseCommand):
+    help = 'Render missing resized variants for existing post images and avatars.'
+
+    def handle(self, *args, **options):
+        jobs = [
+            (PostImage, 'image', 'variants', settings.POST_IMAGE_SIZES,
+             PostImage.objects.exclude(image='').exclude(image__isnull=True).filter(variants={})),
+            (Profile, 'avatar', 'avatar_variants', settings.AVATAR_SIZES,
+             Profile.objects.exclude(avatar='').exclude(avatar__isnull=True).filter(avatar_variants={})),
+        ]
+        pool = get_pool()
+        for model, file_field, variants_field, sizes, queryset in jobs:
+            futures = {
+                pool.submit(
+                    render_variants, settings.MEDIA_ROOT, name, sizes,
+                    settings.IMAGE_VARIANT_FORMAT, settings.IMAGE_VARIANT_QUALITY,
+                ): (pk, name)
+                for pk, name in queryset.values_list('pk', file_field).iterator()
+            }
+            done = 0
+            for future in as_completed(futures):
+                pk, name = futures[future]
+                try:
+                    # Skipped if the file was replaced while it was rendered.
+                    store_variants(model, pk, variants_field, future.result(), **{file_field: name})
+                except OSError as e:
+                    self.stderr.write(f'{model.__name__} {pk}: {e}')
+                    continue
+                done += 1
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: rendered variants for {done} files.'))
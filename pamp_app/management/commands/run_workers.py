@@ -0,0 +1,42 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pamp_app.jobs import Worker, requeue_stale, schedule_periodic
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers until SIGINT / SIGTERM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of worker threads.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL,
+            help='Seconds an idle worker waits before polling again.',
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        workers = [
+            Worker(stop, options['poll_interval'], name=f'worker-{i}')
+            for i in range(options['concurrency'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(self.style.SUCCESS(f'Started {len(workers)} workers.'))
+
+        # Housekeeping: recover jobs of crashed workers, keep periodic tasks queued.
+        while True:
+            requeue_stale()
+            schedule_periodic()
+            if stop.wait(60):
+                break
+
+        self.stdout.write('Stopping workers, waiting for running jobs...')
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pamp_app', '0005_alter_telegramlink_linking_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['profile', '-created_at', '-id'], name='post_profile_created_id_idx'),
+        ),
+    ]
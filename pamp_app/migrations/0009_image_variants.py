@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pamp_app', '0008_videoupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
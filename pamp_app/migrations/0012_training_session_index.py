@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pamp_app', '0011_mediablob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trainingsession',
+            index=models.Index(fields=['profile', 'date', 'time'], name='session_profile_date_idx'),
+        ),
+    ]
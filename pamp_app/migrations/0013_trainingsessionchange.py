@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pamp_app', '0012_training_session_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingSessionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txid', models.BigIntegerField(db_default=models.Func(function='txid_current', output_field=models.BigIntegerField()))),
+                ('session_id', models.BigIntegerField()),
+                ('op', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['txid', 'id'], name='session_change_cursor_idx'), models.Index(fields=['created_at'], name='session_change_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pamp_app', '0014_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='calendar_token',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='trainingsession',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
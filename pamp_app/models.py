@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.conf import settings
 from django.contrib.auth.models import User
+import os
 import uuid
 from django.utils import timezone
 from datetime import timedelta
@@ -17,15 +20,36 @@ class Profile(models.Model):
         blank=True,
         upload_to='user_avatars/%Y/%m/%d/',
     )
+    # {"<width>": "<storage name>"}, filled in by pamp_app.images
+    avatar_variants = models.JSONField(default=dict, blank=True)
+    # Secret of the user's iCalendar feed URL (see pamp_app/ical.py).
+    calendar_token = models.CharField(max_length=64, unique=True, null=True, blank=True)
 
     def __str__(self):
         return f'Profile of {self.user.username}'
 
 
+class MediaBlob(models.Model):
+    """
+    One stored file of the content-addressed media storage, shared by every
+    PostImage, PostVideo and Profile.avatar with the same bytes.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} refs)'
+
+
 class PostImage(models.Model):
     post = models.ForeignKey('Post', related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='post_images/%Y/%m/%d/', null=True, blank=True)
     image_url = models.URLField(max_length=500, null=True, blank=True)
+    # {"<width>": "<storage name>"}, filled in by pamp_app.images
+    variants = models.JSONField(default=dict, blank=True)
 
 
 
@@ -36,6 +60,29 @@ class PostVideo(models.Model):
 
 
 
+class PostQuerySet(models.QuerySet):
+    def with_related(self, profile=True, images=True, videos=True):
+        """
+        Load everything PostSerializer renders in a fixed number of queries.
+        Relations that will not be rendered can be switched off.
+        """
+        queryset = self.defer('search_vector')
+        if profile:
+            queryset = queryset.select_related('profile__user')
+        prefetch = [name for name, wanted in (('images', images), ('videos', videos)) if wanted]
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def with_thumbnail(self):
+        """Annotate the first image of each post without loading the rest."""
+        first = PostImage.objects.filter(post=models.OuterRef('pk')).order_by('id')
+        return self.annotate(
+            thumbnail_image=models.Subquery(first.values('image')[:1]),
+            thumbnail_url=models.Subquery(first.values('image_url')[:1]),
+        )
+
+
 class Post(models.Model):
     title = models.CharField(max_length=200)
     training_type = models.CharField(max_length=100)
@@ -44,29 +91,205 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     profile = models.ForeignKey('Profile', on_delete=models.CASCADE)
+    # Computed by Postgres on every INSERT/UPDATE, so it can never go stale.
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', weight='A', config='english')
+            + SearchVector('training_type', weight='B', config='english')
+            + SearchVector('description', weight='C', config='english')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the feed, see PostKeysetPagination.
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            # Same ordering scoped to a single author (mine / user_posts).
+            models.Index(fields=['profile', '-created_at', '-id'], name='post_profile_created_id_idx'),
+            GinIndex(fields=['search_vector'], name='post_search_vector_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
 
+class VideoUpload(models.Model):
+    """
+    A resumable, chunked upload of a PostVideo file.
+
+    Chunks are written straight into `temp_path`; `received` is the length
+    of the contiguous prefix stored so far, which is where a client resumes.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETE = 'complete'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    profile = models.ForeignKey('Profile', on_delete=models.CASCADE, related_name='video_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(
+        max_length=20,
+        choices=[(STATUS_PENDING, 'Pending'), (STATUS_COMPLETE, 'Complete')],
+        default=STATUS_PENDING,
+    )
+    video = models.ForeignKey('PostVideo', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.VIDEO_UPLOAD_TEMP_DIR, f'{self.id}.part')
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
+
+
+
 class TrainingSession(models.Model):
     profile = models.ForeignKey('Profile', on_delete=models.CASCADE, related_name='training_sessions')
     date = models.DateField()
     time = models.TimeField()
     recurrence = models.CharField(max_length=20, choices=[('once', 'Once'), ('weekly', 'Weekly')], default='once')
     days_of_week = models.CharField(max_length=100, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Upcoming sessions per user, in order (bulk lookups for the bot).
+            models.Index(fields=['profile', 'date', 'time'], name='session_profile_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The change feed and outbox rows written by post_save receivers
+        # must commit or roll back together with the session itself.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.profile.user.username} - {self.date} at {self.time}'
 
 
 
+class TrainingSessionChange(models.Model):
+    """
+    One row per TrainingSession save or delete, read by the bot through
+    the change feed (see pamp_app/session_changes.py). `txid` is the
+    writing transaction's id and, with `id`, forms the feed cursor.
+    """
+    OP_UPSERT = 'upsert'
+    OP_DELETE = 'delete'
+    OP_CHOICES = [(OP_UPSERT, 'Upsert'), (OP_DELETE, 'Delete')]
+
+    txid = models.BigIntegerField(db_default=models.Func(function='txid_current', output_field=models.BigIntegerField()))
+    session_id = models.BigIntegerField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='session_change_cursor_idx'),
+            models.Index(fields=['created_at'], name='session_change_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.op} session {self.session_id} (#{self.id})'
+
+
 class TelegramLink(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     telegram_user_id = models.CharField(max_length=50, null=True, blank=True)
     linking_code = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        # Keep the outbox event of a confirmation in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def is_expired(self):
         return timezone.now() > self.created_at + timedelta(minutes=15)
+
+
+
+class Job(models.Model):
+    """
+    A unit of background work, see pamp_app.jobs. Workers claim ready jobs
+    with SELECT ... FOR UPDATE SKIP LOCKED, highest priority first.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            (STATUS_QUEUED, 'Queued'),
+            (STATUS_RUNNING, 'Running'),
+            (STATUS_DONE, 'Done'),
+            (STATUS_FAILED, 'Failed'),
+        ],
+        default=STATUS_QUEUED,
+    )
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Only queued rows are ever scanned by the claim query.
+            models.Index(
+                fields=['-priority', 'run_at', 'id'],
+                condition=models.Q(status='queued'),
+                name='job_ready_idx',
+            ),
+            models.Index(
+                fields=['locked_at'],
+                condition=models.Q(status='running'),
+                name='job_running_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
+
+
+
+class OutboxEvent(models.Model):
+    """
+    An event for the reminder bot, written in the same transaction as the
+    change it describes and pushed to the bot by `manage.py dispatch_outbox`
+    (see pamp_app/outbox.py).
+    """
+    topic = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set while a dispatcher is pushing the event; a claim older than
+    # OUTBOX_CLAIM_TIMEOUT belongs to a dispatcher that died.
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'], name='outbox_pending_idx',
+                condition=models.Q(dispatched_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.topic} #{self.id}'
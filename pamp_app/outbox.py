@@ -0,0 +1,155 @@
+# pamp_app/outbox.py
+"""
+Transactional outbox for the reminder bot.
+
+Receivers below write an OutboxEvent in the same transaction as the
+TrainingSession / TelegramLink change and send NOTIFY, which Postgres
+only delivers on commit. `manage.py dispatch_outbox` wakes up on the
+notification, claims a batch of pending events, POSTs it to the bot and
+then marks it dispatched: an event is delivered at least once, in commit
+order per session, and never lost.
+"""
+import logging
+import select
+from datetime import timedelta
+
+import httpx
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import OutboxEvent, Profile, TelegramLink, TrainingSession
+from .recurrence import active_between
+from .serializers import TrainingSessionSerializer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'outbox'
+
+SESSION_SAVED = 'session.saved'
+SESSION_DELETED = 'session.deleted'
+TELEGRAM_LINKED = 'telegram.linked'
+TELEGRAM_UNLINKED = 'telegram.unlinked'
+
+
+def record(topic, payload):
+    """Add an event to the outbox in the caller's transaction."""
+    event = OutboxEvent.objects.create(topic=topic, payload=payload)
+    with connection.cursor() as cursor:
+        cursor.execute(f'NOTIFY {CHANNEL}')
+    return event
+
+
+def telegram_user_id(user_id):
+    return (
+        TelegramLink.objects.filter(user_id=user_id, telegram_user_id__isnull=False)
+        .values_list('telegram_user_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=TrainingSession)
+def session_saved(sender, instance, **kwargs):
+    user_id = instance.profile.user_id
+    record(SESSION_SAVED, {
+        'id': instance.pk,
+        'user_id': user_id,
+        'telegram_user_id': telegram_user_id(user_id),
+        'session': TrainingSessionSerializer(instance).data,
+    })
+
+
+@receiver(post_delete, sender=TrainingSession)
+def session_deleted(sender, instance, **kwargs):
+    # The bot drops the session from its owner's cached list.
+    user_id = Profile.objects.filter(pk=instance.profile_id).values_list('user_id', flat=True).first()
+    record(SESSION_DELETED, {'id': instance.pk, 'user_id': user_id})
+
+
+@receiver(post_save, sender=TelegramLink)
+def telegram_linked(sender, instance, **kwargs):
+    if not instance.telegram_user_id:
+        return
+    # The user's existing sessions had nobody to remind until now.
+    sessions = TrainingSession.objects.filter(
+        active_between(timezone.now().date()), profile__user_id=instance.user_id,
+    ).order_by('date', 'time')
+    record(TELEGRAM_LINKED, {
+        'user_id': instance.user_id,
+        'telegram_user_id': instance.telegram_user_id,
+        'sessions': TrainingSessionSerializer(sessions, many=True).data,
+    })
+
+
+@receiver(post_delete, sender=TelegramLink)
+def telegram_unlinked(sender, instance, **kwargs):
+    if instance.telegram_user_id:
+        record(TELEGRAM_UNLINKED, {'user_id': instance.user_id, 'telegram_user_id': instance.telegram_user_id})
+
+
+def get_client():
+    transport = httpx.HTTPTransport(uds=settings.OUTBOX_UDS) if settings.OUTBOX_UDS else None
+    headers = {'X-Outbox-Token': settings.OUTBOX_TOKEN}
+    return httpx.Client(transport=transport, headers=headers, timeout=settings.OUTBOX_TIMEOUT)
+
+
+def claim_batch():
+    """
+    Claim up to OUTBOX_BATCH_SIZE pending events in a short transaction.
+    Claims of a dispatcher that died run out after OUTBOX_CLAIM_TIMEOUT.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=expired), dispatched_at__isnull=True)
+            .order_by('id')[:settings.OUTBOX_BATCH_SIZE]
+        )
+        if events:
+            OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(claimed_at=now)
+    return events
+
+
+def dispatch_batch(client):
+    """
+    Push up to OUTBOX_BATCH_SIZE pending events and return how many were
+    sent. No transaction or row lock is held while waiting for the bot;
+    a failed push releases the claim and leaves the events pending.
+    """
+    events = claim_batch()
+    if not events:
+        return 0
+    ids = [event.id for event in events]
+    try:
+        response = client.post(settings.OUTBOX_URL, json={'events': [
+            {'id': event.id, 'topic': event.topic, 'payload': event.payload} for event in events
+        ]})
+        response.raise_for_status()
+    except Exception:
+        OutboxEvent.objects.filter(id__in=ids).update(claimed_at=None)
+        raise
+    OutboxEvent.objects.filter(id__in=ids).update(dispatched_at=timezone.now())
+    return len(events)
+
+
+def drain(client):
+    total = 0
+    while (sent := dispatch_batch(client)):
+        total += sent
+    return total
+
+
+def listen():
+    with connection.cursor() as cursor:
+        cursor.execute(f'LISTEN {CHANNEL}')
+
+
+def wait_for_events(timeout):
+    """Block until a NOTIFY arrives or `timeout` seconds pass."""
+    raw = connection.connection
+    if select.select([raw], [], [], timeout)[0]:
+        raw.poll()
+        raw.notifies.clear()
@@ -0,0 +1,136 @@
+# pamp_app/pagination.py
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PostKeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over posts ordered by (-created_at, -id).
+
+    The cursor stores the (created_at, id) pair of the last post on the page,
+    so the next page is a plain range scan on the matching composite index
+    and costs the same no matter how deep the client has scrolled.
+
+    Pagination is opt-in: it only kicks in when the request carries a
+    `cursor` or `page_size` query parameter, so existing clients that
+    expect a plain list keep working.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, encoded):
+        if not encoded:
+            return None
+        try:
+            created_at, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            return datetime.fromisoformat(created_at), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound('Invalid cursor.')
+
+    def encode_cursor(self, post):
+        raw = f'{post.created_at.isoformat()}|{post.pk}'
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def page_queryset(self, queryset, request, cursor, page_size):
+        """The slice holding the requested page, plus one row to detect a next page."""
+        self.request = request
+        self.page_size_requested = page_size
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(cursor)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        return queryset[:self.page_size_requested + 1]
+
+    def finish_page(self, rows):
+        self.has_next = len(rows) > self.page_size_requested
+        page = rows[:self.page_size_requested]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def requested_page(self, request):
+        return request.query_params.get(self.cursor_query_param), self.get_page_size(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return self.paginate_page(queryset, request, *self.requested_page(request))
+
+    def paginate_page(self, queryset, request, cursor, page_size):
+        """paginate_queryset() for an explicit cursor and page size."""
+        return self.finish_page(list(self.page_queryset(queryset, request, cursor, page_size)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views."""
+        if not self.is_requested(request):
+            return None
+        rows = self.page_queryset(queryset, request, *self.requested_page(request))
+        return self.finish_page([post async for post in rows])
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_cached_response(self, request, data, next_cursor):
+        """Build the paginated response for a page served from a cache."""
+        self.request = request
+        self.next_cursor = next_cursor
+        return self.get_paginated_response(data)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class PostSearchPagination(PageNumberPagination):
+    """
+    Page-number pagination for ranked search results.
+
+    Ranks are not a stable sort key, so keyset pagination does not apply;
+    the match set is already narrowed by the GIN index before it is counted.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,10 +1,10 @@
 # pamp_app/pipeline.py
 import json
 from social_core.pipeline.partial import partial
-from rest_framework_simplejwt.tokens import RefreshToken
+from pamp_app.authentication import tokens_for_user
 
 def generate_jwt_tokens(strategy, details, user, *args, **kwargs):
-    refresh = RefreshToken.for_user(user)
+    refresh = tokens_for_user(user)
     access_token = str(refresh.access_token)
     refresh_token = str(refresh)
 
@@ -0,0 +1,110 @@
+# pamp_app/recurrence.py
+"""
+Expansion of TrainingSession recurrence rules into concrete dates.
+
+A session is parsed once into a Rule: its start date as an ordinal and a
+7-bit weekday mask (0 for one-off sessions). Expanding a rule over a
+window is integer arithmetic only: for each weekday in the mask, the
+first matching ordinal in the window, then every 7th day after it.
+
+`days_of_week` is free text; it accepts English or Russian day names
+(full or abbreviated), ISO day numbers (1 = Monday ... 7 = Sunday) and
+ranges such as "mon-fri", separated by commas or spaces. An empty value
+repeats on the weekday of `date`.
+"""
+import re
+from collections import namedtuple
+from datetime import date
+
+from django.db.models import Q
+
+WEEKLY = 'weekly'
+
+DAY_NAMES = {}
+for number, names in enumerate([
+    ('mon', 'monday', 'пн', 'пон', 'понедельник'),
+    ('tue', 'tues', 'tuesday', 'вт', 'вто', 'вторник'),
+    ('wed', 'wednesday', 'ср', 'сре', 'среда'),
+    ('thu', 'thur', 'thurs', 'thursday', 'чт', 'чет', 'четверг'),
+    ('fri', 'friday', 'пт', 'пят', 'пятница'),
+    ('sat', 'saturday', 'сб', 'суб', 'суббота'),
+    ('sun', 'sunday', 'вс', 'вос', 'воскресенье'),
+]):
+    for name in names:
+        DAY_NAMES[name] = number
+
+Rule = namedtuple('Rule', ['start', 'mask'])
+
+
+def parse_day(token):
+    if token.isdigit():
+        if 1 <= int(token) <= 7:
+            return int(token) - 1
+    elif token in DAY_NAMES:
+        return DAY_NAMES[token]
+    raise ValueError(f'Unknown day of week: {token!r}')
+
+
+def parse_days(value):
+    """Parse a days_of_week string into a weekday bitmask (bit 0 = Monday)."""
+    mask = 0
+    for token in re.split(r'[\s,;]+', (value or '').strip().lower()):
+        if not token:
+            continue
+        first, _, last = token.partition('-')
+        first = parse_day(first)
+        last = parse_day(last) if last else first
+        # Ranges may wrap around the week: fri-mon
+        for offset in range((last - first) % 7 + 1):
+            mask |= 1 << (first + offset) % 7
+    return mask
+
+
+def weekdays(mask):
+    return [day for day in range(7) if mask >> day & 1]
+
+
+def rule_for(session):
+    start = session.date.toordinal()
+    if session.recurrence != WEEKLY:
+        return Rule(start, 0)
+    try:
+        mask = parse_days(session.days_of_week)
+    except ValueError:
+        # Saved before days_of_week was validated: repeat on the start day.
+        mask = 0
+    return Rule(start, mask or 1 << session.date.weekday())
+
+
+def expand(rule, start, end):
+    """Ordinals of the occurrences of `rule` from `start` to `end` inclusive, in order."""
+    low, high = max(start.toordinal(), rule.start), end.toordinal()
+    if not rule.mask:
+        return [rule.start] if start.toordinal() <= rule.start <= high else []
+    if low > high:
+        return []
+    low_weekday = (low + 6) % 7
+    ordinals = []
+    for day in weekdays(rule.mask):
+        ordinals.extend(range(low + (day - low_weekday) % 7, high + 1, 7))
+    ordinals.sort()
+    return ordinals
+
+
+def occurrences(sessions, start, end):
+    """(date, session) for every occurrence of `sessions` in the window, by date and time."""
+    found = [
+        (ordinal, session.time, session)
+        for session in sessions
+        for ordinal in expand(rule_for(session), start, end)
+    ]
+    found.sort(key=lambda item: item[:2])
+    return [(date.fromordinal(ordinal), session) for ordinal, _, session in found]
+
+
+def active_between(start, end=None):
+    """Sessions that can have an occurrence in the window."""
+    condition = Q(date__gte=start) | Q(recurrence=WEEKLY)
+    if end is not None:
+        condition &= Q(date__lte=end)
+    return condition
@@ -1,7 +1,15 @@
 # serializers.py
 from django.contrib.auth.models import User
+from django.db import transaction
 from rest_framework import serializers
-from .models import Post, Profile, PostImage, PostVideo, TrainingSession
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from django.conf import settings
+from django.core.files.storage import default_storage
+from . import recurrence
+from .authentication import add_profile_claim
+from .images import generate_variants
+from .tasks import delete_files
+from .models import Post, Profile, PostImage, PostVideo, TrainingSession, VideoUpload
 
 from allauth.socialaccount.helpers import complete_social_login
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
@@ -11,8 +19,69 @@ from allauth.socialaccount.models import SocialLogin, SocialToken, SocialApp
 #import traceback
 
 
+def parse_fields_param(value):
+    """Turn a comma separated `?fields=` / `?expand=` value into a list."""
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_ids(values, name):
+    try:
+        return {int(value) for value in values}
+    except (TypeError, ValueError):
+        raise serializers.ValidationError({name: "Expected a list of ids."})
+
+
+class DynamicFieldsMixin:
+    """
+    Lets a caller trim the serializer down to a sparse fieldset.
+
+    `fields` is a list of field names. Dotted names such as
+    "profile.username" keep the parent field and are handed down to nested
+    serializers that use this mixin too.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            self.restrict(fields)
+
+    def restrict(self, fields):
+        top, nested = set(), {}
+        for name in fields:
+            head, _, rest = name.partition('.')
+            top.add(head)
+            if rest:
+                nested.setdefault(head, []).append(rest)
+
+        for name in set(self.fields) - top:
+            self.fields.pop(name)
+        for name, subfields in nested.items():
+            field = self.fields.get(name)
+            child = getattr(field, 'child', field)
+            if isinstance(child, DynamicFieldsMixin):
+                child.restrict(subfields)
+
+
+class VariantURLsField(serializers.Field):
+    """Renders {"<width>": "<storage name>"} as {"<width>": "<absolute url>"}."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = {}
+        for width, name in (variants or {}).items():
+            url = default_storage.url(name)
+            urls[width] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
 #Login
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
@@ -48,35 +117,39 @@ class LoginSerializer(serializers.Serializer):
 
 
 #Profile
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     user = UserSerializer(read_only=True)  # Сделать user только для чтения
+    avatar_variants = VariantURLsField()
 
     class Meta:
         model = Profile
-        fields = ['id', 'user', 'username', 'avatar']
+        fields = ['id', 'user', 'username', 'avatar', 'avatar_variants']
 
 
 
     def update(self, instance, validated_data):
         avatar = validated_data.get('avatar', None)
-        if avatar == '':
-            if instance.avatar:
-                instance.avatar.delete(save=False)
-            instance.avatar = None
-        elif avatar:
-            if instance.avatar:
-                instance.avatar.delete(save=False)
-            instance.avatar = avatar
+        if avatar is not None:
+            # The old files are deleted by a background job after commit.
+            stale_files = [instance.avatar.name, *instance.avatar_variants.values()]
+            instance.avatar = avatar or None
+            instance.avatar_variants = {}
         instance.save()
+        if avatar is not None:
+            delete_files.enqueue(stale_files)
+        if avatar:
+            generate_variants([instance], 'avatar', 'avatar_variants', settings.AVATAR_SIZES)
         return instance
 
 
 
 class PostImageSerializer(serializers.ModelSerializer):
+    variants = VariantURLsField()
+
     class Meta:
         model = PostImage
-        fields = ['id', 'image', 'image_url']
+        fields = ['id', 'image', 'image_url', 'variants']
 
     def validate(self, data):
         if not data.get('image') and not data.get('image_url'):
@@ -96,6 +169,20 @@ class PostVideoSerializer(serializers.ModelSerializer):
 
 
 
+class VideoUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VideoUpload
+        fields = ['id', 'filename', 'size', 'received', 'status', 'video', 'created_at']
+        read_only_fields = ['received', 'status', 'video', 'created_at']
+
+    def validate_size(self, value):
+        if value <= 0 or value > settings.VIDEO_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Size must be between 1 and {settings.VIDEO_UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+
+
 class TrainingSessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = TrainingSession
@@ -107,15 +194,28 @@ class TrainingSessionSerializer(serializers.ModelSerializer):
 
 
 class TrainingSessionSerializer(serializers.ModelSerializer):
+    # days_of_week parsed into 0 (Monday) ... 6 (Sunday); empty for one-off sessions.
+    weekdays = serializers.SerializerMethodField()
+
     class Meta:
         model = TrainingSession
-        fields = ['id', 'date', 'time', 'recurrence', 'days_of_week', 'profile']
+        fields = ['id', 'date', 'time', 'recurrence', 'days_of_week', 'weekdays', 'profile']
         read_only_fields = ('profile',)
 
+    def get_weekdays(self, obj):
+        return recurrence.weekdays(recurrence.rule_for(obj).mask)
+
+    def validate_days_of_week(self, value):
+        try:
+            recurrence.parse_days(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
 
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     images = PostImageSerializer(many=True, required=False)
     videos = PostVideoSerializer(many=True, required=False)
     profile = ProfileSerializer(read_only=True)
@@ -128,68 +228,66 @@ class PostSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'profile'
         ]
 
+    def get_media_data(self):
+        request = self.context['request']
+        return {
+            'images': request.FILES.getlist('images'),
+            'image_urls': request.data.getlist('image_urls'),
+            'videos': request.FILES.getlist('videos'),
+            'video_urls': request.data.getlist('video_urls'),
+        }
+
+    def add_media(self, post, media):
+        """Insert all new media for a post with one INSERT per media type."""
+        images = PostImage.objects.bulk_create(
+            [PostImage(post=post, image=image) for image in media['images']]
+            + [PostImage(post=post, image_url=url) for url in media['image_urls']]
+        )
+        generate_variants(images, 'image', 'variants', settings.POST_IMAGE_SIZES)
+        PostVideo.objects.bulk_create(
+            [PostVideo(post=post, video=video) for video in media['videos']]
+            + [PostVideo(post=post, video_url=url) for url in media['video_urls']]
+        )
+
     def create(self, validated_data):
-        images_data = self.context['request'].FILES.getlist('images')
-        images_url_data = self.context['request'].data.getlist('image_urls')
-        videos_data = self.context['request'].FILES.getlist('videos')
-        videos_url_data = self.context['request'].data.getlist('video_urls')
+        media = self.get_media_data()
 
         # Remove 'profile' from validated_data as it's handled by the view
         profile = validated_data.pop('profile')
 
-        post = Post.objects.create(profile=profile, **validated_data)
-
-        for image_data in images_data:
-            PostImage.objects.create(post=post, image=image_data)
-
-        for image_url in images_url_data:
-            PostImage.objects.create(post=post, image_url=image_url)
-
-        for video_data in videos_data:
-            PostVideo.objects.create(post=post, video=video_data)
-
-        for video_url in videos_url_data:
-            PostVideo.objects.create(post=post, video_url=video_url)
+        with transaction.atomic():
+            post = Post.objects.create(profile=profile, **validated_data)
+            self.add_media(post, media)
 
         return post
 
 
 
     def update(self, instance, validated_data):
-        images_data = self.context['request'].FILES.getlist('images')
-        images_url_data = self.context['request'].data.getlist('image_urls')
-        videos_data = self.context['request'].FILES.getlist('videos')
-        videos_url_data = self.context['request'].data.getlist('video_urls')
-
-        existing_image_ids = self.context['request'].data.getlist('existing_images')
-        existing_video_ids = self.context['request'].data.getlist('existing_videos')
+        media = self.get_media_data()
+        request = self.context['request']
+        existing_image_ids = request.data.getlist('existing_images')
+        existing_video_ids = request.data.getlist('existing_videos')
 
         instance.title = validated_data.get('title', instance.title)
         instance.training_type = validated_data.get('training_type', instance.training_type)
         instance.description = validated_data.get('description', instance.description)
-        instance.save()
-
-        if existing_image_ids:
-            instance.images.exclude(id__in=existing_image_ids).delete()
-        else:
-            instance.images.all().delete()
-
-        for image_data in images_data:
-            PostImage.objects.create(post=instance, image=image_data)
 
-        for image_url in images_url_data:
-            PostImage.objects.create(post=instance, image_url=image_url)
+        with transaction.atomic():
+            instance.save()
 
-        if existing_video_ids:
-            instance.videos.exclude(id__in=existing_video_ids).delete()
-        else:
-            instance.videos.all().delete()
+            # Only media missing from existing_images / existing_videos is
+            # removed; everything the client kept is left untouched.
+            images = {image.id: image for image in instance.images.all()}
+            videos = {video.id: video for video in instance.videos.all()}
+            removed_images = set(images) - parse_ids(existing_image_ids, 'existing_images')
+            removed_videos = set(videos) - parse_ids(existing_video_ids, 'existing_videos')
+            if removed_images:
+                PostImage.objects.filter(id__in=removed_images).delete()
+            if removed_videos:
+                PostVideo.objects.filter(id__in=removed_videos).delete()
 
-        for video_data in videos_data:
-            PostVideo.objects.create(post=instance, video=video_data)
-
-        for video_url in videos_url_data:
-            PostVideo.objects.create(post=instance, video_url=video_url)
+            self.add_media(instance, media)
 
         return instance
 
@@ -199,7 +297,12 @@ class PostSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
         request = self.context.get('request')
 
-        if request and instance.profile.user == request.user:
+        # Compare ids so rendering never needs an extra User query.
+        # Pages cached for every reader ('shared') always keep the profile.
+        if (
+            request and 'profile' in representation and not self.context.get('shared')
+            and instance.profile.user_id == request.user.id
+        ):
             # Omit 'profile' fields
             representation.pop('profile', None)
             # Alternatively, you can set them to None or some placeholder
@@ -208,6 +311,42 @@ class PostSerializer(serializers.ModelSerializer):
         return representation
 
 
+class PostListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact card representation for feeds: title, a thumbnail and counters.
+
+    The heavy fields are opt-in through `expand`, and the view only loads
+    the relations that end up rendered. `thumbnail` reads the annotations
+    added by PostQuerySet.with_thumbnail().
+    """
+    expandable = ('description', 'images', 'videos', 'profile')
+
+    thumbnail = serializers.SerializerMethodField()
+    images = PostImageSerializer(many=True, read_only=True)
+    videos = PostVideoSerializer(many=True, read_only=True)
+    profile = ProfileSerializer(read_only=True)
+
+    class Meta:
+        model = Post
+        fields = [
+            'id', 'title', 'training_type', 'views', 'created_at', 'thumbnail',
+            'description', 'images', 'videos', 'profile',
+        ]
+
+    def __init__(self, *args, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in set(self.expandable) - set(expand or ()):
+            self.fields.pop(name, None)
+
+    def get_thumbnail(self, post):
+        name = getattr(post, 'thumbnail_image', None)
+        if not name:
+            return getattr(post, 'thumbnail_url', None)
+        url = PostImage._meta.get_field('image').storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
 class GoogleLoginSerializer(serializers.Serializer):
     id_token = serializers.CharField(required=True, allow_blank=False)
 
@@ -246,3 +385,9 @@ class GoogleLoginSerializer(serializers.Serializer):
 
         attrs['user'] = login.user
         return attrs
+
+
+class ProfileTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_profile_claim(super().get_token(user), user)
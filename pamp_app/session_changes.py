@@ -0,0 +1,95 @@
+# pamp_app/session_changes.py
+"""
+Change feed for TrainingSession, so the reminder bot can follow edits
+without re-downloading every schedule.
+
+Every save and delete writes a TrainingSessionChange row in the same
+transaction. The cursor is the (txid, id) of the last row a reader saw.
+Rows are only handed out once every transaction that could still insert
+a smaller txid has finished (txid below the snapshot's xmin), so a slow
+commit can never be skipped over.
+"""
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import TrainingSession, TrainingSessionChange
+from .serializers import TrainingSessionSerializer
+
+
+class CursorExpired(Exception):
+    """The cursor points at changes that were already pruned."""
+
+
+def visible_changes():
+    xmin = RawSQL('pg_snapshot_xmin(pg_current_snapshot())::text::bigint', [])
+    return TrainingSessionChange.objects.filter(txid__lt=xmin).order_by('txid', 'id')
+
+
+def encode_cursor(txid, pk):
+    return f'{txid}-{pk}'
+
+
+def decode_cursor(value):
+    txid, pk = value.split('-')
+    return int(txid), int(pk)
+
+
+async def head():
+    """The cursor of the newest visible change: where a fresh reader starts."""
+    last = await visible_changes().order_by('-txid', '-id').afirst()
+    return encode_cursor(last.txid, last.id) if last else encode_cursor(0, 0)
+
+
+async def read_changes(cursor, limit):
+    """
+    Return (changes, next_cursor, has_more) for up to `limit` change rows
+    after `cursor`. Several changes to one session collapse into its
+    current state, or a tombstone if it no longer exists.
+    """
+    txid, pk = decode_cursor(cursor)
+    if pk and not await TrainingSessionChange.objects.filter(id=pk).aexists():
+        raise CursorExpired(cursor)
+
+    rows = [
+        row async for row in
+        visible_changes().filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=pk))[:limit + 1]
+    ]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], cursor, False
+
+    session_ids = list(dict.fromkeys(row.session_id for row in rows))
+    sessions = {
+        session.id: session async for session in
+        TrainingSession.objects.filter(id__in=session_ids).annotate(
+            user_id=F('profile__user_id'),
+            telegram_user_id=F('profile__user__telegramlink__telegram_user_id'),
+        )
+    }
+    changes = []
+    for session_id in session_ids:
+        session = sessions.get(session_id)
+        if session is None:
+            changes.append({'id': session_id, 'deleted': True})
+        else:
+            changes.append({
+                'id': session_id,
+                'deleted': False,
+                'user_id': session.user_id,
+                'telegram_user_id': session.telegram_user_id,
+                'session': TrainingSessionSerializer(session).data,
+            })
+    return changes, encode_cursor(rows[-1].txid, rows[-1].id), has_more
+
+
+@receiver(post_save, sender=TrainingSession)
+def record_save(sender, instance, **kwargs):
+    TrainingSessionChange.objects.create(session_id=instance.pk, op=TrainingSessionChange.OP_UPSERT)
+
+
+@receiver(post_delete, sender=TrainingSession)
+def record_delete(sender, instance, **kwargs):
+    TrainingSessionChange.objects.create(session_id=instance.pk, op=TrainingSessionChange.OP_DELETE)
@@ -0,0 +1,154 @@
+# pamp_app/storage.py
+"""
+Content-addressed media storage: every upload is stored once, under the
+SHA-256 of its bytes (`blobs/ab/cd/<digest>.<ext>`), and shared by all
+PostImage, PostVideo and Profile.avatar rows that upload the same file.
+
+Each save() is one new reference and each delete() drops one; the file
+(and its rendered variants) is only removed when no reference is left.
+Blob names never change content, so they can be served as immutable.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+from functools import partial
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import MediaBlob, PostImage, PostVideo, Profile
+
+BLOB_PREFIX = 'blobs/'
+READ_SIZE = 64 * 1024
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def lock_digest(digest):
+    """
+    Serialise everything touching one blob's file until the transaction
+    ends. Unlike a row lock it also covers a blob whose row is gone.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))', [digest])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save(); an existing
+        # file with the same bytes is the point, not a conflict.
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large uploads, finished chunked uploads):
+            # hash it in place and move it, no extra copy. Like
+            # FileSystemStorage, the temporary file is consumed either way.
+            temp_path = content.temporary_file_path()
+            digest, size = self._hash_file(temp_path)
+        else:
+            temp_path, digest, size = self._spool(content)
+
+        name = blob_name(digest, extension)
+        with transaction.atomic():
+            lock_digest(digest)
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                digest=digest, defaults={'name': name, 'size': size, 'refcount': 1},
+            )
+            if not created:
+                MediaBlob.objects.filter(pk=digest).update(refcount=F('refcount') + 1)
+            # The digest lock serialises this with the removal of the same
+            # blob's file, so it cannot disappear between the check and
+            # the commit.
+            path = self.path(blob.name)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                file_move_safe(temp_path, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        return blob.name
+
+    def _spool(self, content):
+        """Stream `content` into a temp file under MEDIA_ROOT while hashing it."""
+        sha256 = hashlib.sha256()
+        size = 0
+        temp_dir = self.path(BLOB_PREFIX + 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(READ_SIZE):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return temp_path, sha256.hexdigest(), size
+
+    @staticmethod
+    def _hash_file(path):
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while data := f.read(READ_SIZE):
+                sha256.update(data)
+                size += len(data)
+        return sha256.hexdigest(), size
+
+    def delete(self, name):
+        if not name.startswith(BLOB_PREFIX):
+            # Files stored before blobs existed are owned by one row.
+            return super().delete(name)
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                # A rendered variant: it lives and dies with its blob.
+                return
+            if blob.refcount > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            blob.delete()
+            # Only once the row is really gone: a rollback must not leave
+            # it pointing at a missing file.
+            transaction.on_commit(partial(self._remove_blob, blob.digest, name))
+
+    def _remove_blob(self, digest, name):
+        with transaction.atomic():
+            lock_digest(digest)
+            if MediaBlob.objects.filter(pk=digest).exists():
+                # Uploaded again since; the file is in use once more.
+                return
+            super().delete(name)
+            stem = glob.escape(os.path.splitext(self.path(name))[0])
+            for variant in glob.glob(f'{stem}.*w.*'):
+                os.remove(variant)
+
+
+@receiver(post_delete, sender=PostImage)
+@receiver(post_delete, sender=PostVideo)
+@receiver(post_delete, sender=Profile)
+def release_media(sender, instance, **kwargs):
+    from .tasks import delete_files
+
+    names = [field.name for field in (
+        getattr(instance, 'image', None),
+        getattr(instance, 'video', None),
+        getattr(instance, 'avatar', None),
+    ) if field]
+    if names:
+        delete_files.enqueue(names)
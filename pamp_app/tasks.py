@@ -0,0 +1,71 @@
+# pamp_app/tasks.py
+# Background tasks run by `manage.py run_workers`, see pamp_app.jobs.
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .images import get_pool, render_variants, store_variants
+from .jobs import task
+from .models import Job, OutboxEvent, TrainingSessionChange, VideoUpload
+from .uploads import remove_temp_file
+from .view_counter import post_views
+
+
+@task(priority=10)
+def delete_files(names):
+    for name in names:
+        if name:
+            default_storage.delete(name)
+
+
+@task(priority=5)
+def render_image_variants(model_label, pk, file_field, variants_field, sizes):
+    model = apps.get_model(model_label)
+    name = model.objects.filter(pk=pk).values_list(file_field, flat=True).first()
+    if not name:
+        return
+    args = (settings.MEDIA_ROOT, name, sizes, settings.IMAGE_VARIANT_FORMAT, settings.IMAGE_VARIANT_QUALITY)
+    if settings.IMAGE_VARIANT_WORKERS:
+        variants = get_pool().submit(render_variants, *args).result()
+    else:
+        variants = render_variants(*args)
+    store_variants(model, pk, variants_field, variants, **{file_field: name})
+
+
+@task(priority=10, every=timedelta(seconds=settings.POST_VIEWS_FLUSH_INTERVAL))
+def flush_post_views():
+    """Write the view counts web processes left in the shared buffer."""
+    post_views.flush()
+
+
+@task(every=timedelta(hours=1))
+def cleanup_video_uploads():
+    """Drop chunked uploads that were abandoned before being finalized."""
+    cutoff = timezone.now() - timedelta(seconds=settings.VIDEO_UPLOAD_EXPIRY)
+    stale = VideoUpload.objects.filter(status=VideoUpload.STATUS_PENDING, updated_at__lt=cutoff)
+    for upload in stale:
+        remove_temp_file(upload.temp_path)
+        upload.delete()
+
+
+@task(every=timedelta(hours=6))
+def prune_session_changes():
+    """Readers whose cursor was pruned get 410 and resync from scratch."""
+    cutoff = timezone.now() - timedelta(seconds=settings.SESSION_CHANGES_RETENTION)
+    TrainingSessionChange.objects.filter(created_at__lt=cutoff).delete()
+
+
+@task(every=timedelta(hours=6))
+def prune_outbox():
+    cutoff = timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION)
+    OutboxEvent.objects.filter(dispatched_at__lt=cutoff).delete()
+
+
+@task(every=timedelta(hours=6))
+def prune_jobs():
+    """Finished jobs are only kept for a while; failed ones stay for inspection."""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_RETENTION)
+    Job.objects.filter(status=Job.STATUS_DONE, updated_at__lt=cutoff).delete()
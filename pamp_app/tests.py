@@ -1,3 +1,1294 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import httpx
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_api_key.models import APIKey
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import feed_cache, ical, jobs, outbox, recurrence, tasks, uploads
+from .authentication import principal_key, tokens_for_user
+from .jobs import run_pending
+from .models import (
+    Job, MediaBlob, OutboxEvent, Post, PostImage, PostVideo, Profile, TelegramLink, TrainingSession,
+    TrainingSessionChange, VideoUpload,
+)
+from .view_counter import PostViewBuffer, post_views
+
+
+def make_profile(username):
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='pass12345')
+    return Profile.objects.create(user=user)
+
+
+def make_posts(profile, count):
+    return [
+        Post.objects.create(profile=profile, title=f'Post {i}', training_type='run', description='...')
+        for i in range(count)
+    ]
+
+
+class FeedTestCase(TestCase):
+    """
+    Starts from an empty cache. The feed version is bumped on transaction
+    commit: wrap writes whose bump a test relies on in
+    captureOnCommitCallbacks(execute=True).
+    """
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        # Detail hits are buffered; write them out while the tables exist.
+        self.addCleanup(post_views.flush)
+
+
+class PostKeysetPaginationTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.me = make_profile('me')
+        self.other = make_profile('other')
+        self.other_posts = make_posts(self.other, 5)
+        self.my_posts = make_posts(self.me, 2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def collect(self, url, params):
+        ids, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages += 1
+            ids += [post['id'] for post in response.data['results']]
+            if not response.data['next']:
+                return ids, pages
+            response = self.client.get(response.data['next'])
+
+    def test_list_without_pagination_params_is_a_plain_list(self):
+        response = self.client.get(reverse('posts-list'))
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_exclude_mine_pages_through_every_post_once(self):
+        ids, pages = self.collect(reverse('posts-list'), {'exclude_mine': 'true', 'page_size': 2})
+        expected = [post.id for post in sorted(self.other_posts, key=lambda p: (p.created_at, p.id), reverse=True)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_mine_and_user_posts_are_paginated(self):
+        ids, _ = self.collect(reverse('posts-list'), {'mine': 'true', 'page_size': 1})
+        self.assertCountEqual(ids, [post.id for post in self.my_posts])
+        ids, _ = self.collect(reverse('user-posts'), {'page_size': 1})
+        self.assertCountEqual(ids, [post.id for post in self.my_posts])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('posts-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=3600)
+class PostQueryCountTests(FeedTestCase):
+    """Rendering posts must cost a constant number of queries, not one per post."""
+
+    def setUp(self):
+        super().setUp()
+        self.me = make_profile('me')
+        self.other = make_profile('other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def add_posts(self, profile, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for post in make_posts(profile, count):
+                PostImage.objects.create(post=post, image_url='https://example.com/a.jpg')
+                PostVideo.objects.create(post=post, video_url='https://example.com/a.mp4')
+
+    def assert_constant_queries(self, profile, url, params=None, num=3):
+        # posts + images + videos; request.user.profile is already cached here
+        self.add_posts(profile, 2)
+        with self.assertNumQueries(num):
+            self.client.get(url, params)
+        self.add_posts(profile, 8)
+        with self.assertNumQueries(num):
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.data), 10)
+
+    def test_feed(self):
+        self.assert_constant_queries(self.other, reverse('posts-list'), {'exclude_mine': 'true'})
+
+    def test_mine(self):
+        self.assert_constant_queries(self.me, reverse('posts-list'), {'mine': 'true'})
+
+    def test_user_posts(self):
+        self.assert_constant_queries(self.me, reverse('user-posts'))
+
+    def test_detail(self):
+        self.add_posts(self.other, 1)
+        post = Post.objects.get()
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('posts-detail', args=[post.id]))
+        self.assertEqual(response.data['profile']['user']['username'], 'other')
+
+
+class PostSearchTests(TestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+        self.title_hit = Post.objects.create(
+            profile=self.me, title='Morning running', training_type='cardio', description='Easy pace.')
+        self.body_hit = Post.objects.create(
+            profile=self.me, title='Leg day', training_type='strength', description='Squats, then a short run.')
+        Post.objects.create(profile=self.me, title='Bench press', training_type='strength', description='Heavy.')
+
+    def test_results_are_ranked_by_weight(self):
+        response = self.client.get(reverse('posts-search'), {'q': 'run'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.title_hit.id, self.body_hit.id])
+
+    def test_vector_follows_updates(self):
+        self.title_hit.title = 'Evening swim'
+        self.title_hit.save()
+        response = self.client.get(reverse('posts-search'), {'q': 'swimming'})
+        self.assertEqual([post['id'] for post in response.data['results']], [self.title_hit.id])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get(reverse('posts-search')).status_code, 400)
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=3600)
+class PostViewCounterTests(TestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        self.hot, self.cold = make_posts(self.me, 2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+        post_views.flush()
+
+    def test_views_are_buffered_and_flushed_in_one_update(self):
+        for _ in range(3):
+            self.client.get(reverse('posts-detail', args=[self.hot.id]))
+        self.client.get(reverse('posts-detail', args=[self.cold.id]))
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.views, 0)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(post_views.flush(), 4)
+        self.hot.refresh_from_db()
+        self.cold.refresh_from_db()
+        self.assertEqual((self.hot.views, self.cold.views), (3, 1))
+
+    def test_flush_moves_the_feed_version(self):
+        version = feed_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(post_views.flush(), 0)
+        self.assertEqual(callbacks, [])
+
+        caches['default'].clear()
+        self.client.get(reverse('posts-list'))  # cached with 0 views
+        self.client.get(reverse('posts-detail', args=[self.hot.id]))
+        version = feed_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            post_views.flush()
+        self.assertGreater(feed_cache.get_version(), version)
+        response = self.client.get(reverse('posts-list'))
+        self.assertEqual({post['id']: post['views'] for post in response.data}[self.hot.id], 1)
+
+    @override_settings(POST_VIEWS_FLUSH_INTERVAL=0)
+    def test_due_hits_go_to_the_shared_buffer_for_the_job(self):
+        with patch.object(PostViewBuffer, 'shared', True), self.assertNumQueries(0):
+            post_views.record(self.hot.id)
+        self.assertEqual(post_views.cache.get(PostViewBuffer.pending_key), {self.hot.id: 1})
+        tasks.flush_post_views()
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.views, 1)
+
+    def test_management_command_drains_buffer(self):
+        post_views.record(self.hot.id)
+        post_views.spill()
+        call_command('flush_post_views', stdout=StringIO())
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.views, 1)
+
+
+class FeedCacheTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.me = make_profile('me')
+        self.other = make_profile('other')
+        make_posts(self.me, 1)
+        make_posts(self.other, 2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+        self.url = reverse('posts-list')
+
+    def test_second_read_is_a_hit_and_skips_the_database(self):
+        first = self.client.get(self.url, {'exclude_mine': 'true'})
+        self.assertEqual(first['X-Feed-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {'exclude_mine': 'true'})
+        self.assertEqual(second['X-Feed-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+    def test_shared_page_is_filtered_per_reader(self):
+        self.client.get(self.url, {'exclude_mine': 'true', 'page_size': 10})
+        self.client.force_authenticate(self.other.user)
+        response = self.client.get(self.url, {'exclude_mine': 'true', 'page_size': 10})
+        self.assertEqual(response['X-Feed-Cache'], 'HIT')
+        self.assertEqual([post['profile']['id'] for post in response.data['results']], [self.me.id])
+
+    def test_short_shared_page_is_filled_from_the_next_one(self):
+        # Shared pages of two, newest first: [other, me] [other, other].
+        # My first page takes one post from each and the second carries on
+        # in the middle of the second shared page.
+        Post.objects.all().delete()
+        older = make_posts(self.other, 2)
+        make_posts(self.me, 1)
+        newer = make_posts(self.other, 1)
+        first = self.client.get(self.url, {'exclude_mine': 'true', 'page_size': 2})
+        self.assertEqual([post['id'] for post in first.data['results']], [newer[0].id, older[1].id])
+        second = self.client.get(first.data['next'])
+        self.assertEqual([post['id'] for post in second.data['results']], [older[0].id])
+        self.assertIsNone(second.data['next'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_deploy_check_warns_about_a_local_cache(self):
+        from .checks import check_shared_caches
+        self.assertEqual(
+            [error.id for error in check_shared_caches(None)],
+            ['pamp_app.W001'] * 3,
+        )
+
+    def test_writes_invalidate_the_feed(self):
+        self.client.get(self.url, {'exclude_mine': 'true'})
+        with self.captureOnCommitCallbacks(execute=True):
+            post = make_posts(self.other, 1)[0]
+        response = self.client.get(self.url, {'exclude_mine': 'true'})
+        self.assertEqual(response['X-Feed-Cache'], 'MISS')
+        self.assertEqual(response.data[0]['id'], post.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PostImage.objects.create(post=post, image_url='https://example.com/a.jpg')
+        response = self.client.get(self.url, {'exclude_mine': 'true'})
+        self.assertEqual(len(response.data[0]['images']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        response = self.client.get(self.url, {'exclude_mine': 'true'})
+        self.assertNotIn(post.id, [item['id'] for item in response.data])
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=3600)
+class ConditionalGetTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.me = make_profile('me')
+        self.post = make_posts(self.me, 1)[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def assert_revalidates(self, url, params=None):
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        second = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        return first['ETag']
+
+    def test_post_list_and_detail(self):
+        etag = self.assert_revalidates(reverse('posts-list'), {'mine': 'true'})
+        detail_etag = self.assert_revalidates(reverse('posts-detail', args=[self.post.id]))
+
+        self.post.title = 'Changed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.save()
+        response = self.client.get(reverse('posts-list'), {'mine': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('posts-detail', args=[self.post.id]), HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_last_modified_covers_media(self):
+        url = reverse('posts-detail', args=[self.post.id])
+        first = self.client.get(url)
+        later = timezone.now() + timedelta(minutes=1)
+        with patch('pamp_app.feed_cache.timezone.now', return_value=later), \
+                self.captureOnCommitCallbacks(execute=True):
+            PostImage.objects.create(post=self.post, image_url='https://example.com/a.jpg')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['images']), 1)
+
+    def test_list_variants_have_different_etags(self):
+        mine = self.client.get(reverse('posts-list'), {'mine': 'true'})
+        feed = self.client.get(reverse('posts-list'), {'exclude_mine': 'true'})
+        self.assertNotEqual(mine['ETag'], feed['ETag'])
+
+    def test_profiles(self):
+        self.assert_revalidates(reverse('user-profile'))
+        etag = self.assert_revalidates(reverse('profile-me'))
+        self.me.user.username = 'renamed'
+        self.me.user.save()
+        response = self.client.get(reverse('profile-me'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=3600)
+class SparseFieldsetTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.me = make_profile('me')
+        self.other = make_profile('other')
+        for post in make_posts(self.other, 3):
+            PostImage.objects.create(post=post, image_url=f'https://example.com/{post.id}-1.jpg')
+            PostImage.objects.create(post=post, image_url=f'https://example.com/{post.id}-2.jpg')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+        self.url = reverse('posts-list')
+
+    def test_fields_limit_output_and_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'mine': 'false', 'fields': 'id,title'})
+        self.assertEqual(set(response.data[0]), {'id', 'title'})
+
+    def test_nested_fields(self):
+        response = self.client.get(self.url, {'fields': 'id,profile.username'})
+        self.assertEqual(response.data[0]['profile'], {'username': 'other'})
+
+    def test_compact_representation(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'compact': 'true'})
+        post = response.data[0]
+        self.assertNotIn('description', post)
+        self.assertNotIn('profile', post)
+        self.assertEqual(post['thumbnail'], f'https://example.com/{post["id"]}-1.jpg')
+
+    def test_compact_expand(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'compact': 'true', 'expand': 'profile,images'})
+        self.assertEqual(response.data[0]['profile']['username'], 'other')
+        self.assertEqual(len(response.data[0]['images']), 2)
+        self.assertNotIn('videos', response.data[0])
+
+    def test_cached_feed_respects_shape(self):
+        full = self.client.get(self.url, {'exclude_mine': 'true'})
+        sparse = self.client.get(self.url, {'exclude_mine': 'true', 'fields': 'id'})
+        self.assertEqual(sparse['X-Feed-Cache'], 'MISS')
+        self.assertEqual(sparse.data, [{'id': post['id']} for post in full.data])
+
+    def test_profile_fields(self):
+        response = self.client.get(reverse('profile-me'), {'fields': 'username'})
+        self.assertEqual(response.data, {'username': 'me'})
+        response = self.client.get(reverse('user-profile'), {'fields': 'id,user.email'})
+        self.assertEqual(response.data, {'id': self.me.id, 'user': {'email': 'me@example.com'}})
+
+
+class PostMediaWriteTests(TestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def create_post(self, attachments):
+        return self.client.post(reverse('posts-list'), {
+            'title': 'Post', 'training_type': 'run', 'description': '...',
+            'image_urls': [f'https://example.com/{i}.jpg' for i in range(attachments)],
+            'video_urls': [f'https://example.com/{i}.mp4' for i in range(attachments)],
+        }, format='multipart')
+
+    def test_create_uses_a_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            self.create_post(2)
+        with CaptureQueriesContext(connection) as many:
+            response = self.create_post(20)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.data['images']), 20)
+        self.assertEqual(len(response.data['videos']), 20)
+
+    def test_update_only_touches_changed_media(self):
+        post_id = self.create_post(3).data['id']
+        kept, removed, also_kept = PostImage.objects.filter(post_id=post_id).order_by('id')
+        videos = list(PostVideo.objects.filter(post_id=post_id).values_list('id', flat=True))
+
+        response = self.client.put(reverse('posts-detail', args=[post_id]), {
+            'title': 'Edited', 'training_type': 'run', 'description': '...',
+            'existing_images': [kept.id, also_kept.id], 'existing_videos': videos,
+            'image_urls': ['https://example.com/new.jpg'],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['images']), 3)
+        self.assertFalse(PostImage.objects.filter(id=removed.id).exists())
+        self.assertEqual(list(PostVideo.objects.filter(post_id=post_id).values_list('id', flat=True)), videos)
+
+    def test_invalid_existing_ids(self):
+        post_id = self.create_post(1).data['id']
+        response = self.client.put(reverse('posts-detail', args=[post_id]), {
+            'title': 'Edited', 'training_type': 'run', 'description': '...',
+            'existing_images': ['nope'],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class VideoUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root, VIDEO_UPLOAD_TEMP_DIR=os.path.join(media_root, 'tmp'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.me = make_profile('me')
+        self.post = make_posts(self.me, 1)[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+        self.content = os.urandom(1000)
+        response = self.client.post(reverse('video-upload-list'), {'filename': 'clip.mp4', 'size': 1000})
+        self.upload_url = reverse('video-upload-detail', args=[response.data['id']])
+        self.finalize_url = reverse('video-upload-finalize', args=[response.data['id']])
+
+    def put_chunk(self, start, end):
+        return self.client.generic(
+            'PUT', self.upload_url, self.content[start:end + 1],
+            content_type='application/octet-stream', HTTP_CONTENT_RANGE=f'bytes {start}-{end}/1000',
+        )
+
+    def test_chunk_racing_a_finalize_leaves_received_alone(self):
+        # The chunk is written without holding the row; the upload gets
+        # finalized in the meantime.
+        def finalize_meanwhile(*args):
+            VideoUpload.objects.update(status=VideoUpload.STATUS_COMPLETE)
+
+        with patch('pamp_app.views.write_chunk', side_effect=finalize_meanwhile):
+            response = self.put_chunk(0, 399)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(VideoUpload.objects.get().received, 0)
+
+    def test_chunks_resume_and_finalize(self):
+        self.assertEqual(self.put_chunk(0, 399).data['received'], 400)
+        # A chunk past the resume point is rejected with the current offset.
+        response = self.put_chunk(600, 999)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.client.get(self.upload_url).data['received'], 400)
+        # Retrying an overlapping chunk is fine.
+        self.put_chunk(300, 699)
+        self.assertEqual(self.client.post(self.finalize_url, {'post': self.post.id}).status_code, 409)
+        self.assertEqual(self.put_chunk(700, 999).data['received'], 1000)
+
+        response = self.client.post(self.finalize_url, {'post': self.post.id})
+        self.assertEqual(response.status_code, 201)
+        video = PostVideo.objects.get(post=self.post)
+        with video.video.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(self.client.post(self.finalize_url, {'post': self.post.id}).status_code, 409)
+
+    def test_chunk_below_received_is_rejected(self):
+        self.put_chunk(0, 999)
+        with patch('pamp_app.views.write_chunk') as write:
+            response = self.put_chunk(0, 399)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.data['received'], 1000)
+        write.assert_not_called()
+
+    def finalize_and_check_blob(self):
+        response = self.client.post(self.finalize_url, {'post': self.post.id})
+        self.assertEqual(response.status_code, 201)
+        video = PostVideo.objects.get(post=self.post)
+        with video.video.open('rb') as f:
+            stored = f.read()
+        self.assertEqual(stored, self.content)
+        self.assertIn(hashlib.sha256(stored).hexdigest(), video.video.name)
+
+    def test_finalize_waits_for_a_chunk_being_written(self):
+        self.put_chunk(0, 999)
+        temp_path = VideoUpload.objects.get().temp_path
+        release = threading.Event()
+
+        class SlowStream:
+            def read(self, size):
+                release.wait(5)
+                return b'x' * size
+
+        writer = threading.Thread(target=uploads.write_chunk, args=(temp_path, 0, SlowStream(), 100))
+        writer.start()
+        try:
+            time.sleep(0.1)
+            response = self.client.post(self.finalize_url, {'post': self.post.id})
+            self.assertEqual(response.status_code, 409)
+        finally:
+            release.set()
+            writer.join()
+        self.content = b'x' * 100 + self.content[100:]
+        self.finalize_and_check_blob()
+
+    def test_chunk_written_after_finalize_misses_the_blob(self):
+        self.put_chunk(0, 999)
+        temp_path = VideoUpload.objects.get().temp_path
+        opened, finalized = threading.Event(), threading.Event()
+        flock = uploads.fcntl.flock
+        errors = []
+
+        def late_flock(fd, operation):
+            # The writer has the file open, then finalize moves it.
+            if operation == uploads.fcntl.LOCK_SH:
+                opened.set()
+                finalized.wait(5)
+            return flock(fd, operation)
+
+        def write():
+            try:
+                uploads.write_chunk(temp_path, 0, BytesIO(b'x' * 100), 100)
+            except FileNotFoundError as e:
+                errors.append(e)
+
+        with patch('pamp_app.uploads.fcntl.flock', late_flock):
+            writer = threading.Thread(target=write)
+            writer.start()
+            try:
+                self.assertTrue(opened.wait(5))
+                self.finalize_and_check_blob()
+            finally:
+                finalized.set()
+                writer.join()
+        self.assertEqual(len(errors), 1)
+        # The published blob still holds the finalized bytes.
+        video = PostVideo.objects.get(post=self.post)
+        with video.video.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_rejects_bad_ranges(self):
+        response = self.client.generic('PUT', self.upload_url, b'abc', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.generic(
+            'PUT', self.upload_url, b'abc',
+            content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-2/5000',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+def make_image_file(name='photo.png', size=(800, 400), color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, POST_IMAGE_SIZES=[200, 400, 1600], AVATAR_SIZES=[64])
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.me = make_profile('me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def test_post_images_get_size_keyed_variants(self):
+        response = self.client.post(reverse('posts-list'), {
+            'title': 'Post', 'training_type': 'run', 'description': '...',
+            'images': [make_image_file()],
+        }, format='multipart')
+        self.assertEqual(run_pending(), 1)
+        image = PostImage.objects.get(id=response.data['images'][0]['id'])
+        # Widths at or above the original are not rendered.
+        self.assertEqual(set(image.variants), {'200', '400'})
+        with Image.open(image.image.storage.path(image.variants['200'])) as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (200, 100)))
+
+        response = self.client.get(reverse('posts-detail', args=[response.data['id']]))
+        self.assertTrue(response.data['images'][0]['variants']['400'].startswith('http://testserver/media/'))
+
+    def test_upload_queues_every_image_with_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('posts-list'), {
+                'title': 'Post', 'training_type': 'run', 'description': '...',
+                'images': [make_image_file(f'{i}.png', color=(i, 0, 0)) for i in range(3)],
+            }, format='multipart')
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "pamp_app_job"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Job.objects.filter(task='pamp_app.tasks.render_image_variants').count(), 3)
+
+    def test_backfill_skips_files_replaced_meanwhile(self):
+        from concurrent.futures import Future
+
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('a.png')}, format='multipart')
+        other = make_profile('other')
+        self.client.force_authenticate(other.user)
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('b.png', color='blue')},
+                          format='multipart')
+        Job.objects.all().delete()
+        me = self.me
+
+        class ReplacingPool:
+            def submit(self, fn, *args):
+                # `me` uploads a new avatar while the old one is rendered.
+                future = Future()
+                future.set_result(fn(*args))
+                Profile.objects.filter(pk=me.pk).update(avatar='blobs/new.png')
+                return future
+
+        with patch('pamp_app.management.commands.generate_image_variants.get_pool', ReplacingPool):
+            call_command('generate_image_variants', stdout=StringIO())
+        self.me.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.me.avatar_variants, {})
+        self.assertEqual(set(other.avatar_variants), {'64'})
+
+    def test_avatar_variants_are_replaced(self):
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('a.png')}, format='multipart')
+        run_pending()
+        self.me.refresh_from_db()
+        old_avatar, old_variant = self.me.avatar.name, self.me.avatar_variants['64']
+        self.assertTrue(self.me.avatar.storage.exists(old_variant))
+
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('b.png')}, format='multipart')
+        # Old files are removed by the worker, not in the request.
+        self.assertTrue(self.me.avatar.storage.exists(old_avatar))
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.me.refresh_from_db()
+        # Same bytes, so the new avatar is the old blob: nothing to remove.
+        self.assertEqual(self.me.avatar.name, old_avatar)
+        self.assertTrue(self.me.avatar.storage.exists(old_avatar))
+        self.assertTrue(self.me.avatar.storage.exists(old_variant))
+        self.assertIn('64', self.client.get(reverse('user-profile')).data['avatar_variants'])
+
+    def test_replaced_avatar_files_are_removed(self):
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('a.png')}, format='multipart')
+        run_pending()
+        self.me.refresh_from_db()
+        old_avatar, old_variant = self.me.avatar.name, self.me.avatar_variants['64']
+
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('b.png', color='blue')}, format='multipart')
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.assertFalse(self.me.avatar.storage.exists(old_avatar))
+        self.assertFalse(self.me.avatar.storage.exists(old_variant))
+        self.assertIn('64', self.client.get(reverse('user-profile')).data['avatar_variants'])
+
+    def test_profile_etag_changes_when_variants_arrive(self):
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('a.png')}, format='multipart')
+        etag = self.client.get(reverse('profile-me'))['ETag']
+        run_pending()
+        response = self.client.get(reverse('profile-me'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('64', response.data['avatar_variants'])
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, POST_IMAGE_SIZES=[200], AVATAR_SIZES=[64])
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root, VIDEO_UPLOAD_TEMP_DIR=os.path.join(media_root, 'tmp'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.me = make_profile('me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def create_post(self, **files):
+        response = self.client.post(reverse('posts-list'), {
+            'title': 'Post', 'training_type': 'run', 'description': '...', **files,
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.create_post(images=[make_image_file('one.png')])
+        second = self.create_post(images=[make_image_file('two.PNG')])
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file('me.png')}, format='multipart')
+        run_pending()
+
+        names = set(PostImage.objects.values_list('image', flat=True))
+        self.me.refresh_from_db()
+        names.add(self.me.avatar.name)
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(name.startswith('blobs/'))
+        self.assertEqual(MediaBlob.objects.get().refcount, 3)
+
+        storage = self.me.avatar.storage
+        variant = PostImage.objects.first().variants['200']
+        Post.objects.filter(id=first['id']).delete()
+        Post.objects.filter(id=second['id']).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+        self.assertTrue(storage.exists(name))
+        self.assertTrue(storage.exists(variant))
+
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file(color='green')}, format='multipart')
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(storage.exists(variant))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_rolled_back_delete_keeps_the_file(self):
+        self.client.patch(reverse('profile-me'), {'avatar': make_image_file()}, format='multipart')
+        self.me.refresh_from_db()
+        storage, name = self.me.avatar.storage, self.me.avatar.name
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    storage.delete(name)
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+        self.assertTrue(MediaBlob.objects.filter(name=name).exists())
+        self.assertTrue(storage.exists(name))
+
+    def test_chunked_video_is_stored_by_digest(self):
+        data = b'video-bytes' * 100
+        for _ in range(2):
+            upload = self.client.post(reverse('video-upload-list'), {'filename': 'v.mp4', 'size': len(data)}).data
+            url = reverse('video-upload-detail', args=[upload['id']])
+            self.client.generic(
+                'PUT', url, data, content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE=f'bytes 0-{len(data) - 1}/{len(data)}',
+            )
+            post = self.create_post()
+            self.client.post(reverse('video-upload-finalize', args=[upload['id']]), {'post': post['id']})
+
+        expected = hashlib.sha256(data).hexdigest()
+        self.assertEqual(
+            set(PostVideo.objects.values_list('video', flat=True)),
+            {f'blobs/{expected[:2]}/{expected[2:4]}/{expected}.mp4'},
+        )
+        self.assertEqual(MediaBlob.objects.get(digest=expected).refcount, 2)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'tmp')), [])
+
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.registry = patch.dict(jobs.registry, {
+            'test.record': lambda value: self.calls.append(value),
+            'test.fail': self.fail_task,
+        })
+        self.registry.start()
+        self.addCleanup(self.registry.stop)
+
+    def fail_task(self):
+        raise RuntimeError('boom')
+
+    def test_priority_order(self):
+        jobs.enqueue('test.record', 'low')
+        jobs.enqueue('test.record', 'high', priority=10)
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(self.calls, ['high', 'low'])
+        self.assertEqual(Job.objects.filter(status=Job.STATUS_DONE).count(), 2)
+
+    def test_future_jobs_wait(self):
+        jobs.enqueue('test.record', 'later', run_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(run_pending(), 0)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2, JOB_BACKOFF_BASE=60)
+    def test_retries_with_backoff_then_fails(self):
+        job = jobs.enqueue('test.fail')
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_QUEUED, 1))
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertLessEqual(job.run_at, timezone.now() + timedelta(seconds=60))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = jobs.enqueue('test.record', 'x')
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.STATUS_RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        run_pending()
+        self.assertEqual(self.calls, ['x'])
+
+    def test_stale_job_on_its_last_attempt_fails(self):
+        job = jobs.enqueue('test.record', 'x', max_attempts=2)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.STATUS_RUNNING, attempts=2, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        run_pending()
+        self.assertEqual(self.calls, [])
+
+
+class JobClaimTests(TransactionTestCase):
+    def test_locked_jobs_are_skipped(self):
+        first = jobs.enqueue('test.record', 1)
+        second = jobs.enqueue('test.record', 2)
+        claimed = []
+
+        with transaction.atomic():
+            # Hold a row lock on the first job as another worker would.
+            Job.objects.select_for_update().get(pk=first.pk)
+
+            def other_worker():
+                claimed.append(jobs.claim())
+                connection.close()
+
+            thread = threading.Thread(target=other_worker)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(claimed[0].pk, second.pk)
+
+    def test_heartbeat_keeps_a_slow_job_from_being_requeued(self):
+        jobs.enqueue('test.record', 1)
+        job = jobs.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        with jobs.heartbeat(job, interval=0.05):
+            time.sleep(0.2)
+        self.assertEqual(jobs.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_RUNNING)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        self.client = APIClient()
+
+    def test_training_sessions_for_bot(self):
+        today = timezone.now().date()
+        TrainingSession.objects.create(profile=self.me, date=today - timedelta(days=1), time='08:00')
+        upcoming = TrainingSession.objects.create(profile=self.me, date=today + timedelta(days=1), time='08:00')
+        url = reverse('user-training-sessions')
+
+        self.assertEqual(self.client.get(url, {'id': self.me.user.id}).status_code, 401)
+
+        _, key = APIKey.objects.create_key(name='bot')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Api-Key {key}')
+        response = self.client.get(url, {'id': self.me.user.id})
+        self.assertEqual([session['id'] for session in response.data], [upcoming.id])
+        self.assertEqual(self.client.get(url, {'id': 0}).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_telegram_link_status(self):
+        url = reverse('link-telegram-status')
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        self.client.force_authenticate(self.me.user)
+        self.assertEqual(self.client.get(url).data, {'linked': False, 'status': 'no_link'})
+        link = TelegramLink.objects.create(user=self.me.user)
+        self.assertEqual(self.client.get(url).data['status'], 'pending')
+        link.telegram_user_id = '42'
+        link.save()
+        self.assertEqual(self.client.get(url).data, {'linked': True})
+
+    def test_bulk_training_sessions(self):
+        other = make_profile('other')
+        unlinked = make_profile('unlinked')
+        today = timezone.now().date()
+        for profile in (self.me, other, unlinked):
+            TrainingSession.objects.create(profile=profile, date=today + timedelta(days=2), time='09:00')
+            TrainingSession.objects.create(profile=profile, date=today + timedelta(days=1), time='18:00')
+            TrainingSession.objects.create(profile=profile, date=today - timedelta(days=1), time='09:00')
+        TelegramLink.objects.create(user=self.me.user, telegram_user_id='100')
+        TelegramLink.objects.create(user=other.user, telegram_user_id='200')
+        TelegramLink.objects.create(user=unlinked.user)
+
+        _, key = APIKey.objects.create_key(name='bot')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Api-Key {key}')
+        url = reverse('user-training-sessions-bulk')
+
+        response = self.client.get(url, {'ids': f'{self.me.user.id},{other.user.id},0'})
+        self.assertEqual(set(response.data), {str(self.me.user.id), str(other.user.id), '0'})
+        self.assertEqual(response.data['0'], [])
+        mine = response.data[str(self.me.user.id)]
+        self.assertEqual([session['time'] for session in mine], ['18:00:00', '09:00:00'])
+        self.assertEqual(self.client.get(url, {'ids': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+        response = self.client.get(url, {'linked': 'true'})
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = [json.loads(line) for line in async_to_sync(read)().decode().splitlines()]
+        self.assertEqual(
+            [(line['user_id'], line['telegram_user_id'], len(line['sessions'])) for line in lines],
+            [(self.me.user.id, '100', 2), (other.user.id, '200', 2)],
+        )
+
+
+class RecurrenceTests(TestCase):
+    def test_parse_days(self):
+        self.assertEqual(recurrence.weekdays(recurrence.parse_days('Mon, wed пт')), [0, 2, 4])
+        self.assertEqual(recurrence.weekdays(recurrence.parse_days('1 7')), [0, 6])
+        self.assertEqual(recurrence.weekdays(recurrence.parse_days('fri-mon')), [0, 4, 5, 6])
+        self.assertEqual(recurrence.parse_days(''), 0)
+        with self.assertRaises(ValueError):
+            recurrence.parse_days('someday')
+
+    def test_expand(self):
+        # 2024-01-01 is a Monday.
+        start = date(2024, 1, 1)
+        weekly = recurrence.Rule(start.toordinal(), recurrence.parse_days('mon,thu'))
+        days = [date.fromordinal(o) for o in recurrence.expand(weekly, date(2023, 12, 1), date(2024, 1, 15))]
+        self.assertEqual(days, [date(2024, 1, 1), date(2024, 1, 4), date(2024, 1, 8), date(2024, 1, 11), date(2024, 1, 15)])
+        once = recurrence.Rule(start.toordinal(), 0)
+        self.assertEqual(recurrence.expand(once, date(2024, 1, 2), date(2024, 2, 1)), [])
+
+    def test_occurrences_endpoint(self):
+        me, other = make_profile('me'), make_profile('other')
+        weekly = TrainingSession.objects.create(
+            profile=me, date=date(2024, 1, 1), time='07:00', recurrence='weekly', days_of_week='mon, wed')
+        once = TrainingSession.objects.create(profile=me, date=date(2024, 3, 6), time='19:00')
+        TrainingSession.objects.create(profile=other, date=date(2024, 5, 1), time='09:00')
+        TelegramLink.objects.create(user=me.user, telegram_user_id='100')
+
+        client = APIClient()
+        _, key = APIKey.objects.create_key(name='bot')
+        client.credentials(HTTP_AUTHORIZATION=f'Api-Key {key}')
+        url = reverse('user-training-sessions-occurrences')
+
+        response = client.get(url, {'ids': f'{me.user.id},{other.user.id}', 'from': '2024-03-04', 'to': '2024-03-10'})
+        self.assertEqual(response.data[str(other.user.id)], [])
+        self.assertEqual(
+            [(o['session'], o['date']) for o in response.data[str(me.user.id)]],
+            [(weekly.id, '2024-03-04'), (weekly.id, '2024-03-06'), (once.id, '2024-03-06')],
+        )
+        self.assertEqual(client.get(url, {'ids': me.user.id, 'from': '2024-03-10', 'to': '2024-03-01'}).status_code, 400)
+        self.assertEqual(client.get(url, {'ids': me.user.id, 'from': '2024-01-01', 'to': '2025-06-01'}).status_code, 400)
+
+        response = client.get(url, {'linked': 'true', 'from': '2024-01-01', 'to': '2024-12-31'})
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = [json.loads(line) for line in async_to_sync(read)().decode().splitlines()]
+        self.assertEqual([line['user_id'] for line in lines], [me.user.id])
+        # 53 Mondays and 52 Wednesdays in 2024, plus the one-off session.
+        self.assertEqual(len(lines[0]['sessions']), 106)
+
+    def test_weekly_sessions_stay_upcoming(self):
+        me = make_profile('me')
+        weekly = TrainingSession.objects.create(
+            profile=me, date=timezone.now().date() - timedelta(days=30), time='07:00', recurrence='weekly')
+        client = APIClient()
+        _, key = APIKey.objects.create_key(name='bot')
+        client.credentials(HTTP_AUTHORIZATION=f'Api-Key {key}')
+        response = client.get(reverse('user-training-sessions'), {'id': me.user.id})
+        self.assertEqual([session['id'] for session in response.data], [weekly.id])
+        self.assertEqual(response.data[0]['weekdays'], [weekly.date.weekday()])
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me.user)
+
+    def read(self, response):
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(read)().decode()
+
+    def feed_url(self):
+        url = self.client.get(reverse('calendar-feed')).data['url']
+        return url.replace('http://testserver', '')
+
+    def test_feed(self):
+        weekly = TrainingSession.objects.create(
+            profile=self.me, date=date(2024, 1, 1), time='07:00', recurrence='weekly', days_of_week='mon, wed')
+        TrainingSession.objects.create(profile=self.me, date=date(2024, 3, 6), time='19:30')
+        TrainingSession.objects.create(profile=make_profile('other'), date=date(2024, 3, 6), time='19:30')
+        url = self.feed_url()
+        self.assertEqual(url, self.feed_url())
+
+        anonymous = APIClient()
+        response = anonymous.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/calendar'))
+        body = self.read(response)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:session-{weekly.id}@testserver', body)
+        self.assertIn('DTSTART;TZID=Europe/Lisbon:20240101T070000', body)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO,WE', body)
+
+        etag = response['ETag']
+        with self.assertNumQueries(2):
+            self.assertEqual(anonymous.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        weekly.time = '08:00'
+        weekly.save()
+        response = anonymous.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('DTSTART;TZID=Europe/Lisbon:20240101T080000', self.read(response))
+        weekly.delete()
+        self.assertNotEqual(anonymous.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_rotate_token(self):
+        old = self.feed_url()
+        new = self.client.post(reverse('calendar-feed')).data['url'].replace('http://testserver', '')
+        self.assertNotEqual(old, new)
+        self.assertEqual(APIClient().get(old).status_code, 404)
+        self.assertEqual(APIClient().get(new).status_code, 200)
+
+    def test_weekly_start_moves_to_first_matching_day(self):
+        # 2024-01-03 is a Wednesday; the rule only matches Fridays and Mondays.
+        TrainingSession.objects.create(
+            profile=self.me, date=date(2024, 1, 3), time='07:00', recurrence='weekly', days_of_week='fri, mon')
+        body = self.read(APIClient().get(self.feed_url()))
+        self.assertIn('DTSTART;TZID=Europe/Lisbon:20240105T070000', body)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO,FR', body)
+
+    def test_feed_defines_its_timezone(self):
+        body = self.read(APIClient().get(self.feed_url()))
+        self.assertIn('BEGIN:VTIMEZONE\r\nTZID:Europe/Lisbon\r\n', body)
+        self.assertIn(
+            'BEGIN:DAYLIGHT\r\nDTSTART:19700329T010000\r\nTZOFFSETFROM:+0000\r\nTZOFFSETTO:+0100\r\n'
+            'TZNAME:WEST\r\nRRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU\r\nEND:DAYLIGHT\r\n', body)
+        self.assertIn('TZOFFSETFROM:+0100\r\nTZOFFSETTO:+0000\r\n', body)
+        self.assertIn('BEGIN:STANDARD\r\nDTSTART:19700101T000000\r\nTZOFFSETFROM:+0900\r\n',
+                      ical.vtimezone('Asia/Tokyo', 2024))
+
+    def test_long_lines_are_folded(self):
+        line = ical.fold('X-' + 'ж' * 100)
+        pieces = line[:-2].split('\r\n ')
+        self.assertTrue(all(len(piece.encode()) <= 75 for piece in pieces))
+        self.assertEqual(''.join(pieces), 'X-' + 'ж' * 100)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        caches[settings.AUTH_CACHE].clear()
+        self.me = make_profile('me')
+        self.client = APIClient()
+        access = tokens_for_user(self.me.user).access_token
+        self.assertEqual(access['profile_id'], self.me.id)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.url = reverse('user-profile')
+
+    def test_reads_cost_no_auth_queries(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Only the profile itself, which profile reads always load fresh.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['user']['username'], 'me')
+
+    def test_profile_edit_shows_up_despite_a_stale_principal(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        # Another worker still holds the principal from before the edit.
+        self.client.get(reverse('profile-me'))
+        stale = caches[settings.AUTH_CACHE].get(principal_key(self.me.user_id))
+        with self.settings(MEDIA_ROOT=media_root):
+            self.client.patch(reverse('profile-me'), {'avatar': make_image_file()}, format='multipart')
+        caches[settings.AUTH_CACHE].set(principal_key(self.me.user_id), stale)
+
+        response = self.client.get(reverse('profile-me'))
+        self.assertTrue(response.data['avatar'])
+        self.assertTrue(self.client.get(self.url).data['avatar'])
+
+    def test_token_endpoint_adds_profile_claim(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'me', 'password': 'pass12345'})
+        self.assertEqual(AccessToken(response.data['access'])['profile_id'], self.me.id)
+
+    def test_changes_invalidate_the_cache(self):
+        self.client.get(self.url)
+        self.me.user.is_active = False
+        self.me.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_writes_load_the_principal_fresh(self):
+        self.client.get(self.url)
+        Profile.objects.filter(pk=self.me.pk).update(calendar_token='changed-elsewhere')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('calendar-feed'))
+        self.assertIn('pamp_app_profile', queries[0]['sql'])
+
+
+class TrainingSessionChangeFeedTests(TransactionTestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        TelegramLink.objects.create(user=self.me.user, telegram_user_id='100')
+        _, key = APIKey.objects.create_key(name='bot')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Api-Key {key}')
+        self.url = reverse('user-training-sessions-changes')
+
+    def changes(self, cursor):
+        return self.client.get(self.url, {'cursor': cursor}).data
+
+    def create_session(self, days=1):
+        return TrainingSession.objects.create(
+            profile=self.me, date=timezone.now().date() + timedelta(days=days), time='08:00')
+
+    def test_changes_since_cursor(self):
+        kept = self.create_session()
+        cursor = self.client.get(self.url).data['next_cursor']
+        self.assertEqual(self.changes(cursor)['changes'], [])
+
+        moved = self.create_session()
+        moved.time = '19:30'
+        moved.save()
+        kept_id = kept.id
+        kept.delete()
+        data = self.changes(cursor)
+        self.assertEqual([(c['id'], c['deleted']) for c in data['changes']], [(moved.id, False), (kept_id, True)])
+        self.assertEqual(data['changes'][0]['session']['time'], '19:30:00')
+        self.assertEqual(data['changes'][0]['telegram_user_id'], '100')
+        self.assertEqual(self.changes(data['next_cursor'])['changes'], [])
+
+        with override_settings(SESSION_CHANGES_PAGE_SIZE=1):
+            data = self.changes(cursor)
+            self.assertTrue(data['has_more'])
+            self.assertEqual(len(data['changes']), 1)
+
+    def test_pruned_cursor_is_gone(self):
+        self.create_session()
+        cursor = self.client.get(self.url).data['next_cursor']
+        TrainingSessionChange.objects.all().delete()
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 410)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 400)
+
+    def test_later_commits_wait_for_older_transactions(self):
+        cursor = self.client.get(self.url).data['next_cursor']
+        seen = []
+
+        def in_thread(func):
+            def run():
+                func()
+                connection.close()
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+
+        with transaction.atomic():
+            slow = self.create_session()
+            # A younger transaction commits while this one is still open.
+            in_thread(lambda: self.create_session(days=2))
+            in_thread(lambda: seen.append(self.changes(cursor)['changes']))
+        seen.append(self.changes(cursor)['changes'])
+
+        self.assertEqual(seen[0], [])
+        self.assertEqual(len(seen[1]), 2)
+        self.assertEqual(seen[1][0]['id'], slow.id)
+
+
+class OutboxTests(TransactionTestCase):
+    def setUp(self):
+        self.me = make_profile('me')
+        self.received = []
+
+    def session(self, **kwargs):
+        return TrainingSession.objects.create(
+            profile=self.me, date=timezone.now().date() + timedelta(days=1), time='08:00', **kwargs)
+
+    def client_for(self, status_code=204):
+        def handler(request):
+            self.received.append(json.loads(request.content))
+            return httpx.Response(status_code)
+        return httpx.Client(transport=httpx.MockTransport(handler))
+
+    def test_events_commit_with_the_change(self):
+        session = self.session()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.session()
+            raise RuntimeError
+        session_id = session.id
+        session.delete()
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('id').values_list('topic', 'payload__id')),
+            [('session.saved', session_id), ('session.deleted', session_id)],
+        )
+        self.assertEqual(OutboxEvent.objects.get(topic='session.deleted').payload['user_id'], self.me.user_id)
+
+    def test_dispatch_marks_events_sent(self):
+        self.session()
+        self.session()
+        with self.client_for(status_code=503) as client, self.assertRaises(httpx.HTTPStatusError):
+            outbox.dispatch_batch(client)
+        self.assertEqual(OutboxEvent.objects.filter(dispatched_at__isnull=True).count(), 2)
+
+        with override_settings(OUTBOX_BATCH_SIZE=1), self.client_for() as client:
+            self.assertEqual(outbox.drain(client), 2)
+        self.assertFalse(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+        self.assertEqual([len(batch['events']) for batch in self.received[1:]], [1, 1])
+
+    @override_settings(OUTBOX_TOKEN='')
+    def test_dispatcher_needs_a_token(self):
+        with self.assertRaises(CommandError):
+            call_command('dispatch_outbox', stdout=StringIO())
+
+    @override_settings(OUTBOX_TOKEN='secret')
+    def test_client_sends_the_token(self):
+        with outbox.get_client() as client:
+            self.assertEqual(client.headers['X-Outbox-Token'], 'secret')
+
+    def test_push_holds_no_transaction(self):
+        self.session()
+
+        def handler(request):
+            self.received.append(connection.in_atomic_block)
+            # Another dispatcher sees the batch as claimed, not as locked.
+            self.assertEqual(outbox.claim_batch(), [])
+            return httpx.Response(204)
+
+        with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+            self.assertEqual(outbox.dispatch_batch(client), 1)
+        self.assertEqual(self.received, [False])
+
+    def test_expired_claim_is_taken_over(self):
+        self.session()
+        self.assertEqual(len(outbox.claim_batch()), 1)
+        self.assertEqual(outbox.claim_batch(), [])
+        OutboxEvent.objects.update(claimed_at=timezone.now() - timedelta(seconds=120))
+        with override_settings(OUTBOX_CLAIM_TIMEOUT=60):
+            self.assertEqual(len(outbox.claim_batch()), 1)
+
+    def test_telegram_confirmation_event_carries_sessions(self):
+        session = self.session()
+        link = TelegramLink.objects.create(user=self.me.user)
+        response = APIClient().post(
+            reverse('link-telegram-confirm'), {'code': str(link.linking_code), 'telegram_user_id': '100'})
+        self.assertEqual(response.status_code, 200)
+        event = OutboxEvent.objects.get(topic='telegram.linked')
+        self.assertEqual(event.payload['telegram_user_id'], '100')
+        self.assertEqual([s['id'] for s in event.payload['sessions']], [session.id])
+
+    def test_notify_wakes_the_dispatcher(self):
+        outbox.listen()
+
+        def write():
+            self.session()
+            connection.close()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+        started = time.monotonic()
+        outbox.wait_for_events(5)
+        self.assertLess(time.monotonic() - started, 4)
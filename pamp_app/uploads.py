@@ -0,0 +1,87 @@
+# pamp_app/uploads.py
+"""
+Chunked uploads are written into one temporary file per upload. Chunk
+writers hold a shared flock on it while they write; finalize takes it
+exclusively before hashing and moving the file into storage, so no
+chunk can change the bytes of a published blob.
+"""
+import fcntl
+import os
+import re
+
+from django.core.files import File
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_SIZE = 64 * 1024
+
+
+class IncompleteChunk(Exception):
+    pass
+
+
+class PartialUploadFile(File):
+    """
+    A finished chunked upload on disk. Exposing temporary_file_path() lets
+    FileSystemStorage move it into place instead of copying it.
+    """
+
+    def __init__(self, path, name):
+        super().__init__(open(path, 'rb'), name=name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+    def lock(self):
+        """Lock out chunk writers; False while one is still writing."""
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+
+def parse_content_range(header):
+    """Parse `bytes start-end/total` into a (start, end, total) tuple."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise ValueError('Content-Range must look like "bytes start-end/total".')
+    start, end, total = (int(group) for group in match.groups())
+    if start > end or end >= total:
+        raise ValueError('Content-Range is out of bounds.')
+    return start, end, total
+
+
+def create_temp_file(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def write_chunk(path, start, stream, length):
+    """
+    Copy `length` bytes from `stream` into the file at offset `start`,
+    READ_SIZE at a time, so a chunk is never held in memory as a whole.
+    Raises FileNotFoundError if the upload was finalized or aborted.
+    """
+    remaining = length
+    with open(path, 'r+b') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+        # Opened before a finalize moved the file into storage: this is
+        # the published blob now, not the upload.
+        opened, current = os.fstat(f.fileno()), os.stat(path)
+        if (opened.st_dev, opened.st_ino) != (current.st_dev, current.st_ino):
+            raise FileNotFoundError(path)
+        f.seek(start)
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                raise IncompleteChunk(f'Chunk ended after {length - remaining} of {length} bytes.')
+            f.write(data)
+            remaining -= len(data)
+
+
+def remove_temp_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
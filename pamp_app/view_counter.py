@@ -0,0 +1,148 @@
+# pamp_app/view_counter.py
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from . import feed_cache
+from .checks import LOCAL_CACHE_BACKENDS
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class PostViewBuffer:
+    """
+    Write-behind counter for Post.views.
+
+    Hits are counted in a per-process Counter and never touch the database
+    on the request path, so a popular post costs one row write per
+    POST_VIEWS_FLUSH_INTERVAL instead of one per hit.
+
+    With a cache shared between processes (see pamp_app/checks.py), every
+    interval a request moves its process's counts into a shared buffer in
+    the cache, without waiting for the buffer's lock, and the periodic
+    `flush_post_views` job (pamp_app/tasks.py) writes all pending deltas
+    with one UPDATE. Feed pages carry view counts, so a flush that wrote
+    any moves the feed version on. With a process-local cache nobody else can see the
+    counts, so each process writes them itself from a background thread.
+    """
+    pending_key = 'post_views:pending'
+    lock_key = 'post_views:lock'
+    lock_timeout = 10
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    @property
+    def cache(self):
+        return caches[settings.POST_VIEWS_CACHE]
+
+    @property
+    def shared(self):
+        return settings.CACHES[settings.POST_VIEWS_CACHE]['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+    def record(self, post_id):
+        with self._lock:
+            self._counts[post_id] += 1
+            now = time.monotonic()
+            due = now - self._last_flush >= settings.POST_VIEWS_FLUSH_INTERVAL
+            if due:
+                self._last_flush = now
+        if not due:
+            return
+        if self.shared:
+            self.spill(wait=0)
+        else:
+            threading.Thread(target=self._flush_in_thread, name='post-views-flush', daemon=True).start()
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush post views")
+        finally:
+            connections.close_all()
+
+    def _restore(self, counts):
+        with self._lock:
+            self._counts.update(counts)
+
+    @contextmanager
+    def _shared_lock(self, wait=1.0):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        acquired = self.cache.add(self.lock_key, token, timeout=self.lock_timeout)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.01)
+            acquired = self.cache.add(self.lock_key, token, timeout=self.lock_timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired and self.cache.get(self.lock_key) == token:
+                self.cache.delete(self.lock_key)
+
+    def spill(self, wait=1.0):
+        """Move this process's counts into the shared buffer."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        with self._shared_lock(wait) as acquired:
+            if not acquired:
+                # Somebody else is flushing; keep the counts for next time.
+                self._restore(counts)
+                return
+            pending = Counter(self.cache.get(self.pending_key) or {})
+            pending.update(counts)
+            self.cache.set(self.pending_key, dict(pending), timeout=None)
+
+    def flush(self, wait=1.0):
+        """
+        Write every buffered delta to the database with a single UPDATE.
+        Returns the number of views written.
+        """
+        self.spill(wait)
+        with self._shared_lock(wait) as acquired:
+            if not acquired:
+                return 0
+            pending = self.cache.get(self.pending_key) or {}
+            self.cache.delete(self.pending_key)
+        if not pending:
+            return 0
+
+        delta = Case(
+            *[When(pk=pk, then=Value(count)) for pk, count in pending.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        try:
+            updated = Post.objects.filter(pk__in=pending.keys()).update(views=F('views') + delta)
+        except DatabaseError:
+            logger.exception("Failed to flush %d post view counters", len(pending))
+            self._restore(pending)
+            return 0
+        if updated:
+            transaction.on_commit(feed_cache.bump_version)
+        return sum(pending.values())
+
+
+post_views = PostViewBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        post_views.flush()
+    except Exception:
+        logger.exception("Failed to flush post views on shutdown")
@@ -1,16 +1,18 @@
 from django.shortcuts import render,get_object_or_404
-from rest_framework import viewsets, permissions, status
+from rest_framework import viewsets, permissions, status, mixins
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from pamp_app.authentication import tokens_for_user
 from rest_framework.decorators import api_view , action , permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework_api_key.permissions import HasAPIKey
-from .models import Profile, Post,TrainingSession,TelegramLink
+from .models import Profile, Post, PostVideo, TrainingSession, TelegramLink, VideoUpload
 
 
 from rest_framework.views import APIView
 import uuid
+import json
+from datetime import date, timedelta
 import logging
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -19,6 +21,24 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
 from  pamp_app.permissions import IsOwnerOrReadOnly
+from pamp_app.async_views import AsyncAPIView
+from pamp_app.pagination import PostKeysetPagination, PostSearchPagination
+from pamp_app.view_counter import post_views
+from pamp_app import feed_cache, ical, recurrence, session_changes
+from pamp_app.conditional import conditional_get, make_etag, not_modified, set_validators
+from pamp_app.uploads import (
+    IncompleteChunk,
+    PartialUploadFile,
+    create_temp_file,
+    parse_content_range,
+    remove_temp_file,
+    write_chunk,
+)
+from django.conf import settings
+from django.db import transaction
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from django.db.models.functions import Greatest
 
 
 #from datetime import timedelta
@@ -34,6 +54,10 @@ from  pamp_app.permissions import IsOwnerOrReadOnly
 from .serializers import (
     ProfileSerializer,
     PostSerializer,
+    PostListSerializer,
+    PostVideoSerializer,
+    VideoUploadSerializer,
+    parse_fields_param,
     TrainingSessionSerializer,
     RegisterSerializer,
     LoginSerializer,
@@ -42,7 +66,8 @@ from .serializers import (
 )
 
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from allauth.socialaccount.providers.oauth2.client import OAuth2Client
@@ -67,6 +92,25 @@ def google_callback(request):
 
 
 
+def own_profile(request):
+    """
+    The requester's profile with its user, read fresh: the cached principal
+    on request.user may predate an edit made through another process.
+    """
+    return get_object_or_404(Profile.objects.select_related('user'), user_id=request.user.pk)
+
+
+def profile_etag(request, profile):
+    # Everything ProfileSerializer renders, without touching the database.
+    user = profile.user
+    return make_etag(
+        'profile', profile.pk, user.pk, user.username, user.email, profile.avatar.name,
+        # Filled in by a background job some time after the avatar upload.
+        json.dumps(profile.avatar_variants, sort_keys=True),
+        request.get_full_path(),
+    )
+
+
 class ProfileViewSet(viewsets.ModelViewSet):
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -74,11 +118,15 @@ class ProfileViewSet(viewsets.ModelViewSet):
    
     @action(detail=False, methods=['get', 'put', 'patch'], url_path='me')
     def me(self, request):
-        profile = get_object_or_404(Profile, user=request.user)
         if request.method == 'GET':
-            serializer = self.get_serializer(profile)
-            return Response(serializer.data)
+            profile = own_profile(request)
+            return conditional_get(
+                request,
+                lambda: Response(self.get_serializer(profile).data),
+                etag=profile_etag(request, profile),
+            )
         elif request.method in ['PUT', 'PATCH']:
+            profile = get_object_or_404(Profile, user=request.user)
             serializer = self.get_serializer(profile, data=request.data, partial=(request.method == 'PATCH'))
             serializer.is_valid(raise_exception=True)
             serializer.save()
@@ -87,6 +135,11 @@ class ProfileViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Profile.objects.filter(user=self.request.user)
 
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET':
+            kwargs.setdefault('fields', parse_fields_param(self.request.query_params.get('fields')))
+        return super().get_serializer(*args, **kwargs)
+
 
 
 
@@ -98,6 +151,7 @@ class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.all().order_by('-created_at')
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = PostKeysetPagination
 
 
 
@@ -130,8 +184,9 @@ class PostViewSet(viewsets.ModelViewSet):
         """
         Optionally restricts the returned posts to the current user,
         by filtering against a `mine` query parameter in the URL.
+        Ordering matches PostKeysetPagination so both use the same index.
         """
-        queryset = Post.objects.all().order_by('-created_at')
+        queryset = Post.objects.order_by('-created_at', '-id')
         mine = self.request.query_params.get('mine')
         exclude_mine = self.request.query_params.get('exclude_mine')
 
@@ -142,12 +197,286 @@ class PostViewSet(viewsets.ModelViewSet):
         elif exclude_mine == 'true':
             queryset = queryset.exclude(profile=self.request.user.profile)
             
+        return self.shape_queryset(queryset)
+
+    def shape_queryset(self, queryset):
+        """
+        Only load what the requested representation renders: relations
+        left out by `fields` / `compact` are neither joined nor prefetched.
+        """
+        if self.request.method != 'GET':
+            return queryset.with_related()
+        rendered = set(self.get_serializer().fields)
+        queryset = queryset.with_related(
+            profile='profile' in rendered,
+            images='images' in rendered,
+            videos='videos' in rendered,
+        )
+        if 'description' not in rendered:
+            queryset = queryset.defer('description')
+        if 'thumbnail' in rendered:
+            queryset = queryset.with_thumbnail()
         return queryset
 
+    def get_serializer_class(self):
+        if self.request.method == 'GET' and self.request.query_params.get('compact') == 'true':
+            return PostListSerializer
+        return PostSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET':
+            params = self.request.query_params
+            kwargs.setdefault('fields', parse_fields_param(params.get('fields')))
+            if self.get_serializer_class() is PostListSerializer:
+                kwargs.setdefault('expand', parse_fields_param(params.get('expand')))
+        return super().get_serializer(*args, **kwargs)
+
 
     def perform_create(self, serializer):
         serializer.save(profile=self.request.user.profile)
 
+    def list(self, request, *args, **kwargs):
+        # Any post or media write bumps the feed version, so it validates
+        # every list variant; the query string tells the variants apart.
+        etag = make_etag(
+            'posts', feed_cache.get_version(), request.user.pk,
+            request.get_host(), request.get_full_path(),
+        )
+
+        def build():
+            if request.query_params.get('mine') != 'true' and request.query_params.get('exclude_mine') == 'true':
+                return self.cached_feed(request)
+            return super(PostViewSet, self).list(request, *args, **kwargs)
+
+        return conditional_get(request, build, etag=etag, last_modified=feed_cache.last_modified())
+
+    def cached_feed(self, request):
+        """
+        Serve the shared `exclude_mine` feed from the versioned feed cache.
+        Pages are cached once for every reader and the reader's own posts
+        are dropped from them; when that leaves a page short, the following
+        shared pages fill it up, so every page but the last is full.
+        """
+        paginator = self.paginator
+        paginated = paginator.is_requested(request)
+        cursor = request.query_params.get(paginator.cursor_query_param) if paginated else None
+        page_size = paginator.get_page_size(request) if paginated else None
+        shape = [request.query_params.get(name) for name in ('compact', 'fields', 'expand')]
+        version = feed_cache.get_version()
+        profile_id = request.user.profile.id
+
+        results, hit = [], True
+        while True:
+            page = self.shared_feed_page(request, version, cursor, page_size, shape)
+            hit = hit and page['hit']
+            items = feed_cache.exclude_profile(page['results'], profile_id)
+            if not paginated:
+                results = [data for _, data in items]
+                break
+            room = page_size - len(results)
+            results += [data for _, data in items[:room]]
+            if len(items) > room:
+                # Full in the middle of a shared page: carry on after the
+                # last post served.
+                next_cursor = items[room - 1][0]
+                break
+            next_cursor = cursor = page['next_cursor']
+            if len(results) == page_size or cursor is None:
+                break
+
+        if paginated:
+            response = paginator.get_cached_response(request, results, next_cursor)
+        else:
+            response = Response(results)
+        response['X-Feed-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    def shared_feed_page(self, request, version, cursor, page_size, shape):
+        """One page of the whole feed, as every reader sees it."""
+        key = feed_cache.page_key(request, version, cursor, page_size, shape)
+        page = feed_cache.get_page(key)
+        if page is not None:
+            return {**page, 'hit': True}
+
+        paginator = self.paginator
+        queryset = self.shape_queryset(Post.objects.order_by('-created_at', '-id'))
+        if page_size is None:
+            posts = list(queryset)
+        else:
+            posts = paginator.paginate_page(queryset, request, cursor, page_size)
+        context = {**self.get_serializer_context(), 'shared': True}
+        serializer = self.get_serializer(posts, many=True, context=context)
+        page = {
+            # Sparse fieldsets may drop the profile, so keep the author next
+            # to each item for the per-reader filter, and the item's cursor
+            # for pages that end in the middle of this one.
+            'results': [
+                (post.profile_id, paginator.encode_cursor(post), data)
+                for post, data in zip(posts, serializer.data)
+            ],
+            'next_cursor': paginator.next_cursor if page_size is not None else None,
+        }
+        feed_cache.set_page(key, page)
+        return {**page, 'hit': False}
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        post_views.record(instance.pk)
+        etag = make_etag(
+            'post', instance.pk, instance.updated_at.isoformat(), instance.views,
+            feed_cache.get_version(), request.user.pk, request.get_host(), request.get_full_path(),
+        )
+        # Media and author changes leave Post.updated_at alone but bump the
+        # feed, so the later of the two bounds the rendered post.
+        return conditional_get(
+            request,
+            lambda: Response(self.get_serializer(instance).data),
+            etag=etag,
+            last_modified=max(instance.updated_at, feed_cache.last_modified()),
+        )
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Full-text search over title, training_type and description.
+        Accepts websearch syntax in `q` and honours `mine` / `exclude_mine`.
+        """
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return Response({"detail": "q is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        query = SearchQuery(q, search_type='websearch', config='english')
+        queryset = (
+            self.get_queryset()
+            .filter(search_vector=query)
+            .annotate(rank=SearchRank(F('search_vector'), query))
+            .order_by('-rank', '-created_at', '-id')
+        )
+
+        paginator = PostSearchPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+
+
+
+class VideoUploadViewSet(mixins.CreateModelMixin,
+                         mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin,
+                         viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads for post videos.
+
+    POST   /api/video-uploads/                {filename, size} opens a session
+    PUT    /api/video-uploads/<id>/           raw bytes with a Content-Range header
+    GET    /api/video-uploads/<id>/           `received` is where to resume
+    POST   /api/video-uploads/<id>/finalize/  {post} attaches the file as a PostVideo
+    DELETE /api/video-uploads/<id>/           aborts the upload
+    """
+    serializer_class = VideoUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return VideoUpload.objects.filter(profile__user=self.request.user)
+
+    def perform_create(self, serializer):
+        upload = serializer.save(profile=self.request.user.profile)
+        create_temp_file(upload.temp_path)
+
+    def perform_destroy(self, instance):
+        remove_temp_file(instance.temp_path)
+        instance.delete()
+
+    def update(self, request, *args, **kwargs):
+        upload = self.get_object()
+        try:
+            start, end, total = parse_content_range(request.headers.get('Content-Range'))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        length = end - start + 1
+        if total != upload.size:
+            return Response({"detail": "Content-Range total does not match the upload size."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.VIDEO_UPLOAD_MAX_CHUNK:
+            return Response({"detail": "Chunk is too large."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if request.META.get('CONTENT_LENGTH') != str(length):
+            return Response({"detail": "Content-Length does not match Content-Range."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # No row lock or transaction is held while the body streams in from
+        # a possibly slow client; it goes straight to disk, never into
+        # memory, under a shared file lock that finalize waits out.
+        if upload.status != VideoUpload.STATUS_PENDING:
+            return Response({"detail": "Upload is already finalized."}, status=status.HTTP_409_CONFLICT)
+        if start > upload.received:
+            return Response(
+                {"detail": "Chunk leaves a gap.", "received": upload.received},
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            )
+        if end < upload.received:
+            return Response(
+                {"detail": "Chunk was already received.", "received": upload.received},
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            )
+        try:
+            write_chunk(upload.temp_path, start, request.stream, length)
+        except IncompleteChunk as e:
+            return Response({"detail": str(e), "received": upload.received},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except FileNotFoundError:
+            # Finalized or aborted while this chunk was being sent.
+            return Response({"detail": "Upload is already finalized."}, status=status.HTTP_409_CONFLICT)
+
+        # `received` only grows, so the chunk still joins the stored prefix;
+        # a single conditional UPDATE advances it unless the upload was
+        # finalized meanwhile. Concurrent chunks each keep the larger end.
+        advanced = VideoUpload.objects.filter(
+            pk=upload.pk, status=VideoUpload.STATUS_PENDING, received__gte=start,
+        ).update(received=Greatest(F('received'), end + 1), updated_at=timezone.now())
+        if not advanced:
+            return Response({"detail": "Upload is already finalized."}, status=status.HTTP_409_CONFLICT)
+        upload.refresh_from_db()
+        return Response(self.get_serializer(upload).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            post = Post.objects.get(pk=int(request.data.get('post')), profile__user=request.user)
+        except (TypeError, ValueError, Post.DoesNotExist):
+            return Response({"detail": "post must be one of your posts."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            upload = VideoUpload.objects.select_for_update().get(pk=upload.pk)
+            if upload.status != VideoUpload.STATUS_PENDING:
+                return Response({"detail": "Upload is already finalized."}, status=status.HTTP_409_CONFLICT)
+            if upload.received != upload.size:
+                return Response({"detail": "Upload is incomplete.", "received": upload.received},
+                                status=status.HTTP_409_CONFLICT)
+
+            video = PostVideo(post=post)
+            try:
+                content = PartialUploadFile(upload.temp_path, upload.filename)
+            except FileNotFoundError:
+                return Response({"detail": "Upload is already finalized."}, status=status.HTTP_409_CONFLICT)
+            try:
+                # Held until the file has been hashed and moved into storage.
+                if not content.lock():
+                    return Response({"detail": "A chunk is still being written.", "received": upload.received},
+                                    status=status.HTTP_409_CONFLICT)
+                video.video.save(upload.filename, content, save=True)
+            finally:
+                content.close()
+            upload.status = VideoUpload.STATUS_COMPLETE
+            upload.video = video
+            upload.save(update_fields=['status', 'video', 'updated_at'])
+
+        serializer = PostVideoSerializer(video, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 
 
@@ -218,7 +547,7 @@ def register(request):
     serializer = RegisterSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'refresh': str(refresh),
@@ -238,7 +567,7 @@ def login_view(request):
         password = serializer.validated_data['password']
         user = authenticate(username=username, password=password)
         if user:
-            refresh = RefreshToken.for_user(user)
+            refresh = tokens_for_user(user)
             return Response({
                 'user': UserSerializer(user).data,
                 'refresh': str(refresh),
@@ -253,11 +582,17 @@ def login_view(request):
 @api_view(['GET', 'PUT', 'PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def user_profile(request):
-    profile = request.user.profile
     if request.method == 'GET':
-        serializer = ProfileSerializer(profile)
-        return Response(serializer.data)
+        profile = own_profile(request)
+        fields = parse_fields_param(request.query_params.get('fields'))
+        return conditional_get(
+            request,
+            lambda: Response(ProfileSerializer(profile, fields=fields).data),
+            etag=profile_etag(request, profile),
+        )
     elif request.method in ['PUT', 'PATCH']:
+        # Writes authenticate with a freshly loaded principal.
+        profile = request.user.profile
         partial = request.method == 'PATCH'
         serializer = ProfileSerializer(profile, data=request.data, partial=partial)
         if serializer.is_valid():
@@ -267,11 +602,26 @@ def user_profile(request):
 
 
 
+class UserPostsView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request):
+        posts = Post.objects.with_related().filter(profile__user=request.user).order_by('-created_at', '-id')
+        paginator = PostKeysetPagination()
+        page = await paginator.apaginate_queryset(posts, request)
+        if page is not None:
+            serializer = PostSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        serializer = PostSerializer([post async for post in posts], many=True)
+        return Response(serializer.data)
+
+
+
+
 @api_view(['GET'])
-def user_posts(request):
-    posts = Post.objects.filter(profile=request.user.profile)
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data)
+@permission_classes([permissions.IsAdminUser])
+def feed_cache_stats(request):
+    return Response(feed_cache.stats())
 
 
 
@@ -293,13 +643,13 @@ class LinkTelegramView(APIView):
 
 
 
-class LinkTelegramStatusView(APIView):
+class LinkTelegramStatusView(AsyncAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get(self, request):
+    async def get(self, request):
         user = request.user
         try:
-            link = TelegramLink.objects.get(user=user)
+            link = await TelegramLink.objects.aget(user=user)
             if link.telegram_user_id:
                 return Response({"linked": True}, status=status.HTTP_200_OK)
             elif link.is_expired():
@@ -338,28 +688,207 @@ class LinkTelegramConfirmView(APIView):
 
 
 
-class UserTrainingSessionsView(APIView):
+class UserTrainingSessionsView(AsyncAPIView):
     permission_classes = [HasAPIKey]
 
-    def get(self, request):
+    async def get(self, request):
         user_id = request.query_params.get('id')
 
         if not user_id:
             return Response({"detail": "id обязателен."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            user = User.objects.get(id=user_id)
+            user = await User.objects.aget(id=user_id)
         except User.DoesNotExist:
             return Response({"detail": "Пользователь не найден."}, status=status.HTTP_404_NOT_FOUND)
 
         now = timezone.now().date()
-        sessions = TrainingSession.objects.filter(profile__user=user, date__gte=now).order_by('date')
+        sessions = TrainingSession.objects.filter(recurrence.active_between(now), profile__user=user).order_by('date')
 
-        serializer = TrainingSessionSerializer(sessions, many=True)
+        serializer = TrainingSessionSerializer([session async for session in sessions], many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 
+class BulkTrainingSessionsView(AsyncAPIView):
+    """
+    Upcoming training sessions for many users in one request.
+
+    ?ids=1,2,3 answers with {user_id: [sessions]} for at most
+    BULK_SESSIONS_MAX_IDS users. ?linked=true streams every Telegram-linked
+    user's sessions as NDJSON, one {"user_id", "telegram_user_id",
+    "sessions"} line per user, read from the database in chunks.
+    Weekly sessions are included as long as they recur.
+    """
+    permission_classes = [HasAPIKey]
+
+    def get_window(self, request):
+        return timezone.now().date(), None
+
+    def render(self, sessions, start, end):
+        return TrainingSessionSerializer(sessions, many=True).data
+
+    async def get(self, request):
+        try:
+            start, end = self.get_window(request)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        sessions = TrainingSession.objects.filter(recurrence.active_between(start, end)).annotate(
+            user_id=F('profile__user_id'),
+        )
+
+        if request.query_params.get('linked') == 'true':
+            sessions = sessions.filter(
+                profile__user__telegramlink__telegram_user_id__isnull=False,
+            ).annotate(telegram_user_id=F('profile__user__telegramlink__telegram_user_id'))
+            response = StreamingHttpResponse(self.stream_linked(sessions, start, end), content_type='application/x-ndjson')
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        try:
+            user_ids = {
+                int(value)
+                for param in request.query_params.getlist('ids')
+                for value in param.split(',') if value
+            }
+        except ValueError:
+            return Response({"detail": "ids должны быть числами."}, status=status.HTTP_400_BAD_REQUEST)
+        if not user_ids:
+            return Response({"detail": "ids или linked=true обязательны."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > settings.BULK_SESSIONS_MAX_IDS:
+            return Response(
+                {"detail": f"Не больше {settings.BULK_SESSIONS_MAX_IDS} ids за запрос."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        by_user = {user_id: [] for user_id in sorted(user_ids)}
+        async for session in sessions.filter(profile__user_id__in=user_ids).order_by('date', 'time'):
+            by_user[session.user_id].append(session)
+        grouped = {str(user_id): self.render(user_sessions, start, end) for user_id, user_sessions in by_user.items()}
+        return Response(grouped, status=status.HTTP_200_OK)
+
+    async def stream_linked(self, sessions, start, end):
+        group = []
+
+        def line():
+            return json.dumps({
+                'user_id': group[0].user_id,
+                'telegram_user_id': group[0].telegram_user_id,
+                'sessions': self.render(group, start, end),
+            }) + '\n'
+
+        async for session in sessions.order_by('profile_id', 'date', 'time').aiterator(chunk_size=2000):
+            if group and group[0].user_id != session.user_id:
+                yield line()
+                group = []
+            group.append(session)
+        if group:
+            yield line()
+
+
+class TrainingSessionOccurrencesView(BulkTrainingSessionsView):
+    """
+    Concrete occurrences between ?from= and ?to= (ISO dates, inclusive;
+    default the next 30 days, at most OCCURRENCES_MAX_DAYS) with weekly
+    sessions expanded, for ?ids= or every ?linked=true user, shaped like
+    BulkTrainingSessionsView: {"session", "date", "time"} per occurrence.
+    """
+
+    def get_window(self, request):
+        today = timezone.now().date()
+        params = request.query_params
+        try:
+            start = date.fromisoformat(params['from']) if params.get('from') else today
+            end = date.fromisoformat(params['to']) if params.get('to') else start + timedelta(days=30)
+        except ValueError:
+            raise ValueError("from и to должны быть датами в формате ГГГГ-ММ-ДД.")
+        if end < start or (end - start).days >= settings.OCCURRENCES_MAX_DAYS:
+            raise ValueError(f"Окно должно быть не длиннее {settings.OCCURRENCES_MAX_DAYS} дней.")
+        return start, end
+
+    def render(self, sessions, start, end):
+        return [
+            {'session': session.id, 'date': day.isoformat(), 'time': session.time.isoformat()}
+            for day, session in recurrence.occurrences(sessions, start, end)
+        ]
+
+
+class TrainingSessionChangesView(AsyncAPIView):
+    """
+    Training session changes after ?cursor=, oldest first, with tombstones
+    for deleted sessions. Without a cursor only the current head cursor is
+    returned; a pruned cursor gets 410 and the reader must resync.
+    """
+    permission_classes = [HasAPIKey]
+
+    async def get(self, request):
+        cursor = request.query_params.get('cursor')
+        if not cursor:
+            return Response({"changes": [], "next_cursor": await session_changes.head(), "has_more": False})
+
+        try:
+            changes, next_cursor, has_more = await session_changes.read_changes(
+                cursor, settings.SESSION_CHANGES_PAGE_SIZE)
+        except ValueError:
+            return Response({"detail": "Неверный cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        except session_changes.CursorExpired:
+            return Response({"detail": "cursor устарел, нужна полная синхронизация."}, status=status.HTTP_410_GONE)
+        return Response({"changes": changes, "next_cursor": next_cursor, "has_more": has_more})
+
+
+
+class CalendarFeedView(APIView):
+    """
+    The current user's iCalendar feed URL. GET creates the feed on first
+    use; POST replaces the token, so the old URL stops working.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        profile = get_object_or_404(Profile, user=request.user)
+        if not profile.calendar_token:
+            # Two concurrent first requests must end up with the same token.
+            Profile.objects.filter(pk=profile.pk, calendar_token__isnull=True).update(calendar_token=ical.new_token())
+            profile.refresh_from_db(fields=['calendar_token'])
+        return Response({"url": self.feed_url(request, profile)}, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        profile = get_object_or_404(Profile, user=request.user)
+        profile.calendar_token = ical.new_token()
+        profile.save(update_fields=['calendar_token'])
+        return Response({"url": self.feed_url(request, profile)}, status=status.HTTP_200_OK)
+
+    def feed_url(self, request, profile):
+        return request.build_absolute_uri(reverse('calendar-feed-ics', args=[profile.calendar_token]))
+
+
+class CalendarFeedIcsView(AsyncAPIView):
+    """
+    The .ics feed itself. Calendar apps cannot send credentials, so the
+    secret token in the URL is the authentication. The response streams;
+    an unchanged feed is answered with 304 from a single aggregate query.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    async def get(self, request, token):
+        try:
+            profile = await Profile.objects.aget(calendar_token=token)
+        except Profile.DoesNotExist:
+            return Response({"detail": "Календарь не найден."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = await ical.feed_etag(profile)
+        response = not_modified(request, etag=etag)
+        if response is None:
+            response = StreamingHttpResponse(
+                ical.render_feed(profile, request.get_host().split(':')[0]),
+                content_type='text/calendar; charset=utf-8',
+            )
+            response['Content-Disposition'] = 'inline; filename="training.ics"'
+        return set_validators(response, etag=etag)
+
+
+
 # Render React app
 # def index(request):
     #return render(request, 'index.html')
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import random
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Worth another try: the server is restarting, overloaded or throttling us.
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class ApiClient:
+    """
+    One pooled, keep-alive HTTP client for every call the bot makes to the
+    API. It is created lazily on first use so it binds to the event loop
+    the bot runs on; close it with aclose() on shutdown.
+
+    Requests that fail with a transport error or a RETRY_STATUSES response
+    are retried up to `retries` times (0 sends each request once) with
+    exponential backoff and full jitter. Non-idempotent
+    requests are only retried when the connection could not be opened,
+    i.e. when the server cannot have seen them.
+    """
+
+    def __init__(self, base_url, headers, timeout=10.0, connect_timeout=5.0,
+                 max_connections=20, retries=2, backoff_base=0.5, backoff_max=8.0):
+        self.base_url = base_url
+        self.headers = headers
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30,
+        )
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+        return self._client
+
+    def backoff(self, attempt):
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    async def request(self, method, path, idempotent=True, **kwargs):
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if last_attempt:
+                    raise
+            except httpx.TransportError:
+                if last_attempt or not idempotent:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt or not idempotent:
+                    return response
+                await response.aclose()
+
+            delay = self.backoff(attempt + 1)
+            logger.warning(f"{method} {path} failed (attempt {attempt + 1}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, idempotent=False, **kwargs):
+        return await self.request('POST', path, idempotent=idempotent, **kwargs)
+
+    async def iter_json_lines(self, path, **kwargs):
+        """Stream an NDJSON response and yield one decoded object per line."""
+        async with self.client.stream('GET', path, **kwargs) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+End-to-end check and benchmark of the bot's webhook mode.
+
+Starts FakeTelegram, runs reminder_bot.py against it in webhook mode,
+sends `--updates` /start messages from different chats through the
+webhook (`--concurrency` at a time) and measures the time from each
+POST to the bot's reply reaching the fake API. Finally it stops the bot
+with SIGTERM and checks that it exits cleanly.
+
+    python reminder_tg_bot/bench_webhook.py --updates 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from fake_telegram import FakeTelegram
+
+TOKEN = '123456:fake-token'
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def start_bot(fake, port, data_dir, stderr=asyncio.subprocess.DEVNULL, **overrides):
+    """Run reminder_bot.py in webhook mode against `fake`, with `overrides` in its environment."""
+    address = f'http://{fake.address}'
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=TOKEN,
+        BOT_API_KEY='bench',
+        API_BASE_URL=address,
+        TELEGRAM_API_URL=f'{address}/bot',
+        WEBHOOK_URL=f'http://127.0.0.1:{port}/telegram/webhook',
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_SECRET='bench-secret',
+        EVENTS_PORT='0',
+        CHAT_DB_FILE=os.path.join(data_dir, 'chats.sqlite3'),
+        CHAT_IDS_FILE=os.path.join(data_dir, 'chat_ids.json'),
+        REMINDER_DB_FILE=os.path.join(data_dir, 'reminders.sqlite3'),
+    )
+    env.update(overrides)
+    return await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reminder_bot.py'),
+        env=env, stdout=asyncio.subprocess.DEVNULL, stderr=stderr,
+    )
+
+
+async def main(args):
+    fake = FakeTelegram(TOKEN)
+    await fake.start()
+    bot = await start_bot(
+        fake, args.port, tempfile.mkdtemp(prefix='bench-bot-'),
+        stderr=None if args.verbose else asyncio.subprocess.DEVNULL,
+        UPDATE_CONCURRENCY=str(args.bot_concurrency),
+    )
+    try:
+        await asyncio.wait_for(fake.webhook_set.wait(), 30)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(chat_id):
+            async with semaphore:
+                replied = fake.wait_for_message(chat_id)
+                sent = time.monotonic()
+                status = await fake.push(fake.text_update(chat_id, '/start'))
+                assert status == 200, status
+                latencies.append(await asyncio.wait_for(replied, 30) - sent)
+
+        started = time.monotonic()
+        await asyncio.gather(*(one(1000 + i) for i in range(args.updates)))
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        print(f"{args.updates} updates in {elapsed:.2f}s: {args.updates / elapsed:.0f} updates/s")
+        print(
+            f"latency p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+            f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+            f"max {latencies[-1] * 1000:.1f} ms"
+        )
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        code = await asyncio.wait_for(bot.wait(), 30)
+        await fake.stop()
+    print(f"bot exited with {code}")
+    return code
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50, help='webhook requests in flight')
+    parser.add_argument('--bot-concurrency', type=int, default=32, help="the bot's UPDATE_CONCURRENCY")
+    parser.add_argument('--port', type=int, default=8443, help='webhook port of the bot')
+    parser.add_argument('--verbose', action='store_true', help="show the bot's log")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chats_user_id_idx ON chats (user_id);
+"""
+
+
+class ChatStore:
+    """
+    chat_id -> user_id mappings in SQLite (WAL mode): lookups hit the
+    primary key index, every write is its own atomic transaction, and
+    readers never wait for a writer.
+
+    On first start an existing chat_ids.json is imported and renamed to
+    `<name>.migrated`, so the import happens once.
+    """
+
+    def __init__(self, path, legacy_json=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # One connection shared by the bot's threads, guarded by a lock;
+        # autocommit mode, transactions are opened explicitly.
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('PRAGMA busy_timeout=5000')
+            self.connection.executescript(SCHEMA)
+        if legacy_json:
+            self.migrate_json(legacy_json)
+
+    def migrate_json(self, json_path):
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                chat_ids = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read {json_path} for migration: {e}")
+            return
+        if not isinstance(chat_ids, dict):
+            logger.error(f"Could not read {json_path} for migration: not a JSON object")
+            return
+
+        rows = []
+        for chat_id, user_id in chat_ids.items():
+            if not user_id:
+                continue
+            try:
+                rows.append((str(chat_id), int(user_id)))
+            except (TypeError, ValueError):
+                logger.warning(f"Skipping chat {chat_id} in {json_path}: bad user id {user_id!r}")
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                # Mappings saved since then win over the old file.
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO chats (chat_id, user_id) VALUES (?, ?)', rows)
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        os.replace(json_path, json_path + '.migrated')
+        logger.info(f"Migrated {len(rows)} chat ids from {json_path}")
+
+    def get_user_id(self, chat_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT user_id FROM chats WHERE chat_id = ?', (str(chat_id),)).fetchone()
+        return row[0] if row else None
+
+    def save_user_id(self, chat_id, user_id):
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO chats (chat_id, user_id) VALUES (?, ?) '
+                'ON CONFLICT (chat_id) DO UPDATE SET user_id = excluded.user_id, '
+                'updated_at = CURRENT_TIMESTAMP',
+                (str(chat_id), int(user_id)),
+            )
+
+    def get_all_mappings(self):
+        with self.lock:
+            return dict(self.connection.execute('SELECT chat_id, user_id FROM chats'))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
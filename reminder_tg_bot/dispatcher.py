@@ -0,0 +1,291 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    A token bucket handing out send slots: `rate` per second on average,
+    up to `burst` at once. reserve() books the next slot and returns how
+    long to wait for it, so concurrent callers queue up fairly.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1 / rate
+        self.burst = burst
+        self.next_free = 0.0
+
+    def reserve(self):
+        now = time.monotonic()
+        self.next_free = max(self.next_free, now - (self.burst - 1) * self.interval)
+        wait = self.next_free - now
+        self.next_free += self.interval
+        return max(wait, 0.0)
+
+    def pause(self, seconds):
+        self.next_free = max(self.next_free, time.monotonic() + seconds)
+
+
+class ChatGate:
+    """Sends to one chat go one at a time, `interval` seconds apart."""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.last_sent = float('-inf')
+
+
+class Reminder:
+    __slots__ = ('key', 'chat_id', 'text', 'fire_at', 'repeat', 'data', 'version')
+
+    def __init__(self, key, chat_id, text, fire_at, repeat, data, version):
+        self.key = key
+        self.chat_id = chat_id
+        self.text = text
+        self.fire_at = fire_at
+        self.repeat = repeat
+        self.data = data
+        self.version = version
+
+
+def retry_after_seconds(exc):
+    """Seconds Telegram asked us to wait (a 429 / RetryAfter), or None."""
+    retry_after = getattr(exc, 'retry_after', None)
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+class ReminderDispatcher:
+    """
+    Sends reminders from the bot's own event loop.
+
+    Reminders sit in a min-heap by fire time (epoch seconds). One loop
+    task sleeps until the earliest is due, pops everything due and sends
+    it concurrently, at most `concurrency` at a time. Sends respect a
+    global token bucket (Telegram allows about 30 messages a second), and
+    messages to one chat go out one by one, `chat_interval` apart. A 429 pauses the global bucket
+    for the requested time and the message is retried up to `retries`
+    times.
+
+    Rescheduling or cancelling a key leaves its old heap entry behind;
+    entries whose version no longer matches are skipped when popped, and
+    the heap is rebuilt from the live reminders once dead entries
+    outnumber them.
+    `repeat(fire_at)` returns the next fire time of a recurring reminder.
+
+    With a `store` (see reminder_store.py) every reminder is mirrored to
+    disk along with its `data`. A fired occurrence stays stored until it
+    has been sent, so a restart in between sends it again rather than
+    losing it.
+    """
+
+    # Heaps this small are not worth rebuilding.
+    MIN_PRUNE = 64
+
+    def __init__(self, rate=25, burst=25, chat_interval=1.0, concurrency=16, retries=3,
+                 metrics_interval=300, sample_size=1000, store=None):
+        self.send = None
+        self.store = store
+        self.limiter = RateLimiter(rate, burst)
+        self.chat_interval = chat_interval
+        self.chat_gates = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.metrics_interval = metrics_interval
+
+        self.heap = []
+        self.reminders = {}
+        self.versions = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sending = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        # (lag behind the fire time, Telegram round-trip) of recent sends
+        self.samples = deque(maxlen=sample_size)
+
+    def schedule(self, key, chat_id, text, fire_at, repeat=None, data=None, persist=True):
+        """Add or replace the reminder `key`; returns False if fire_at is None."""
+        if fire_at is None:
+            self.cancel(key)
+            return False
+        self.versions += 1
+        reminder = Reminder(key, chat_id, text, fire_at, repeat, data, self.versions)
+        self.reminders[key] = reminder
+        if self.store is not None and persist:
+            self.store.save(key, chat_id, text, fire_at, data)
+        heapq.heappush(self.heap, (fire_at, reminder.version, key))
+        if self.heap[0][1] == reminder.version:
+            self.wakeup.set()
+        self.prune()
+        return True
+
+    def cancel(self, key):
+        if self.store is not None:
+            self.store.delete([key])
+        cancelled = self.reminders.pop(key, None) is not None
+        self.prune()
+        return cancelled
+
+    def cancel_where(self, predicate):
+        keys = [key for key, reminder in self.reminders.items() if predicate(reminder)]
+        for key in keys:
+            del self.reminders[key]
+        if self.store is not None:
+            self.store.delete(keys)
+        self.prune()
+
+    def prune(self):
+        """Drop dead heap entries once they outnumber the live ones."""
+        if len(self.heap) > 2 * len(self.reminders) + self.MIN_PRUNE:
+            self.heap = [(reminder.fire_at, reminder.version, reminder.key)
+                         for reminder in self.reminders.values()]
+            heapq.heapify(self.heap)
+            self.wakeup.set()
+
+    def __contains__(self, key):
+        return key in self.reminders
+
+    def __len__(self):
+        return len(self.reminders)
+
+    def get(self, key):
+        return self.reminders.get(key)
+
+    def start(self, send):
+        """Start sending with the coroutine function `send(chat_id, text)`."""
+        self.send = send
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # Let reminders already handed to Telegram finish.
+        await asyncio.gather(*self.sending, return_exceptions=True)
+
+    async def run(self):
+        reported = time.monotonic()
+        while True:
+            self.wakeup.clear()
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                fire_at, version, key = heapq.heappop(self.heap)
+                reminder = self.reminders.get(key)
+                if reminder is None or reminder.version != version:
+                    continue
+                self.fire(reminder)
+
+            if self.metrics_interval and time.monotonic() - reported >= self.metrics_interval:
+                reported = time.monotonic()
+                self.log_metrics()
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            if self.metrics_interval:
+                timeout = min(timeout or self.metrics_interval, self.metrics_interval)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def fire(self, reminder):
+        next_fire = reminder.repeat(reminder.fire_at) if reminder.repeat else None
+        if next_fire is not None:
+            self.schedule(reminder.key, reminder.chat_id, reminder.text, next_fire, reminder.repeat,
+                          reminder.data, persist=False)
+        else:
+            del self.reminders[reminder.key]
+        task = asyncio.create_task(self.complete(reminder))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def complete(self, reminder):
+        try:
+            await self.deliver(reminder.chat_id, reminder.text, reminder.fire_at)
+        finally:
+            if self.store is not None:
+                self.persist(reminder.key)
+
+    def persist(self, key):
+        # The occurrence is done with: store whatever comes next.
+        current = self.reminders.get(key)
+        try:
+            if current is None:
+                self.store.delete([key])
+            else:
+                self.store.save(current.key, current.chat_id, current.text, current.fire_at, current.data)
+        except Exception as e:
+            logger.error(f"Error storing reminder {key}: {e}")
+
+    def chat_gate(self, chat_id):
+        gate = self.chat_gates.get(chat_id)
+        if gate is None:
+            if len(self.chat_gates) > 10000:
+                quiet = time.monotonic() - self.chat_interval
+                self.chat_gates = {
+                    chat: gate for chat, gate in self.chat_gates.items()
+                    if gate.lock.locked() or gate.last_sent > quiet
+                }
+            gate = self.chat_gates[chat_id] = ChatGate()
+        return gate
+
+    async def deliver(self, chat_id, text, fire_at):
+        gate = self.chat_gate(chat_id)
+        for attempt in range(self.retries + 1):
+            async with gate.lock:
+                # Wait out the chat's interval before taking a concurrency
+                # slot, so a busy chat does not hold up everybody else.
+                await asyncio.sleep(gate.last_sent + self.chat_interval - time.monotonic())
+                async with self.semaphore:
+                    await asyncio.sleep(self.limiter.reserve())
+                    started = time.monotonic()
+                    try:
+                        await self.send(chat_id, text)
+                    except Exception as e:
+                        retry_after = retry_after_seconds(e)
+                        if retry_after is None or attempt == self.retries:
+                            self.failed += 1
+                            logger.error(f"Error sending reminder to {chat_id}: {e}")
+                            return False
+                        self.retried += 1
+                        logger.warning(f"Flood limit hit, retrying reminder to {chat_id} in {retry_after}s")
+                        self.limiter.pause(retry_after)
+                        continue
+                    finally:
+                        gate.last_sent = time.monotonic()
+            self.sent += 1
+            self.samples.append((time.time() - fire_at, gate.last_sent - started))
+            logger.info(f"Reminder sent to {chat_id}")
+            return True
+
+    def metrics(self):
+        def percentiles(values):
+            values = sorted(values)
+            if not values:
+                return {'p50': None, 'p95': None, 'max': None}
+            return {
+                'p50': round(values[len(values) // 2], 3),
+                'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                'max': round(values[-1], 3),
+            }
+
+        return {
+            'scheduled': len(self.reminders),
+            'sending': len(self.sending),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'lag': percentiles(lag for lag, _ in self.samples),
+            'send_time': percentiles(duration for _, duration in self.samples),
+        }
+
+    def log_metrics(self):
+        logger.info(f"Reminder dispatcher: {self.metrics()}")
@@ -0,0 +1,41 @@
+import hmac
+import json
+import logging
+
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+
+class EventServer(HttpServer):
+    """
+    The endpoint for outbox events pushed by the web app's
+    `dispatch_outbox` command: `POST /events` with {"events": [...]}.
+
+    A batch is acknowledged (204) only after `handler(events)` has applied
+    it, so a failed batch is sent again. Requests must carry `token` in
+    the X-Outbox-Token header.
+    """
+
+    def __init__(self, handler, token, host='0.0.0.0', port=8081, path=None):
+        if not token:
+            raise ValueError("EventServer needs a token")
+        super().__init__(host=host, port=port, path=path)
+        self.handler = handler
+        self.token = token
+
+    async def dispatch(self, method, target, headers, body):
+        if method != 'POST' or target.split('?')[0] != '/events':
+            return 404
+        if not hmac.compare_digest(headers.get('x-outbox-token', ''), self.token):
+            return 401
+        try:
+            events = json.loads(body)['events']
+        except (ValueError, KeyError, TypeError):
+            return 400
+        try:
+            await self.handler(events)
+        except Exception:
+            logger.exception("Error applying outbox events")
+            return 500
+        return 204
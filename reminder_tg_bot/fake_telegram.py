@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import json
+import time
+from urllib.parse import parse_qsl
+
+import httpx
+
+from http_server import HttpServer
+
+
+class FakeTelegram(HttpServer):
+    """
+    A local stand-in for the Telegram Bot API (and for the few web API
+    endpoints the bot calls at startup), for end-to-end tests and
+    benchmarks without network access.
+
+    Point the bot at it with TELEGRAM_API_URL=http://<address>/bot and
+    API_BASE_URL=http://<address>. It answers getMe, setWebhook,
+    deleteWebhook, getUpdates and sendMessage. Sent messages are
+    recorded in `messages` and wake up `wait_for_message()`. push()
+    delivers an update to the webhook the bot registered.
+    """
+
+    def __init__(self, token, host='127.0.0.1', port=0):
+        super().__init__(host=host, port=port)
+        self.token = token
+        self.webhook = None
+        self.webhook_set = asyncio.Event()
+        self.messages = []
+        self.waiters = {}
+        self.update_ids = itertools.count(1)
+        self.client = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=1000))
+
+    async def stop(self):
+        await super().stop()
+        await self.client.aclose()
+
+    async def dispatch(self, method, target, headers, body):
+        path = target.split('?')[0]
+        prefix = f'/bot{self.token}/'
+        if path.startswith(prefix):
+            if headers.get('content-type', '').startswith('application/json'):
+                params = json.loads(body or b'{}')
+            else:
+                params = {key: self.decode(value) for key, value in parse_qsl(body.decode())}
+            return self.reply(await self.call(path[len(prefix):], params))
+        if path == '/api/health/':
+            return 200
+        if path == '/api/user-training-sessions/changes/':
+            return self.reply({'changes': [], 'next_cursor': '0-0', 'has_more': False}, wrap=False)
+        if path == '/api/user-training-sessions/bulk/':
+            return 200, b'', 'application/x-ndjson'
+        return 404
+
+    @staticmethod
+    def decode(value):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    @staticmethod
+    def reply(result, wrap=True):
+        data = {'ok': True, 'result': result} if wrap else result
+        return 200, json.dumps(data).encode(), 'application/json'
+
+    async def call(self, name, params):
+        if name == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        if name == 'setWebhook':
+            self.webhook = (params['url'], params.get('secret_token'))
+            self.webhook_set.set()
+            return True
+        if name == 'deleteWebhook':
+            self.webhook = None
+            return True
+        if name == 'getUpdates':
+            await asyncio.sleep(min(float(params.get('timeout', 0)), 1))
+            return []
+        if name == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            received = time.monotonic()
+            self.messages.append((chat_id, params.get('text'), received))
+            waiter = self.waiters.pop(chat_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(received)
+            return {
+                'message_id': len(self.messages),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text'),
+            }
+        return True
+
+    def wait_for_message(self, chat_id):
+        """A future resolved with the monotonic time the bot next messages `chat_id`."""
+        waiter = self.waiters[chat_id] = asyncio.get_running_loop().create_future()
+        return waiter
+
+    def text_update(self, chat_id, text):
+        update_id = next(self.update_ids)
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+                if text.startswith('/') else [],
+            },
+        }
+
+    async def push(self, update):
+        url, secret = self.webhook
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        response = await self.client.post(url, json=update, headers=headers)
+        return response.status_code
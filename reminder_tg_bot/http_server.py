@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 10 * 1024 * 1024
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HttpServer:
+    """
+    A minimal asyncio HTTP/1.1 server for the bot's internal endpoints.
+
+    It listens on a Unix socket when `path` is given, and on host:port
+    otherwise. Connections are kept alive between requests. Subclasses
+    implement `dispatch(method, target, headers, body)`, which returns
+    a status code or a (status, body, content_type) tuple.
+
+    stop() closes the listener and drops idle keep-alive connections. A
+    request that is being handled still gets its response.
+    """
+
+    def __init__(self, host='0.0.0.0', port=8081, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.server = None
+        self.idle = {}
+
+    @property
+    def address(self):
+        return self.path or f'{self.host}:{self.port}'
+
+    async def start(self):
+        if self.path:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.server = await asyncio.start_unix_server(self.serve, path=self.path)
+        else:
+            self.server = await asyncio.start_server(self.serve, self.host, self.port)
+            if not self.port:
+                self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"{type(self).__name__} listening on {self.address}")
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for task, idle in list(self.idle.items()):
+            if idle:
+                task.cancel()
+        await asyncio.gather(*self.idle, return_exceptions=True)
+        await self.server.wait_closed()
+        self.server = None
+
+    async def serve(self, reader, writer):
+        task = asyncio.current_task()
+        try:
+            while True:
+                self.idle[task] = True
+                request_line = await reader.readline()
+                self.idle[task] = False
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if length > MAX_BODY:
+                    status, keep_alive = 413, False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status = await self.dispatch(method, target, headers, body)
+
+                status, content, content_type = status if isinstance(status, tuple) else (status, b'', None)
+                head = (
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                )
+                if content_type:
+                    head += f"Content-Type: {content_type}\r\n"
+                writer.write((head + "\r\n").encode() + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            if not self.idle[task]:
+                raise
+        finally:
+            del self.idle[task]
+            writer.close()
+
+    async def dispatch(self, method, target, headers, body):
+        raise NotImplementedError
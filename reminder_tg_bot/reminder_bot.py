@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
 import os
+import asyncio
 import logging
-import requests
-import json
-from datetime import datetime
+import signal
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 import pytz
 from dotenv import load_dotenv
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
@@ -15,7 +18,15 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-from apscheduler.schedulers.background import BackgroundScheduler
+import httpx
+
+from api_client import ApiClient
+from chat_store import ChatStore
+from dispatcher import ReminderDispatcher
+from reminder_store import ReminderStore
+from session_cache import TTLCache
+from webhook import WebhookServer
+from event_server import EventServer
 
 load_dotenv()
 
@@ -32,6 +43,46 @@ class BotConfig:
         self.API_BASE_URL = os.getenv('API_BASE_URL', 'http://web:8000')
         self.TIMEZONE = pytz.timezone(os.getenv('TIMEZONE', 'Europe/Lisbon'))
         self.CHAT_IDS_FILE = os.getenv('CHAT_IDS_FILE', '/app/bot_data/chat_ids.json')
+        self.CHAT_DB_FILE = os.getenv('CHAT_DB_FILE', '/app/bot_data/chats.sqlite3')
+        self.REMINDER_DB_FILE = os.getenv('REMINDER_DB_FILE', '/app/bot_data/reminders.sqlite3')
+        # Reminders missed while the bot was down are still sent if they
+        # are at most this many seconds late
+        self.REMINDER_GRACE = int(os.getenv('REMINDER_GRACE', '3600'))
+        self.API_TIMEOUT = float(os.getenv('API_TIMEOUT', '10'))
+        self.API_MAX_CONNECTIONS = int(os.getenv('API_MAX_CONNECTIONS', '20'))
+        # Extra attempts after a failed API call
+        self.API_RETRIES = int(os.getenv('API_RETRIES', '2'))
+        # Outbox events pushed by the web app (EVENTS_PORT=0 and no
+        # EVENTS_SOCKET turns the endpoint off)
+        self.EVENTS_HOST = os.getenv('EVENTS_HOST', '0.0.0.0')
+        self.EVENTS_PORT = int(os.getenv('EVENTS_PORT', '8081'))
+        self.EVENTS_SOCKET = os.getenv('EVENTS_SOCKET')
+        self.OUTBOX_TOKEN = os.getenv('OUTBOX_TOKEN')
+        self.EVENTS_ENABLED = bool(self.EVENTS_SOCKET or self.EVENTS_PORT)
+        # With pushed events, polling the change feed is only a safety net
+        self.SYNC_INTERVAL = int(os.getenv('SYNC_INTERVAL', '600' if self.EVENTS_ENABLED else '30'))
+        # How long the first sync may hold back the reminders restored on start
+        self.STARTUP_SYNC_TIMEOUT = float(os.getenv('STARTUP_SYNC_TIMEOUT', '30'))
+        # Reminder sending; Telegram allows ~30 messages/s overall and
+        # about one per second to the same chat
+        self.REMINDER_RATE = float(os.getenv('REMINDER_RATE', '25'))
+        self.REMINDER_BURST = int(os.getenv('REMINDER_BURST', '25'))
+        self.REMINDER_CHAT_INTERVAL = float(os.getenv('REMINDER_CHAT_INTERVAL', '1'))
+        self.REMINDER_CONCURRENCY = int(os.getenv('REMINDER_CONCURRENCY', '16'))
+        self.REMINDER_RETRIES = int(os.getenv('REMINDER_RETRIES', '3'))
+        self.REMINDER_METRICS_INTERVAL = int(os.getenv('REMINDER_METRICS_INTERVAL', '300'))
+        # Telegram updates: long polling unless WEBHOOK_URL (the public URL
+        # Telegram posts to) is set; nginx forwards its path to WEBHOOK_PORT
+        self.TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+        self.WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+        self.WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+        self.WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+        self.WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+        self.WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+        self.UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+        # Per-user session lists shown by the calendar button
+        self.SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '1024'))
+        self.SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '60'))
         self.HEADERS = {
             'Authorization': f'Api-Key {self.BOT_API_KEY}',
             'Content-Type': 'application/json',
@@ -39,7 +90,7 @@ class BotConfig:
         }
 
         # bot_data directory
-        os.makedirs(os.path.dirname(self.CHAT_IDS_FILE), exist_ok=True)
+        os.makedirs(os.path.dirname(self.CHAT_DB_FILE), exist_ok=True)
 
         self.validate_config()
 
@@ -48,125 +99,333 @@ class BotConfig:
             raise ValueError("TELEGRAM_BOT_TOKEN is not set")
         if not self.BOT_API_KEY:
             raise ValueError("BOT_API_KEY is not set")
+        if self.API_RETRIES < 0:
+            raise ValueError("API_RETRIES must be 0 or more")
+        if self.WEBHOOK_URL and not self.WEBHOOK_SECRET:
+            # Without it anyone who finds the public URL can post updates.
+            raise ValueError("WEBHOOK_SECRET must be set when WEBHOOK_URL is")
+        if self.EVENTS_ENABLED and not self.OUTBOX_TOKEN:
+            # Events relink chats and add or drop reminders.
+            raise ValueError("OUTBOX_TOKEN must be set unless EVENTS_PORT=0 and EVENTS_SOCKET is unset")
 
         logger.info(f"API Base URL: {self.API_BASE_URL}")
         logger.info(f"Timezone: {self.TIMEZONE}")
-        logger.info(f"Chat IDs File: {self.CHAT_IDS_FILE}")
+        logger.info(f"Chat IDs DB: {self.CHAT_DB_FILE}")
+        logger.info(f"Reminders DB: {self.REMINDER_DB_FILE}")
 
 # global config instance
 config = BotConfig()
 
-def check_api_health():
+# shared pooled client for all API calls
+api = ApiClient(
+    config.API_BASE_URL,
+    config.HEADERS,
+    timeout=config.API_TIMEOUT,
+    max_connections=config.API_MAX_CONNECTIONS,
+    retries=config.API_RETRIES,
+)
+
+async def check_api_health():
     try:
-        response = requests.get(
-            f"{config.API_BASE_URL}/api/health/",
-            headers=config.HEADERS,
-            timeout=5
-        )
+        response = await api.get("/api/health/", timeout=5)
         return response.status_code == 200
-    except requests.RequestException:
+    except httpx.HTTPError:
         return False
 
-def fetch_training_sessions(user_id):
-    try:
-        response = requests.get(
-            f"{config.API_BASE_URL}/api/user-training-sessions/",
-            headers=config.HEADERS,
-            params={'id': user_id},
-            timeout=10
-        )
+# user_id -> (sessions, formatted message); dropped when reminders change
+session_cache = TTLCache(maxsize=config.SESSION_CACHE_SIZE, ttl=config.SESSION_CACHE_TTL)
+
+async def fetch_training_sessions(user_id):
+    """(upcoming sessions, formatted message) of a user, cached; [] and None on errors."""
+    async def fetch():
+        response = await api.get("/api/user-training-sessions/", params={'id': user_id})
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        sessions = response.json()
+        return sessions, format_training_sessions(sessions) if sessions else None
+
+    try:
+        return await session_cache.get_or_fetch(int(user_id), fetch)
+    except httpx.HTTPError as e:
         logger.error(f"Error fetching training sessions: {e}")
-        return []
+        return [], None
+
+def forget_sessions(chat_id):
+    """Drop the cached sessions of the user linked to `chat_id`."""
+    if chat_id:
+        user_id = ChatIDManager.get_user_id(chat_id)
+        if user_id is not None:
+            session_cache.invalidate(int(user_id))
+
+# scheduled reminders and the change feed cursor, kept across restarts
+reminder_store = ReminderStore(config.REMINDER_DB_FILE)
+
+# reminders waiting to be sent; started on the bot's event loop in post_init
+dispatcher = ReminderDispatcher(
+    store=reminder_store,
+    rate=config.REMINDER_RATE,
+    burst=config.REMINDER_BURST,
+    chat_interval=config.REMINDER_CHAT_INTERVAL,
+    concurrency=config.REMINDER_CONCURRENCY,
+    retries=config.REMINDER_RETRIES,
+    metrics_interval=config.REMINDER_METRICS_INTERVAL,
+)
+
+# chat_id -> user_id mappings, imported from CHAT_IDS_FILE on first start
+chat_store = ChatStore(config.CHAT_DB_FILE, legacy_json=config.CHAT_IDS_FILE)
 
 class ChatIDManager:
     @staticmethod
     def get_user_id(chat_id):
         try:
-            if os.path.exists(config.CHAT_IDS_FILE):
-                with open(config.CHAT_IDS_FILE, 'r') as f:
-                    chat_ids = json.load(f)
-                return chat_ids.get(str(chat_id))
-        except Exception as e:
+            return chat_store.get_user_id(chat_id)
+        except sqlite3.Error as e:
             logger.error(f"Error reading chat_ids: {e}")
         return None
 
     @staticmethod
     def save_user_id(chat_id, user_id):
         try:
-            chat_ids = {}
-            if os.path.exists(config.CHAT_IDS_FILE):
-                with open(config.CHAT_IDS_FILE, 'r') as f:
-                    chat_ids = json.load(f)
-
-            chat_ids[str(chat_id)] = user_id
-
-            with open(config.CHAT_IDS_FILE, 'w') as f:
-                json.dump(chat_ids, f, indent=4)
-        except Exception as e:
+            chat_store.save_user_id(chat_id, user_id)
+        except sqlite3.Error as e:
             logger.error(f"Error saving chat_id: {e}")
 
     @staticmethod
     def get_all_mappings():
         try:
-            if os.path.exists(config.CHAT_IDS_FILE):
-                with open(config.CHAT_IDS_FILE, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
+            return chat_store.get_all_mappings()
+        except sqlite3.Error as e:
             logger.error(f"Error reading mappings: {e}")
         return {}
 
-def schedule_reminders(app):
-    scheduler = BackgroundScheduler(timezone=config.TIMEZONE)
-    user_chat_ids = ChatIDManager.get_all_mappings()
+async def fetch_linked_sessions():
+    """Upcoming sessions of every Telegram-linked user, streamed in one request."""
+    async for line in api.iter_json_lines(
+        "/api/user-training-sessions/bulk/",
+        params={'linked': 'true'},
+        timeout=httpx.Timeout(config.API_TIMEOUT, read=None),
+    ):
+        yield line
+
+async def fetch_session_changes(cursor=None):
+    """One page of the session change feed; None if the cursor was pruned."""
+    params = {'cursor': cursor} if cursor else {}
+    response = await api.get("/api/user-training-sessions/changes/", params=params)
+    if response.status_code == 410:
+        return None
+    response.raise_for_status()
+    return response.json()
 
-    if not user_chat_ids:
-        logger.warning("No users found for reminders")
-        return
+def session_job_id(session_id):
+    return f"session-{session_id}"
+
+def is_weekly(session):
+    return session.get('recurrence') == 'weekly' and bool(session.get('weekdays'))
 
-    for chat_id, user_id in user_chat_ids.items():
-        if not user_id:
-            continue
+def next_session_time(session, after):
+    """The first start of `session` later than `after`, or None."""
+    start = config.TIMEZONE.localize(datetime.strptime(
+        f"{session['date']} {session['time']}",
+        '%Y-%m-%d %H:%M:%S'
+    ))
+    if not is_weekly(session):
+        return start if start > after else None
+
+    # Weekdays count from 0 = Monday, like the API.
+    day = max(start.date(), after.astimezone(config.TIMEZONE).date())
+    for offset in range(8):
+        candidate = day + timedelta(days=offset)
+        if candidate.weekday() in session['weekdays']:
+            candidate = config.TIMEZONE.localize(datetime.combine(candidate, start.time()))
+            if candidate > after:
+                return candidate
+    return None
+
+def weekly_repeat(session):
+    """The repeat function of a weekly session's reminder: next start after the last one."""
+    def repeat(last):
+        after = datetime.fromtimestamp(max(last, time.time()), config.TIMEZONE)
+        following = next_session_time(session, after)
+        return following.timestamp() if following else None
+    return repeat
+
+def schedule_session(chat_id, session, forget=True):
+    """
+    Add, move or drop the reminder of one session. `forget=False` leaves
+    the user's cached sessions alone, for callers that cleared the cache.
+    """
+    key = session_job_id(session['id'])
+    if forget:
+        forget_sessions(chat_id)
+    fire_at = next_session_time(session, datetime.now(config.TIMEZONE)) if chat_id else None
+    if fire_at is None:
+        dispatcher.cancel(key)
+        return False
 
-        sessions = fetch_training_sessions(user_id)
-        if not sessions:
-            continue
+    if is_weekly(session):
+        message = (
+            f"🔔 Напоминание: У вас тренировка сегодня в "
+            f"{fire_at.strftime('%H:%M')}!"
+        )
+        repeat = weekly_repeat(session)
+    else:
+        message = (
+            f"🔔 Напоминание: У вас тренировка "
+            f"{fire_at.strftime('%Y-%m-%d')} в "
+            f"{fire_at.strftime('%H:%M')}!"
+        )
+        repeat = None
+    return dispatcher.schedule(key, str(chat_id), message, fire_at.timestamp(), repeat, data=session)
+
+def unschedule_session(session_id, user_id=None):
+    """Drop the reminder of a deleted session, and the session from the owner's cached list."""
+    reminder = dispatcher.get(session_job_id(session_id))
+    if user_id is not None:
+        session_cache.invalidate(int(user_id))
+    elif reminder is not None:
+        forget_sessions(reminder.chat_id)
+    else:
+        # A session without a reminder (already past, say) may still be in
+        # its owner's cached list, and there is no telling whose it is.
+        session_cache.clear()
+    dispatcher.cancel(session_job_id(session_id))
+
+async def load_all_reminders():
+    scheduled = 0
+    async for user in fetch_linked_sessions():
+        # The linked Telegram id is the chat the code was confirmed from.
+        chat_id = user['telegram_user_id']
+        with reminder_store.batch():
+            for session in user['sessions']:
+                try:
+                    # full_resync() cleared the session cache already.
+                    scheduled += schedule_session(chat_id, session, forget=False)
+                except Exception as e:
+                    logger.error(f"Error scheduling reminder: {e}")
+    return scheduled
+
+def restore_reminders():
+    """
+    Put the stored reminders back into the dispatcher. Reminders that came
+    due while the bot was down are sent right away if they are less than
+    REMINDER_GRACE late; older ones are skipped (weekly ones move on to
+    their next start).
+    """
+    now = time.time()
+    restored = missed = 0
+    with reminder_store.batch():
+        for key, chat_id, text, fire_at, session in reminder_store.load():
+            if fire_at < now - config.REMINDER_GRACE:
+                missed += 1
+                if session is not None:
+                    restored += schedule_session(chat_id, session)
+                else:
+                    dispatcher.cancel(key)
+                continue
+            repeat = weekly_repeat(session) if session is not None and is_weekly(session) else None
+            dispatcher.schedule(key, chat_id, text, fire_at, repeat, data=session, persist=False)
+            restored += 1
+    if missed:
+        logger.warning(f"Skipped {missed} reminders more than {config.REMINDER_GRACE}s overdue")
+    return restored
+
+async def full_resync():
+    # Take the cursor first: changes made during the download are replayed
+    # by the next sync, and replaying is harmless.
+    head = await fetch_session_changes()
+    dispatcher.cancel_where(lambda reminder: reminder.key.startswith("session-"))
+    session_cache.clear()
+    scheduled = await load_all_reminders()
+    reminder_store.set_state('sync_cursor', head['next_cursor'])
+    return scheduled
+
+async def sync_reminders():
+    """Apply session changes since the last sync to the scheduled reminders."""
+    try:
+        cursor = reminder_store.get_state('sync_cursor')
+        if cursor is None:
+            # Nothing was ever loaded: there is nothing to apply changes to.
+            await full_resync()
+            return
+
+        while True:
+            page = await fetch_session_changes(cursor)
+            if page is None:
+                logger.warning("Change feed cursor expired, resyncing all reminders")
+                await full_resync()
+                return
+
+            # The page and the cursor after it are stored together.
+            with reminder_store.batch():
+                for change in page['changes']:
+                    try:
+                        if change['deleted']:
+                            unschedule_session(change['id'], change.get('user_id'))
+                        else:
+                            schedule_session(change['telegram_user_id'], change['session'])
+                    except Exception as e:
+                        logger.error(f"Error applying change for session {change['id']}: {e}")
+
+                cursor = page['next_cursor']
+                reminder_store.set_state('sync_cursor', cursor)
+            if not page['has_more']:
+                break
+    except httpx.HTTPError as e:
+        logger.error(f"Error syncing reminders: {e}")
+
+def unschedule_chat(chat_id):
+    forget_sessions(chat_id)
+    dispatcher.cancel_where(
+        lambda reminder: reminder.key.startswith("session-") and reminder.chat_id == str(chat_id)
+    )
 
-        for session in sessions:
+async def apply_events(app, events):
+    """
+    Apply a batch of outbox events pushed by the web app, in order. A bad
+    event is logged and skipped: failing the batch would make the web app
+    resend it forever and hold back every event behind it.
+    """
+    with reminder_store.batch():
+        for event in events:
             try:
-                session_datetime = datetime.strptime(
-                    f"{session['date']} {session['time']}",
-                    '%Y-%m-%d %H:%M:%S'
-                ).replace(tzinfo=config.TIMEZONE)
-
-                if session_datetime > datetime.now(config.TIMEZONE):
-                    message = (
-                        f"🔔 Напоминание: У вас тренировка "
-                        f"{session_datetime.strftime('%Y-%m-%d')} в "
-                        f"{session_datetime.strftime('%H:%M')}!"
-                    )
-
-                    scheduler.add_job(
-                        send_reminder,
-                        'date',
-                        run_date=session_datetime,
-                        args=[app, chat_id, message]
-                    )
-                    logger.info(f"Scheduled reminder for chat_id {chat_id}")
+                apply_event(event['topic'], event['payload'])
             except Exception as e:
-                logger.error(f"Error scheduling reminder: {e}")
+                logger.error(f"Error applying outbox event {event.get('id')}: {e}")
+
+def apply_event(topic, payload):
+    if topic == 'session.saved':
+        schedule_session(payload['telegram_user_id'], payload['session'])
+    elif topic == 'session.deleted':
+        unschedule_session(payload['id'], payload.get('user_id'))
+    elif topic == 'telegram.linked':
+        ChatIDManager.save_user_id(payload['telegram_user_id'], payload['user_id'])
+        for session in payload['sessions']:
+            schedule_session(payload['telegram_user_id'], session)
+    elif topic == 'telegram.unlinked':
+        unschedule_chat(payload['telegram_user_id'])
+    else:
+        logger.warning(f"Ignoring unknown outbox event {topic}")
+
+async def schedule_reminders(app):
+    # Changes made during the downtime are applied before the dispatcher
+    # starts, so a session moved or deleted meanwhile does not get its old
+    # reminder; an API that is slow to answer only holds this up for
+    # STARTUP_SYNC_TIMEOUT.
+    restored = restore_reminders()
+    try:
+        await asyncio.wait_for(sync_reminders(), config.STARTUP_SYNC_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Reminder sync took over {config.STARTUP_SYNC_TIMEOUT}s, starting with stored reminders")
+    dispatcher.start(lambda chat_id, text: app.bot.send_message(chat_id=chat_id, text=text))
+    logger.info(f"Reminder dispatcher started with {restored} stored reminders")
 
-    scheduler.start()
-    logger.info("Reminder scheduler started")
+    if not len(dispatcher):
+        logger.warning("No upcoming sessions found for reminders")
+    app.bot_data['sync_task'] = asyncio.create_task(sync_loop())
 
-async def send_reminder(app, chat_id, message):
-    try:
-        await app.bot.send_message(chat_id=chat_id, text=message)
-        logger.info(f"Reminder sent to {chat_id}")
-    except Exception as e:
-        logger.error(f"Error sending reminder: {e}")
+async def sync_loop():
+    while True:
+        await asyncio.sleep(config.SYNC_INTERVAL)
+        await sync_reminders()
 
 def get_keyboard():
     keyboard = [[KeyboardButton("📅 Получить календарь тренировок")]]
@@ -186,11 +445,9 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     linking_code = context.args[0]
     try:
-        response = requests.post(
-            f"{config.API_BASE_URL}/api/link-telegram/confirm/",
+        response = await api.post(
+            "/api/link-telegram/confirm/",
             json={'code': linking_code, 'telegram_user_id': str(chat_id)},
-            headers=config.HEADERS,
-            timeout=10
         )
 
         data = response.json()
@@ -203,9 +460,8 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     reply_markup=get_keyboard()
                 )
 
-                sessions = fetch_training_sessions(user_id)
+                sessions, message = await fetch_training_sessions(user_id)
                 if sessions:
-                    message = format_training_sessions(sessions)
                     await update.message.reply_text(message, parse_mode='Markdown')
         else:
             await update.message.reply_text(
@@ -230,12 +486,11 @@ async def handle_get_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
 
-    sessions = fetch_training_sessions(user_id)
+    sessions, message = await fetch_training_sessions(user_id)
     if not sessions:
         await update.message.reply_text("📅 У вас нет предстоящих тренировок.")
         return
 
-    message = format_training_sessions(sessions)
     await update.message.reply_text(message, parse_mode='Markdown')
 
 def format_training_sessions(sessions):
@@ -257,12 +512,99 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "⚠️ Произошла ошибка при обработке запроса. Пожалуйста, попробуйте позже."
         )
 
+async def post_init(application):
+    # Wait for API
+    for _ in range(30):
+        if await check_api_health():
+            logger.info("API is available")
+            break
+        logger.info("Waiting for API...")
+        await asyncio.sleep(2)
+    else:
+        raise RuntimeError("API is not available after maximum retries")
+
+    await schedule_reminders(application)
+
+    if config.EVENTS_ENABLED:
+        server = EventServer(
+            lambda events: apply_events(application, events),
+            token=config.OUTBOX_TOKEN,
+            host=config.EVENTS_HOST,
+            port=config.EVENTS_PORT,
+            path=config.EVENTS_SOCKET,
+        )
+        await server.start()
+        application.bot_data['event_server'] = server
+
+async def post_shutdown(application):
+    server = application.bot_data.get('event_server')
+    if server is not None:
+        await server.stop()
+    sync_task = application.bot_data.get('sync_task')
+    if sync_task is not None:
+        sync_task.cancel()
+    await dispatcher.stop()
+    await api.aclose()
+    chat_store.close()
+    reminder_store.close()
+
+async def run_webhook(application):
+    """
+    Serve updates from the webhook until SIGTERM / SIGINT. Shutting down
+    stops taking updates first, then lets the ones already queued or
+    being handled finish.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(
+        application,
+        urlsplit(config.WEBHOOK_URL).path or '/',
+        secret=config.WEBHOOK_SECRET,
+        host=config.WEBHOOK_HOST,
+        port=config.WEBHOOK_PORT,
+    )
+    await application.initialize()
+    try:
+        await post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"Webhook set to {config.WEBHOOK_URL}")
+        await stop.wait()
+        logger.info("Stopping webhook")
+    finally:
+        # The webhook stays registered: Telegram holds new updates until
+        # the bot is back.
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+
 def main():
-    application = (
+    # post_init runs on the bot's event loop, so the dispatcher and the
+    # pooled API client are bound to the same loop as the handlers.
+    builder = (
         Application.builder()
         .token(config.TOKEN)
-        .build()
+        .base_url(config.TELEGRAM_API_URL)
+        .concurrent_updates(config.UPDATE_CONCURRENCY)
+        # One connection per concurrent handler, plus room for reminders
+        .connection_pool_size(config.UPDATE_CONCURRENCY + config.REMINDER_CONCURRENCY)
+        .pool_timeout(config.API_TIMEOUT)
     )
+    if config.WEBHOOK_URL:
+        application = builder.updater(None).build()
+    else:
+        application = builder.post_init(post_init).post_shutdown(post_shutdown).build()
 
     application.add_handler(CommandHandler("start", handle_start))
     application.add_handler(MessageHandler(
@@ -271,22 +613,12 @@ def main():
     ))
     application.add_error_handler(error_handler)
 
-    # Wait for API
-    for _ in range(30):
-        if check_api_health():
-            logger.info("API is available")
-            break
-        logger.info("Waiting for API...")
-        import time
-        time.sleep(2)
+    if config.WEBHOOK_URL:
+        logger.info("Starting Telegram bot (webhook)")
+        asyncio.run(run_webhook(application))
     else:
-        logger.error("API is not available after maximum retries")
-        return
-
-    schedule_reminders(application)
-
-    logger.info("Starting Telegram bot")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info("Starting Telegram bot")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
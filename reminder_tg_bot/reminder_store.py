@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reminders (
+    key TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    fire_at REAL NOT NULL,
+    data TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class ReminderStore:
+    """
+    Scheduled reminders in SQLite (WAL mode), so they survive restarts.
+
+    A row is the next undelivered occurrence of a reminder: `fire_at` in
+    epoch seconds and `data`, the JSON the bot needs to rebuild it (the
+    session). The dispatcher rewrites or deletes a row only once that
+    occurrence has been sent, so a reminder that was due, or being sent,
+    when the bot stopped is still there on the next start. The `state`
+    table keeps small values such as the change feed cursor.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Autocommit mode; batch() opens a transaction explicitly.
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.depth = 0
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('PRAGMA busy_timeout=5000')
+            self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def batch(self):
+        """Group many writes into one transaction (and one fsync)."""
+        with self.lock:
+            self.depth += 1
+            if self.depth == 1:
+                self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self
+            except Exception:
+                if self.depth == 1:
+                    self.connection.execute('ROLLBACK')
+                raise
+            else:
+                if self.depth == 1:
+                    self.connection.execute('COMMIT')
+            finally:
+                self.depth -= 1
+
+    def load(self):
+        """Every stored reminder as (key, chat_id, text, fire_at, data), in one scan."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT key, chat_id, text, fire_at, data FROM reminders').fetchall()
+        return [(key, chat_id, text, fire_at, json.loads(data) if data else None)
+                for key, chat_id, text, fire_at, data in rows]
+
+    def save(self, key, chat_id, text, fire_at, data=None):
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO reminders (key, chat_id, text, fire_at, data) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET chat_id = excluded.chat_id, text = excluded.text, '
+                'fire_at = excluded.fire_at, data = excluded.data',
+                (key, str(chat_id), text, fire_at, json.dumps(data) if data is not None else None),
+            )
+
+    def delete(self, keys):
+        with self.batch():
+            self.connection.executemany('DELETE FROM reminders WHERE key = ?', [(key,) for key in keys])
+
+    def get_state(self, name):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name, value):
+        with self.lock:
+            if value is None:
+                self.connection.execute('DELETE FROM state WHERE name = ?', (name,))
+            else:
+                self.connection.execute(
+                    'INSERT INTO state (name, value) VALUES (?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET value = excluded.value',
+                    (name, value),
+                )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
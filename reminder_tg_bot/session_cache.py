@@ -0,0 +1,73 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    An in-process LRU cache whose entries expire `ttl` seconds after
+    they were stored. It holds at most `maxsize` entries.
+
+    get_or_fetch() is single-flight: concurrent misses for one key share
+    a single `fetch()`. invalidate() also detaches a fetch that is still
+    running, so its (possibly stale) result is returned to its waiters
+    but not stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return MISSING
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self.data[key]
+            return MISSING
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.data.pop(key, None)
+        self.inflight.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+        self.inflight.clear()
+
+    async def get_or_fetch(self, key, fetch):
+        value = self.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self.fill(key, fetch))
+        # One waiter giving up must not cancel the fetch for the others.
+        return await asyncio.shield(task)
+
+    async def fill(self, key, fetch):
+        task = asyncio.current_task()
+        try:
+            value = await fetch()
+            if self.inflight.get(key) is task:
+                self.set(key, value)
+            return value
+        finally:
+            if self.inflight.get(key) is task:
+                del self.inflight[key]
@@ -0,0 +1,623 @@
+"""
+Tests of the reminder bot's building blocks.
+
+Run from this directory: python -m unittest tests
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+from telegram.error import RetryAfter
+
+# reminder_bot reads its configuration on import.
+DATA_DIR = tempfile.TemporaryDirectory()
+os.environ.update({
+    'TELEGRAM_BOT_TOKEN': 'test-token',
+    'BOT_API_KEY': 'test-key',
+    'API_BASE_URL': 'http://127.0.0.1:9',
+    'CHAT_IDS_FILE': os.path.join(DATA_DIR.name, 'chat_ids.json'),
+    'CHAT_DB_FILE': os.path.join(DATA_DIR.name, 'chats.sqlite3'),
+    'REMINDER_DB_FILE': os.path.join(DATA_DIR.name, 'reminders.sqlite3'),
+    'EVENTS_PORT': '0',
+})
+
+import reminder_bot
+from api_client import ApiClient
+from bench_webhook import TOKEN, start_bot
+from chat_store import ChatStore
+from dispatcher import ReminderDispatcher
+from event_server import EventServer
+from fake_telegram import FakeTelegram
+from reminder_store import ReminderStore
+from session_cache import MISSING, TTLCache
+
+
+class ApiClientTests(unittest.IsolatedAsyncioTestCase):
+    def make_client(self, retries, statuses):
+        self.requests = 0
+
+        def handler(request):
+            self.requests += 1
+            status = statuses.pop(0) if statuses else 200
+            if status is None:
+                raise httpx.ConnectError('refused', request=request)
+            return httpx.Response(status)
+
+        api = ApiClient('http://api', {}, retries=retries, backoff_base=0.001)
+        api._client = httpx.AsyncClient(base_url='http://api', transport=httpx.MockTransport(handler))
+        self.addAsyncCleanup(api.aclose)
+        return api
+
+    async def test_no_retries_sends_once(self):
+        api = self.make_client(0, [503])
+        self.assertEqual((await api.get('/x')).status_code, 503)
+        self.assertEqual(self.requests, 1)
+
+        api = self.make_client(0, [None])
+        with self.assertRaises(httpx.ConnectError):
+            await api.get('/x')
+        self.assertEqual(self.requests, 1)
+
+    async def test_retries_are_extra_attempts(self):
+        api = self.make_client(2, [503, None, 503, 200])
+        self.assertEqual((await api.get('/x')).status_code, 503)
+        self.assertEqual(self.requests, 3)
+
+        api = self.make_client(2, [503, None])
+        self.assertEqual((await api.get('/x')).status_code, 200)
+        self.assertEqual(self.requests, 3)
+
+    async def test_sent_posts_are_not_retried(self):
+        api = self.make_client(2, [503])
+        self.assertEqual((await api.post('/x')).status_code, 503)
+        self.assertEqual(self.requests, 1)
+
+
+class ChatStoreTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = os.path.join(directory.name, 'chats.sqlite3')
+        self.legacy = os.path.join(directory.name, 'chat_ids.json')
+
+    def open_store(self):
+        store = ChatStore(self.db, legacy_json=self.legacy)
+        self.addCleanup(store.close)
+        return store
+
+    def write_legacy(self, content):
+        with open(self.legacy, 'w') as f:
+            f.write(content if isinstance(content, str) else json.dumps(content))
+
+    def test_legacy_file_is_imported_once(self):
+        self.write_legacy({'100': 1, '200': '2', '300': None})
+        store = self.open_store()
+        self.assertEqual(store.get_all_mappings(), {'100': 1, '200': 2})
+        self.assertFalse(os.path.exists(self.legacy))
+        self.assertTrue(os.path.exists(self.legacy + '.migrated'))
+
+        store.save_user_id(100, 5)
+        # A file showing up again does not override newer mappings.
+        self.write_legacy({'100': 1, '400': 4})
+        self.assertEqual(self.open_store().get_all_mappings(), {'100': 5, '200': 2, '400': 4})
+
+    def test_bad_rows_are_skipped(self):
+        self.write_legacy({'100': 1, '200': 'abc', '300': [3], '400': 4})
+        with self.assertLogs('chat_store', 'WARNING') as logs:
+            store = self.open_store()
+        self.assertEqual(store.get_all_mappings(), {'100': 1, '400': 4})
+        self.assertEqual(len(logs.records), 2)
+        self.assertTrue(os.path.exists(self.legacy + '.migrated'))
+
+    def test_unreadable_file_is_left_alone(self):
+        for content in ['{not json', '[1, 2]']:
+            self.write_legacy(content)
+            with self.assertLogs('chat_store', 'ERROR'):
+                store = self.open_store()
+            self.assertEqual(store.get_all_mappings(), {})
+            self.assertTrue(os.path.exists(self.legacy))
+
+
+class ReminderDispatcherTests(unittest.IsolatedAsyncioTestCase):
+    def make_dispatcher(self, **kwargs):
+        kwargs.setdefault('metrics_interval', 0)
+        dispatcher = ReminderDispatcher(**kwargs)
+        self.sent = []
+        dispatcher.start(self.send)
+        self.addAsyncCleanup(dispatcher.stop)
+        return dispatcher
+
+    async def send(self, chat_id, text):
+        self.sent.append((time.monotonic(), chat_id, text))
+
+    async def wait_for_sends(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.sent) < count:
+            self.assertLess(time.monotonic(), deadline, f"only {len(self.sent)} of {count} sent")
+            await asyncio.sleep(0.01)
+
+    def gaps(self):
+        times = [sent_at for sent_at, _, _ in self.sent]
+        return [later - earlier for earlier, later in zip(times, times[1:])]
+
+    async def test_sends_are_paced_by_the_rate(self):
+        dispatcher = self.make_dispatcher(rate=20, burst=1, chat_interval=0)
+        now = time.time()
+        for chat in range(5):
+            dispatcher.schedule(f'r{chat}', str(chat), 'hi', now)
+        await self.wait_for_sends(5)
+        self.assertEqual(sorted(chat for _, chat, _ in self.sent), ['0', '1', '2', '3', '4'])
+        self.assertTrue(all(gap >= 0.045 for gap in self.gaps()), self.gaps())
+        self.assertEqual(dispatcher.sent, 5)
+        self.assertEqual(len(dispatcher), 0)
+
+    async def test_burst_goes_out_at_once(self):
+        dispatcher = self.make_dispatcher(rate=1, burst=3, chat_interval=0)
+        now = time.time()
+        for chat in range(3):
+            dispatcher.schedule(f'r{chat}', str(chat), 'hi', now)
+        await self.wait_for_sends(3)
+        self.assertLess(self.sent[-1][0] - self.sent[0][0], 0.5)
+
+    async def test_one_chat_is_spaced_out(self):
+        dispatcher = self.make_dispatcher(rate=1000, burst=1000, chat_interval=0.2)
+        now = time.time()
+        for number in range(3):
+            dispatcher.schedule(f'r{number}', '1', f'hi {number}', now)
+        dispatcher.schedule('other', '2', 'hi', now)
+        await self.wait_for_sends(4)
+        to_chat = [sent_at for sent_at, chat, _ in self.sent if chat == '1']
+        self.assertTrue(all(later - earlier >= 0.19 for earlier, later in zip(to_chat, to_chat[1:])))
+        # The other chat does not wait behind the busy one.
+        self.assertEqual(self.sent[1][1], '2')
+
+    async def test_flood_limit_is_retried(self):
+        dispatcher = self.make_dispatcher(rate=1000, burst=1000, chat_interval=0, retries=2)
+        attempts = []
+
+        async def send(chat_id, text):
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.2)
+            self.sent.append((time.monotonic(), chat_id, text))
+
+        dispatcher.send = send
+        dispatcher.schedule('r', '1', 'hi', time.time())
+        await self.wait_for_sends(1)
+        self.assertEqual(len(attempts), 2)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.19)
+        self.assertEqual((dispatcher.sent, dispatcher.retried, dispatcher.failed), (1, 1, 0))
+
+    async def test_gives_up_after_retries(self):
+        dispatcher = self.make_dispatcher(rate=1000, burst=1000, chat_interval=0, retries=1)
+
+        async def send(chat_id, text):
+            raise RetryAfter(0.01)
+
+        dispatcher.send = send
+        dispatcher.schedule('r', '1', 'hi', time.time())
+        await asyncio.sleep(0.2)
+        self.assertEqual((dispatcher.sent, dispatcher.retried, dispatcher.failed), (0, 1, 1))
+
+    async def test_stale_entries_are_skipped(self):
+        dispatcher = self.make_dispatcher(rate=1000, burst=1000, chat_interval=0)
+        now = time.time()
+        dispatcher.schedule('moved', '1', 'old', now + 0.05)
+        dispatcher.schedule('moved', '1', 'new', now + 0.2)
+        dispatcher.schedule('cancelled', '2', 'hi', now + 0.05)
+        dispatcher.cancel('cancelled')
+        dispatcher.schedule('gone', '3', 'hi', now + 0.05)
+        dispatcher.cancel_where(lambda reminder: reminder.chat_id == '3')
+
+        await asyncio.sleep(0.12)
+        self.assertEqual(self.sent, [])
+        await self.wait_for_sends(1)
+        await asyncio.sleep(0.1)
+        self.assertEqual([(chat, text) for _, chat, text in self.sent], [('1', 'new')])
+
+    async def test_repeat_reschedules(self):
+        dispatcher = self.make_dispatcher(rate=1000, burst=1000, chat_interval=0)
+        fired = []
+
+        def repeat(fire_at):
+            fired.append(fire_at)
+            return fire_at + 0.05 if len(fired) < 3 else None
+
+        dispatcher.schedule('weekly', '1', 'hi', time.time(), repeat)
+        await self.wait_for_sends(3)
+        self.assertNotIn('weekly', dispatcher)
+
+    async def test_dead_heap_entries_are_pruned(self):
+        dispatcher = self.make_dispatcher()
+        later = time.time() + 3600
+        for _ in range(10):
+            for number in range(100):
+                dispatcher.schedule(f'r{number}', '1', 'hi', later + number)
+            dispatcher.cancel_where(lambda reminder: True)
+        for number in range(100):
+            dispatcher.schedule(f'r{number}', '1', 'hi', later + number)
+        self.assertEqual(len(dispatcher), 100)
+        self.assertLessEqual(len(dispatcher.heap), 2 * 100 + dispatcher.MIN_PRUNE)
+
+        for number in range(100):
+            dispatcher.cancel(f'r{number}')
+        self.assertLessEqual(len(dispatcher.heap), dispatcher.MIN_PRUNE)
+
+
+class StoreTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'reminders.sqlite3')
+        self.store = self.open_store()
+
+    def open_store(self):
+        store = ReminderStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def make_dispatcher(self, send=None):
+        dispatcher = ReminderDispatcher(store=self.store, chat_interval=0, metrics_interval=0)
+        if send is not None:
+            dispatcher.start(send)
+        self.addAsyncCleanup(dispatcher.stop)
+        return dispatcher
+
+
+class ReminderStoreTests(StoreTestCase):
+    async def test_reminders_survive_a_restart(self):
+        dispatcher = self.make_dispatcher()
+        later = time.time() + 3600
+        dispatcher.schedule('session-1', 100, 'one', later, data={'id': 1})
+        dispatcher.schedule('session-2', 200, 'two', later + 1)
+        dispatcher.schedule('session-2', 200, 'moved', later + 2)
+        dispatcher.schedule('session-3', 300, 'gone', later)
+        dispatcher.cancel('session-3')
+        self.store.set_state('sync_cursor', 'abc')
+        # The process dies here: nothing else is written.
+
+        reopened = self.open_store()
+        self.assertEqual(sorted(reopened.load()), [
+            ('session-1', '100', 'one', later, {'id': 1}),
+            ('session-2', '200', 'moved', later + 2, None),
+        ])
+        self.assertEqual(reopened.get_state('sync_cursor'), 'abc')
+
+    async def test_occurrence_stays_stored_until_sent(self):
+        release = asyncio.Event()
+        sent = []
+
+        async def send(chat_id, text):
+            await release.wait()
+            sent.append(text)
+
+        dispatcher = self.make_dispatcher(send)
+        due = time.time()
+        dispatcher.schedule('weekly', '1', 'hi', due, repeat=lambda fire_at: fire_at + 3600)
+        while not dispatcher.sending:
+            await asyncio.sleep(0.01)
+        # A crash now must not lose the occurrence being sent.
+        self.assertEqual([row[3] for row in self.open_store().load()], [due])
+
+        release.set()
+        while dispatcher.sending:
+            await asyncio.sleep(0.01)
+        self.assertEqual(sent, ['hi'])
+        self.assertEqual([row[3] for row in self.open_store().load()], [due + 3600])
+
+    async def test_batch_rolls_back(self):
+        with self.assertRaises(RuntimeError), self.store.batch():
+            self.store.save('session-1', 1, 'hi', time.time())
+            raise RuntimeError
+        self.assertEqual(self.store.load(), [])
+
+
+def session(session_id, start, weekly=False):
+    """A session as the API returns it, starting at the aware datetime `start`."""
+    local = start.astimezone(reminder_bot.config.TIMEZONE)
+    return {
+        'id': session_id,
+        'date': local.strftime('%Y-%m-%d'),
+        'time': local.strftime('%H:%M:%S'),
+        'recurrence': 'weekly' if weekly else None,
+        'weekdays': list(range(7)) if weekly else [],
+    }
+
+
+class BotTestCase(StoreTestCase):
+    """Runs reminder_bot against a fresh store and dispatcher."""
+
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = self.make_dispatcher()
+        for name, value in [('reminder_store', self.store), ('dispatcher', self.dispatcher)]:
+            patcher = mock.patch.object(reminder_bot, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.now = datetime.now(reminder_bot.config.TIMEZONE).replace(microsecond=0)
+
+    def store_reminder(self, key, fire_at, data):
+        self.store.save(key, '100', f'reminder {key}', fire_at.timestamp(), data)
+
+
+class RestoreRemindersTests(BotTestCase):
+    async def test_grace_window(self):
+        late = self.now - timedelta(minutes=10)
+        self.store_reminder('session-1', late, session(1, late))
+        missed = self.now - timedelta(hours=2)
+        self.store_reminder('session-2', missed, session(2, missed))
+
+        with mock.patch.object(reminder_bot.config, 'REMINDER_GRACE', 3600):
+            self.assertEqual(reminder_bot.restore_reminders(), 1)
+        self.assertEqual(self.dispatcher.get('session-1').fire_at, late.timestamp())
+        self.assertNotIn('session-2', self.dispatcher)
+        self.assertEqual([row[0] for row in self.store.load()], ['session-1'])
+
+    async def test_missed_weekly_reminder_moves_to_next_start(self):
+        missed = self.now - timedelta(hours=2)
+        self.store_reminder('session-3', missed, session(3, missed - timedelta(days=14), weekly=True))
+
+        with mock.patch.object(reminder_bot.config, 'REMINDER_GRACE', 3600):
+            self.assertEqual(reminder_bot.restore_reminders(), 1)
+        fire_at = self.dispatcher.get('session-3').fire_at
+        self.assertGreater(fire_at, self.now.timestamp())
+        self.assertLessEqual(fire_at, (missed + timedelta(days=1)).timestamp())
+        self.assertEqual([row[3] for row in self.store.load()], [fire_at])
+        # Every weekday matches, so the one after comes a day later.
+        self.assertEqual(self.dispatcher.get('session-3').repeat(fire_at), fire_at + 24 * 3600)
+
+
+class ScheduleRemindersTests(BotTestCase):
+    async def start_bot(self):
+        app = SimpleNamespace(bot=mock.Mock(send_message=mock.AsyncMock()), bot_data={})
+        await reminder_bot.schedule_reminders(app)
+        app.bot_data['sync_task'].cancel()
+        await asyncio.sleep(0.1)
+        return app.bot.send_message
+
+    async def test_changes_apply_before_sending(self):
+        late = self.now - timedelta(minutes=10)
+        self.store_reminder('session-1', late, session(1, late))
+
+        async def sync():
+            # The session was deleted while the bot was down.
+            reminder_bot.unschedule_session(1)
+
+        with mock.patch.object(reminder_bot, 'sync_reminders', sync):
+            send_message = await self.start_bot()
+        send_message.assert_not_called()
+        self.assertEqual(self.store.load(), [])
+
+    async def test_slow_sync_does_not_hold_reminders(self):
+        late = self.now - timedelta(minutes=10)
+        self.store_reminder('session-1', late, session(1, late))
+
+        with mock.patch.object(reminder_bot, 'sync_reminders', lambda: asyncio.sleep(60)), \
+                mock.patch.object(reminder_bot.config, 'STARTUP_SYNC_TIMEOUT', 0.05):
+            send_message = await self.start_bot()
+        send_message.assert_awaited_once_with(chat_id='100', text='reminder session-1')
+
+
+class UnscheduleSessionTests(BotTestCase):
+    def setUp(self):
+        super().setUp()
+        reminder_bot.session_cache.clear()
+        for user_id in (1, 2):
+            reminder_bot.session_cache.set(user_id, ([{'id': user_id}], 'cached'))
+
+    def cached(self):
+        return {user_id for user_id in (1, 2) if reminder_bot.session_cache.get(user_id) is not MISSING}
+
+    async def test_owner_from_the_event(self):
+        reminder_bot.unschedule_session(10, user_id=1)
+        self.assertEqual(self.cached(), {2})
+
+    async def test_owner_from_the_reminder(self):
+        reminder_bot.chat_store.save_user_id('100', 1)
+        self.addCleanup(reminder_bot.chat_store.connection.execute, 'DELETE FROM chats')
+        reminder_bot.schedule_session('100', session(10, self.now + timedelta(days=1)))
+        reminder_bot.session_cache.set(1, ([{'id': 10}], 'cached'))
+
+        reminder_bot.unschedule_session(10)
+        self.assertNotIn('session-10', self.dispatcher)
+        self.assertEqual(self.cached(), {2})
+
+    async def test_unknown_owner_drops_every_list(self):
+        # A past session: no reminder left to tell whose it was.
+        with mock.patch.object(reminder_bot.ChatIDManager, 'get_user_id') as get_user_id:
+            reminder_bot.unschedule_session(10)
+        get_user_id.assert_not_called()
+        self.assertEqual(self.cached(), set())
+
+
+class FullResyncTests(BotTestCase):
+    async def test_no_chat_lookups(self):
+        start = self.now + timedelta(days=1)
+
+        async def linked_sessions():
+            for user in range(3):
+                yield {'telegram_user_id': str(100 + user),
+                       'sessions': [session(user * 10 + number, start) for number in range(10)]}
+
+        async def changes(cursor=None):
+            return {'changes': [], 'next_cursor': '5-0', 'has_more': False}
+
+        reminder_bot.session_cache.set(1, ([], None))
+        with mock.patch.object(reminder_bot, 'fetch_linked_sessions', linked_sessions), \
+                mock.patch.object(reminder_bot, 'fetch_session_changes', changes), \
+                mock.patch.object(reminder_bot.ChatIDManager, 'get_user_id') as get_user_id:
+            self.assertEqual(await reminder_bot.full_resync(), 30)
+        get_user_id.assert_not_called()
+        self.assertIs(reminder_bot.session_cache.get(1), MISSING)
+        self.assertEqual(len(self.store.load()), 30)
+        self.assertEqual(self.store.get_state('sync_cursor'), '5-0')
+
+
+class TTLCacheTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def fetch(self):
+        self.calls += 1
+        number = self.calls
+        await self.release.wait()
+        return f'value {number}'
+
+    async def test_concurrent_misses_share_one_fetch(self):
+        cache = TTLCache()
+        waiters = [asyncio.create_task(cache.get_or_fetch('key', self.fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        self.release.set()
+        self.assertEqual(await asyncio.gather(*waiters), ['value 1'] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(await cache.get_or_fetch('key', self.fetch), 'value 1')
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+
+    async def test_cancelled_waiter_does_not_cancel_the_fetch(self):
+        cache = TTLCache()
+        first = asyncio.create_task(cache.get_or_fetch('key', self.fetch))
+        second = asyncio.create_task(cache.get_or_fetch('key', self.fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.release.set()
+        self.assertEqual(await second, 'value 1')
+        self.assertEqual(cache.get('key'), 'value 1')
+
+    async def test_invalidate_detaches_the_running_fetch(self):
+        cache = TTLCache()
+        stale = asyncio.create_task(cache.get_or_fetch('key', self.fetch))
+        await asyncio.sleep(0)
+        cache.invalidate('key')
+        fresh = asyncio.create_task(cache.get_or_fetch('key', self.fetch))
+        await asyncio.sleep(0)
+        self.release.set()
+        # Waiters of the old fetch still get its result, but it is not stored.
+        self.assertEqual(await stale, 'value 1')
+        self.assertEqual(await fresh, 'value 2')
+        self.assertEqual(cache.get('key'), 'value 2')
+        self.assertEqual(cache.inflight, {})
+
+    async def test_entries_expire(self):
+        cache = TTLCache(ttl=60)
+        with mock.patch('session_cache.time.monotonic', return_value=1000):
+            cache.set('key', 'value')
+        with mock.patch('session_cache.time.monotonic', return_value=1059):
+            self.assertEqual(cache.get('key'), 'value')
+        with mock.patch('session_cache.time.monotonic', return_value=1060):
+            self.assertIs(cache.get('key'), MISSING)
+        self.assertEqual(len(cache.data), 0)
+
+    async def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+    async def test_failed_fetch_is_not_stored(self):
+        cache = TTLCache()
+
+        async def fail():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            await cache.get_or_fetch('key', fail)
+        self.assertIs(cache.get('key'), MISSING)
+        self.assertEqual(cache.inflight, {})
+
+
+class EventServerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_events_need_the_token(self):
+        received = []
+
+        async def handler(events):
+            received.extend(events)
+
+        server = EventServer(handler, token='secret', host='127.0.0.1', port=0)
+        await server.start()
+        self.addAsyncCleanup(server.stop)
+        batch = {'events': [{'id': 1, 'topic': 'session.deleted', 'payload': {'id': 1}}]}
+        async with httpx.AsyncClient() as client:
+            url = f'http://{server.address}/events'
+            self.assertEqual((await client.post(url, json=batch)).status_code, 401)
+            response = await client.post(url, json=batch, headers={'X-Outbox-Token': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(received, [])
+            response = await client.post(url, json=batch, headers={'X-Outbox-Token': 'secret'})
+            self.assertEqual(response.status_code, 204)
+        self.assertEqual(received, batch['events'])
+
+    def test_token_is_required(self):
+        for token in (None, ''):
+            with self.assertRaises(ValueError):
+                EventServer(lambda events: None, token=token)
+
+    def test_bot_refuses_events_without_token(self):
+        with mock.patch.dict(os.environ, {'EVENTS_PORT': '8081', 'OUTBOX_TOKEN': ''}):
+            with self.assertRaises(ValueError):
+                reminder_bot.BotConfig()
+        with mock.patch.dict(os.environ, {'EVENTS_PORT': '0', 'OUTBOX_TOKEN': ''}):
+            self.assertFalse(reminder_bot.BotConfig().EVENTS_ENABLED)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class WebhookEndToEndTests(unittest.IsolatedAsyncioTestCase):
+    """reminder_bot.py in webhook mode, run as a process against FakeTelegram."""
+
+    async def asyncSetUp(self):
+        self.fake = FakeTelegram(TOKEN)
+        await self.fake.start()
+        self.addAsyncCleanup(self.fake.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data_dir = directory.name
+
+    async def test_updates_are_answered(self):
+        bot = await start_bot(self.fake, free_port(), self.data_dir)
+        try:
+            await asyncio.wait_for(self.fake.webhook_set.wait(), 30)
+            url, secret = self.fake.webhook
+            self.assertEqual(secret, 'bench-secret')
+
+            replies = [self.fake.wait_for_message(1000 + number) for number in range(5)]
+            statuses = await asyncio.gather(*(
+                self.fake.push(self.fake.text_update(1000 + number, '/start')) for number in range(5)))
+            self.assertEqual(statuses, [200] * 5)
+            await asyncio.wait_for(asyncio.gather(*replies), 30)
+            self.assertEqual(sorted(chat for chat, _, _ in self.fake.messages), list(range(1000, 1005)))
+
+            response = await self.fake.client.post(
+                url, json=self.fake.text_update(2000, '/start'),
+                headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+        finally:
+            bot.send_signal(signal.SIGTERM)
+            code = await asyncio.wait_for(bot.wait(), 30)
+        self.assertEqual(code, 0)
+        self.assertNotIn(2000, [chat for chat, _, _ in self.fake.messages])
+
+    async def test_refuses_to_start_without_secret(self):
+        bot = await start_bot(self.fake, free_port(), self.data_dir, WEBHOOK_SECRET='')
+        self.assertNotEqual(await asyncio.wait_for(bot.wait(), 30), 0)
+        self.assertIsNone(self.fake.webhook)
+
+
+if __name__ == '__main__':
+    unittest.main()
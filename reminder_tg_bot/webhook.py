@@ -0,0 +1,44 @@
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer(HttpServer):
+    """
+    Receives Telegram updates on `POST <url_path>` and puts them on the
+    application's update queue. The application processes them
+    concurrently, up to its `concurrent_updates` limit.
+
+    Telegram sends the webhook's secret token in a header; requests
+    without it are refused. While the application is shutting down,
+    updates are refused with 503. Telegram keeps them and sends them
+    again later.
+    """
+
+    def __init__(self, application, url_path, secret=None, host='0.0.0.0', port=8443, path=None):
+        super().__init__(host=host, port=port, path=path)
+        self.application = application
+        self.url_path = url_path
+        self.secret = secret
+
+    async def dispatch(self, method, target, headers, body):
+        if method != 'POST' or target.split('?')[0] != self.url_path:
+            return 404
+        if self.secret and not hmac.compare_digest(
+                headers.get('x-telegram-bot-api-secret-token', ''), self.secret):
+            return 401
+        if not self.application.running:
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed webhook update")
+            return 400
+        await self.application.update_queue.put(update)
+        return 200